@@ -5,6 +5,7 @@ from datetime import timedelta
 from config import Config
 import os
 from extensions import csrf
+from models.database import init_app as init_db
 from werkzeug.middleware.proxy_fix import ProxyFix
 
 def create_app():
@@ -33,6 +34,7 @@ def create_app():
     app.register_blueprint(api_bp)
 
     csrf.init_app(app=app)
+    init_db(app)
 
     return app
 
@@ -0,0 +1,17 @@
+# gunicorn.conf.py
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("GUNICORN_WORKERS", 4))
+worker_class = "sync"
+timeout = 120
+
+# master 预先导入应用，worker 通过 fork 共享已导入模块的内存（写时复制）
+# 数据库连接池按进程延迟创建，master 不持有连接
+preload_app = True
+
+
+def post_fork(server, worker):
+    # 丢弃可能从 master 继承的连接池，worker 首次访问数据库时重建
+    from models.database import reset_after_fork
+    reset_after_fork()
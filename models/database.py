@@ -1,16 +1,47 @@
 # models/database.py
 
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
 import psycopg2.pool
+import collections
+import functools
+import itertools
 import logging
+import os
+import random
+import re
 import threading
+import time
 import uuid
 from contextlib import contextmanager
 from config import Config
+from models import slow_query_log
+from utils.metrics import Counter, Histogram
 
 logger = logging.getLogger(__name__)
 
+POOL_CHECKOUT_WAIT = Histogram(
+    'teealloy_db_pool_checkout_wait_seconds',
+    'Time spent waiting for a pooled connection',
+    labelnames=('pool',),
+)
+DB_RETRIES = Counter(
+    'teealloy_db_retries_total',
+    'Retries of transient database errors by function and reason',
+    labelnames=('function', 'reason'),
+)
+DB_RETRIES_EXHAUSTED = Counter(
+    'teealloy_db_retries_exhausted_total',
+    'Transient database errors that still failed after all retries',
+    labelnames=('function',),
+)
+DB_TRANSACTIONS = Counter(
+    'teealloy_db_transactions_total',
+    'Transactions finished by get_db_cursor, by outcome (commit/rollback/readonly)',
+    labelnames=('outcome',),
+)
+
 # === 线程局部存储：唯一的数据持有者 ===
 _tls = threading.local()
 
@@ -21,6 +52,8 @@ def set_connection_context(conn, is_pooled=True):
     if not is_pooled:
         cid += "-tmp"
 
+    if isinstance(conn, PooledConnection):
+        conn.connection_id = cid
     _tls.current_conn = conn
     _tls.connection_id = cid
     _tls.is_pooled = is_pooled
@@ -48,30 +81,530 @@ def _cleanup_tls():
             delattr(_tls, attr)
 
 
-# === 连接池初始化 ===
-db_pool = None
+# === 会话状态跟踪 ===
+
+# 会改变会话级状态、需要在归还前 RESET ALL 的语句（SET LOCAL / SET TRANSACTION 只作用于当前事务）
+_SESSION_STATE_RE = re.compile(
+    r"^\s*(RESET\b|SET\s+(?!LOCAL\b|TRANSACTION\b|CONSTRAINTS\b))|set_config\s*\(",
+    re.IGNORECASE,
+)
+
+
+class TrackingCursorMixin:
+    """
+    游标公共行为：记录连接的会话状态是否被修改过，
+    并在开启慢查询日志（DB_SLOW_QUERY_MS > 0）时对每次 execute 计时
+    """
+    # 由 PreparedStatement 在执行前设置：(语句名, 原始 SQL, 参数)，用于慢查询日志
+    statement = None
+
+    def execute(self, query, vars=None):
+        if isinstance(query, str) and _SESSION_STATE_RE.search(query):
+            self.connection.session_dirty = True
+
+        statement, self.statement = self.statement, None
+        if not slow_query_log.is_enabled():
+            return super().execute(query, vars)
+
+        started = time.perf_counter()
+        try:
+            result = super().execute(query, vars)
+        except Exception as e:
+            elapsed = time.perf_counter() - started
+            if elapsed >= slow_query_log.threshold_seconds():
+                self._record_slow_query(statement, query, vars, elapsed, error=str(e))
+            raise
+
+        elapsed = time.perf_counter() - started
+        if elapsed >= slow_query_log.threshold_seconds():
+            self._record_slow_query(statement, query, vars, elapsed)
+        return result
+
+    def _record_slow_query(self, statement, query, vars, elapsed, error=None):
+        if statement is not None:
+            name, sql, params = statement
+        else:
+            name, sql, params = slow_query_log.default_statement_name(query), query, vars
+
+        plan = None
+        if error is None and slow_query_log.should_explain(sql):
+            plan = slow_query_log.explain(self.connection, sql, params)
+
+        pool = getattr(self.connection, 'pool', None)
+        slow_query_log.record(
+            name, sql, params, elapsed,
+            connection_id=getattr(self.connection, 'connection_id', None) or get_connection_id(),
+            pool=pool.name if pool is not None else None,
+            plan=plan,
+            error=error,
+        )
+
+
+class TrackingCursor(TrackingCursorMixin, psycopg2.extras.RealDictCursor):
+    """默认游标：每行是一个 RealDictRow"""
+
+
+# === 紧凑行 ===
+# 热路径查询可以用 get_db_cursor(compact=True) 取回 CompactRow：基于 namedtuple（__slots__ 为空，
+# 没有逐行的 dict），同时支持 row['col'] / row.col / row.get() / dict(row)，调用方代码无需改动。
+# 行只读：需要附加字段时应在 SQL 里查出来。
+
+_row_types = {}
+_row_types_lock = threading.Lock()
+
+
+def compact_row_type(names):
+    """按列名元组取得（并缓存）对应的紧凑行类型"""
+    names = tuple(names)
+    row_type = _row_types.get(names)
+    if row_type is not None:
+        return row_type
+
+    with _row_types_lock:
+        row_type = _row_types.get(names)
+        if row_type is None:
+            base = collections.namedtuple('CompactRow', names, rename=True)
+            index = {name: i for i, name in enumerate(names)}
+
+            def __getitem__(self, key, _index=index, _getitem=tuple.__getitem__):
+                if isinstance(key, str):
+                    return _getitem(self, _index[key])
+                return _getitem(self, key)
+
+            def get(self, key, default=None, _index=index, _getitem=tuple.__getitem__):
+                i = _index.get(key)
+                return default if i is None else _getitem(self, i)
+
+            def keys(self, _names=names):
+                return _names
+
+            row_type = type('CompactRow', (base,), {
+                '__slots__': (),
+                '__getitem__': __getitem__,
+                '__contains__': lambda self, key, _index=index: key in _index,
+                'get': get,
+                'keys': keys,
+            })
+            _row_types[names] = row_type
+    return row_type
+
+
+class CompactCursor(TrackingCursorMixin, psycopg2.extensions.cursor):
+    """返回 CompactRow 的游标"""
+    _row_type = None
+
+    def execute(self, query, vars=None):
+        self._row_type = None
+        return super().execute(query, vars)
+
+    def _make_row_type(self):
+        if self._row_type is None:
+            self._row_type = compact_row_type(col[0] for col in self.description)
+        return self._row_type
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is None:
+            return None
+        return tuple.__new__(self._make_row_type(), row)
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(size) if size is not None else super().fetchmany()
+        row_type = self._make_row_type() if rows else None
+        return [tuple.__new__(row_type, row) for row in rows]
+
+    def fetchall(self):
+        rows = super().fetchall()
+        row_type = self._make_row_type() if rows else None
+        return [tuple.__new__(row_type, row) for row in rows]
+
+    def __iter__(self):
+        first = True
+        for row in super().__iter__():
+            if first:
+                row_type = self._make_row_type()
+                first = False
+            yield tuple.__new__(row_type, row)
+
+
+# === 连接池 ===
+
+class PoolExhaustedError(psycopg2.pool.PoolError):
+    """连接池已满，且在等待超时内没有连接被归还"""
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """
+    携带池元数据的连接：所属连接池、连接 ID、创建时间与最近归还时间
+    元数据挂在连接对象本身，嵌套的 get_db_cursor 不会互相覆盖
+    """
+    pool = None
+    connection_id = 'unknown'
+    created_at = 0.0
+    returned_at = 0.0
+    session_dirty = False
+    prepared_statements = None  # 本连接上已 PREPARE 的语句名（见 models/statements.py）
+    commit_callbacks = None     # 当前事务提交后要执行的回调（见 after_commit）
+
+    def commit(self):
+        super().commit()
+        # 在主库上提交过（无论经 get_db_cursor 还是直接 get_db）之后，本请求的只读查询固定走主库
+        if self.pool is not None and self.pool.name == 'primary' and Config.DATABASE_REPLICA_URLS:
+            _pin_primary()
+
+
+class BoundedConnectionPool:
+    """
+    线程安全的有界连接池
+    - 连接总数不超过 maxconn；池满时调用方在等待队列中最多等待 timeout 秒，超时抛出 PoolExhaustedError
+    - 存活超过 max_lifetime 秒的连接在借出/归还时关闭重建
+    - 超过 minconn 的部分空闲超过 max_idle 秒后被回收
+    """
+
+    def __init__(self, dsn, minconn, maxconn, timeout, max_lifetime, max_idle, name='primary', **connect_kwargs):
+        if maxconn < 1 or minconn < 0 or minconn > maxconn:
+            raise ValueError("invalid pool size")
+        self.dsn = dsn
+        self.name = name
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self._connect_kwargs = connect_kwargs
+
+        self._cond = threading.Condition()
+        self._idle = collections.deque()  # 后进先出，尽量复用热连接
+        self._size = 0                    # 已打开（含正在创建）的连接数
+        self._in_use = 0
+        self._waiting = 0
+        self._closed = False
+
+        self.created_total = 0
+        self.closed_total = 0
+        self.checkouts_total = 0
+        self.timeouts_total = 0
+        self.wait_seconds_total = 0.0
+
+        for _ in range(minconn):
+            conn = self._connect()
+            with self._cond:
+                self._size += 1
+                self._idle.append(conn)
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, connection_factory=PooledConnection, **self._connect_kwargs)
+        conn.pool = self
+        conn.created_at = conn.returned_at = time.monotonic()
+        with self._cond:
+            self.created_total += 1
+        return conn
+
+    def _close(self, conn):
+        with self._cond:
+            self.closed_total += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_expired(self, conn, now) -> bool:
+        return self.max_lifetime > 0 and now - conn.created_at > self.max_lifetime
+
+    def _collect_idle_locked(self, now) -> list:
+        """取出需要关闭的空闲连接（超出生命周期，或超过 minconn 且空闲过久）"""
+        doomed = []
+        keep = collections.deque()
+        while self._idle:
+            conn = self._idle.popleft()
+            idle_too_long = (
+                self.max_idle > 0
+                and now - conn.returned_at > self.max_idle
+                and self._size - len(doomed) > self.minconn
+            )
+            if conn.closed or self._is_expired(conn, now) or idle_too_long:
+                doomed.append(conn)
+            else:
+                keep.append(conn)
+        self._idle = keep
+        self._size -= len(doomed)
+        return doomed
+
+    def getconn(self):
+        """借出连接；池满时排队等待，超时抛出 PoolExhaustedError"""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        doomed = []
+        conn = None
+        create = False
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise psycopg2.pool.PoolError("connection pool is closed")
+
+                doomed.extend(self._collect_idle_locked(time.monotonic()))
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    create = True
+                    break
 
-try:
-    db_pool = psycopg2.pool.SimpleConnectionPool(
-        minconn=Config.DB_MIN_CONN,
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts_total += 1
+                    raise PoolExhaustedError(
+                        f"连接池 {self.name} 已满 ({self.maxconn})，等待 {self.timeout}s 后仍无可用连接"
+                    )
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+            self._in_use += 1
+            self.checkouts_total += 1
+            waited = time.monotonic() - started
+            self.wait_seconds_total += waited
+
+        POOL_CHECKOUT_WAIT.observe(waited, pool=self.name)
+
+        for old in doomed:
+            self._close(old)
+
+        if create:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+        return conn
+
+    def putconn(self, conn, close=False):
+        """归还连接；close=True、连接已断开或超出生命周期时直接关闭并释放名额"""
+        if conn.pool is not self:
+            raise psycopg2.pool.PoolError("trying to put unkeyed connection")
+
+        now = time.monotonic()
+        discard = close or conn.closed or self._closed or self._is_expired(conn, now)
+        if discard:
+            self._close(conn)
+
+        with self._cond:
+            self._in_use -= 1
+            if discard:
+                self._size -= 1
+            else:
+                conn.returned_at = now
+                self._idle.append(conn)
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            self._close(conn)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'name': self.name,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'waiting': self._waiting,
+                'maxconn': self.maxconn,
+                'created_total': self.created_total,
+                'closed_total': self.closed_total,
+                'checkouts_total': self.checkouts_total,
+                'timeouts_total': self.timeouts_total,
+                'wait_seconds_total': self.wait_seconds_total,
+            }
+
+
+# ==============================
+# 连接池（按进程延迟创建）
+# ==============================
+# 连接池在第一次使用时创建，并记录创建它的进程号。gunicorn --preload 时 master 只导入应用、
+# 不持有连接；即使 master 已经建过连接，fork 后子进程也会丢弃继承来的连接池并重建。
+# 继承来的连接不能在子进程里 close（会向与父进程共享的 socket 发送终止消息），
+# 也不能被垃圾回收（析构同样会关闭），所以保留引用直到进程退出。
+#
+# DATABASE_REPLICA_URLS 配置后每个副本一个连接池；get_db_cursor(commit_on_success=False)
+# 轮询副本，副本不可用时短暂跳过并回落到主库。同一请求内发生过写入后，后续只读块固定走主库。
+
+_REPLICA_COOLDOWN = 5.0  # 副本连接失败后跳过的秒数
+
+_pools = None           # (pid, 主库连接池, [副本连接池...])
+_pools_lock = threading.Lock()
+_inherited_pools = []   # fork 前创建的连接池，仅保留引用
+
+
+def _new_pool(dsn, minconn, name):
+    return BoundedConnectionPool(
+        dsn=dsn,
+        minconn=minconn,
         maxconn=Config.DB_MAX_CONN,
-        dsn=Config.DATABASE_URL,
-        cursor_factory=psycopg2.extras.RealDictCursor,
+        timeout=Config.DB_POOL_TIMEOUT,
+        max_lifetime=Config.DB_CONN_MAX_LIFETIME,
+        max_idle=Config.DB_CONN_MAX_IDLE,
+        name=name,
+        cursor_factory=TrackingCursor,
 
         keepalives=1,
         keepalives_idle=30,
         keepalives_interval=10,
         keepalives_count=5,
     )
-    logger.info(f"✅ 数据库连接池已启动: {Config.DB_MIN_CONN} ~ {Config.DB_MAX_CONN}")
-except Exception as e:
-    logger.error(f"❌ 无法创建数据库连接池: {e}")
-    raise
 
 
-def is_connection_usable(conn) -> bool:
+def _get_pools():
+    pools = _pools
+    if pools is not None and pools[0] == os.getpid():
+        return pools
+    return _init_pools()
+
+
+def _init_pools():
+    global _pools
+    with _pools_lock:
+        pid = os.getpid()
+        if _pools is not None and _pools[0] == pid:
+            return _pools
+        if _pools is not None:
+            _discard_inherited_pools()
+
+        try:
+            primary = _new_pool(Config.DATABASE_URL, Config.DB_MIN_CONN, 'primary')
+            logger.info(f"✅ 数据库连接池已启动: {Config.DB_MIN_CONN} ~ {Config.DB_MAX_CONN} (pid={pid})")
+        except Exception as e:
+            logger.error(f"❌ 无法创建数据库连接池: {e}")
+            raise
+
+        replicas = [
+            _new_pool(url, 0, f"replica-{i}")
+            for i, url in enumerate(Config.DATABASE_REPLICA_URLS)
+        ]
+        if replicas:
+            logger.info(f"✅ 只读副本连接池已配置: {len(replicas)} 个")
+
+        _pools = (pid, primary, replicas)
+        return _pools
+
+
+def _discard_inherited_pools():
+    """丢弃父进程的连接池：只保留引用，不关闭任何连接（调用方持有 _pools_lock 或处于 fork 后的单线程状态）"""
+    global _pools
+    if _pools is not None and _pools[0] != os.getpid():
+        _, primary, replicas = _pools
+        _inherited_pools.append((primary, replicas))
+        _pools = None
+
+
+def reset_after_fork():
+    """
+    fork 后在子进程中调用（gunicorn post_fork），丢弃继承来的连接池，下次使用时重建
+    已通过 os.register_at_fork 自动注册，手动调用是幂等的
+    """
+    global _pools_lock
+    _pools_lock = threading.Lock()
+    _discard_inherited_pools()
+    # 父进程记录的副本冷却状态不适用于子进程的新连接池
+    _replica_down_until.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_after_fork)
+
+
+def get_pool() -> BoundedConnectionPool:
+    """当前进程的主库连接池（不存在时创建）"""
+    return _get_pools()[1]
+
+
+def get_replica_pools() -> list:
+    """当前进程的副本连接池列表"""
+    return _get_pools()[2]
+
+
+_replica_rr = itertools.count()
+_replica_down_until = {}
+
+
+def _get_replica_db():
+    """轮询取一个副本连接；全部不可用时回落到主库"""
+    now = time.monotonic()
+    start = next(_replica_rr)
+    replicas = get_replica_pools()
+    for i in range(len(replicas)):
+        pool = replicas[(start + i) % len(replicas)]
+        if _replica_down_until.get(pool.name, 0.0) > now:
+            continue
+        try:
+            return get_db(pool)
+        except (psycopg2.OperationalError, psycopg2.pool.PoolError) as e:
+            _replica_down_until[pool.name] = now + _REPLICA_COOLDOWN
+            logger.warning(f"副本 {pool.name} 不可用，回落: {e}")
+    return get_db()
+
+
+def _primary_pinned() -> bool:
+    """当前请求是否已写过主库（读己之写）"""
+    from flask import g, has_request_context
+    if not has_request_context():
+        return False
+    return g.get('_db_primary_pinned', False)
+
+
+def _pin_primary():
+    from flask import g, has_request_context
+    if has_request_context():
+        g._db_primary_pinned = True
+
+
+def _use_replica(commit_on_success) -> bool:
+    return not commit_on_success and bool(get_replica_pools()) and not _primary_pinned()
+
+
+def get_pool_stats() -> dict:
+    """连接池状态：大小、空闲、借出、排队等待数及累计计数"""
+    return get_pool().stats()
+
+
+def get_all_pool_stats() -> list:
+    """主库与各副本连接池的状态"""
+    return [get_pool().stats()] + [pool.stats() for pool in get_replica_pools()]
+
+
+def needs_validation(conn) -> bool:
+    """
+    按 DB_VALIDATION_MODE 判断借出前是否需要 SELECT 1 探测
+    - always: 每次借出都探测
+    - idle:   空闲超过 DB_VALIDATION_IDLE_SECONDS 才探测（默认）
+    - never:  从不探测，连接失效时由 with_db_retry 包装的调用重试
+    """
+    mode = Config.DB_VALIDATION_MODE
+    if mode == 'always':
+        return True
+    if mode == 'never':
+        return False
+    idle_for = time.monotonic() - getattr(conn, 'returned_at', 0.0)
+    return idle_for > Config.DB_VALIDATION_IDLE_SECONDS
+
+
+def is_connection_usable(conn, probe=True) -> bool:
     """
     检查连接是否可用（防止 SSL 断连、EOF、服务端关闭等）
+    probe=False 时只做本地检查，不发 SELECT 1
     """
     try:
         if conn.closed:
@@ -94,6 +627,9 @@ def is_connection_usable(conn) -> bool:
             except:
                 return False
 
+        if not probe:
+            return True
+
         cursor = conn.cursor()
         cursor.execute("SELECT 1")
         cursor.fetchone()
@@ -117,55 +653,67 @@ def is_connection_usable(conn) -> bool:
         return False
 
 
-def get_db():
+def get_db(pool=None):
     """
-    获取数据库连接（优先从池中获取，失败则创建临时连接）
+    从连接池获取连接（默认主库连接池）
+    池中连接不可用时丢弃并重新获取；池满时排队等待，超时抛出 PoolExhaustedError，不再创建池外临时连接
     """
-    conn = None
-    try:
-        conn = db_pool.getconn()
-        if conn is None:
-            raise Exception("从连接池获取到 None 连接")
-
-        # 检查连接是否可用
-        if is_connection_usable(conn):
+    pool = pool or get_pool()
+    # 每次丢弃都会释放一个名额，最多 maxconn + 1 次即可拿到新建的连接
+    for _ in range(pool.maxconn + 1):
+        conn = pool.getconn()
+        if is_connection_usable(conn, probe=needs_validation(conn)):
             conn.autocommit = False
             set_connection_context(conn, is_pooled=True)
             logger.debug(f"🔁 从连接池获取连接: {get_connection_id()}")
             return conn
-        else:
-            logger.warning(f"池中连接不可用，创建临时连接")
-            try:
-                db_pool.putconn(conn, close=True)
-            except Exception as e:
-                logger.warning(f"关闭无效池连接失败: {e}")
-            conn = None
-    except Exception as e:
-        logger.warning(f"从连接池获取连接失败: {e}")
-        if conn:
-            try:
-                db_pool.putconn(conn, close=True)
-            except:
-                pass
-            conn = None
 
-    # 创建临时连接
-    try:
-        conn = psycopg2.connect(
-            Config.DATABASE_URL,
-            cursor_factory=psycopg2.extras.RealDictCursor,
-            keepalives=1,
-            keepalives_idle=30,
-            keepalives_interval=10,
-            keepalives_count=5,
-        )
-        conn.autocommit = False
-        set_connection_context(conn, is_pooled=False)
-        logger.info(f"🆕 创建临时连接: {get_connection_id()}")
-        return conn
-    except Exception as e:
-        logger.error(f"无法创建临时数据库连接: {e}")
-        raise
+        logger.warning("池中连接不可用，丢弃后重新获取")
+        try:
+            pool.putconn(conn, close=True)
+        except Exception as e:
+            logger.warning(f"关闭无效池连接失败: {e}")
+
+    raise psycopg2.OperationalError("无法从连接池获取可用连接")
+
+
+def after_commit(cursor, callback):
+    """
+    登记在 cursor 所在事务提交后执行的回调（用于更新进程内的派生状态）
+    事务或所在的 SAVEPOINT 回滚时回调被丢弃；回调抛出的异常只记录日志
+    """
+    conn = cursor.connection
+    if conn.commit_callbacks is None:
+        conn.commit_callbacks = []
+    conn.commit_callbacks.append(callback)
+
+
+def run_commit_callbacks(conn):
+    """事务提交后调用：依次执行并清空登记的回调"""
+    callbacks = getattr(conn, 'commit_callbacks', None)
+    if not callbacks:
+        return
+    conn.commit_callbacks = None
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception as e:
+            logger.error(f"提交后回调执行失败: {e}")
+
+
+def _discard_commit_callbacks(conn, keep=0):
+    callbacks = getattr(conn, 'commit_callbacks', None)
+    if callbacks:
+        del callbacks[keep:]
+
+
+def _release(conn, close=False):
+    """把连接还给所属连接池；非池化连接直接关闭"""
+    pool = getattr(conn, 'pool', None)
+    if pool is not None:
+        pool.putconn(conn, close=close)
+    else:
+        conn.close()
 
 
 def close_db(conn):
@@ -176,14 +724,16 @@ def close_db(conn):
         _cleanup_tls()
         return
 
-    cid = get_connection_id()
-
-    if conn.closed:
-        logger.debug(f"❌ 尝试关闭已关闭的连接: {cid}")
-        _cleanup_tls()
-        return
+    cid = getattr(conn, 'connection_id', None) or get_connection_id()
+    # 归还时仍未执行的回调属于未提交的事务
+    _discard_commit_callbacks(conn)
 
     try:
+        if conn.closed:
+            logger.debug(f"❌ 尝试关闭已关闭的连接: {cid}")
+            _release(conn, close=True)
+            return
+
         status = conn.get_transaction_status()
         if status != 0:
             try:
@@ -191,70 +741,216 @@ def close_db(conn):
                 logger.debug(f"🧹 强制回滚未完成事务: {cid}")
             except Exception as e:
                 logger.warning(f"回滚失败 ({cid}): {e}")
-                try:
-                    conn.close()
-                    _cleanup_tls()
-                    return
-                except:
-                    pass
-
-        try:
-            cursor = conn.cursor()
-            cursor.execute("RESET ALL")
-            cursor.close()
-        except Exception as e:
-            logger.warning(f"RESET ALL 失败 ({cid}): {e}")
+                _release(conn, close=True)
+                return
 
-        if is_pooled_connection():
-            try:
-                db_pool.putconn(conn)
-                logger.debug(f"✅ 池化连接已归还: {cid}")
-            except Exception as e:
-                logger.error(f"归还连接失败 ({cid}): {e}，正在关闭")
-                try:
-                    conn.close()
-                except:
-                    pass
-        else:
+        # DB_RESET_MODE=dirty 时只在会话状态被 SET/RESET 修改过时才 RESET ALL
+        if Config.DB_RESET_MODE == 'always' or getattr(conn, 'session_dirty', False):
             try:
-                conn.close()
-                logger.debug(f"🗑️ 临时连接已关闭: {cid}")
+                cursor = conn.cursor()
+                cursor.execute("RESET ALL")
+                cursor.close()
+                conn.session_dirty = False
             except Exception as e:
-                logger.error(f"关闭临时连接失败 ({cid}): {e}")
+                logger.warning(f"RESET ALL 失败 ({cid}): {e}")
+
+        _release(conn, close=conn.closed)
+        logger.debug(f"✅ 连接已归还: {cid}")
 
     except Exception as e:
         logger.error(f"关闭连接时出错 ({cid}): {e}")
         try:
-            conn.close()
+            _release(conn, close=True)
         except:
-            pass
+            try:
+                conn.close()
+            except:
+                pass
     finally:
         _cleanup_tls()
 
 
+# ==============================
+# 请求级连接（可选）
+# ==============================
+# DB_REQUEST_SCOPED_CONN 开启后，同一个 Flask 请求内的所有 get_db_cursor 共用一个主库连接和一个事务：
+# 连接在请求第一次访问数据库（读或写）时借出，之后每个块都复用它，请求结束时在 after_request 中
+# 统一提交（没有写入时回滚），未处理的异常则在 teardown 中整体回滚。此模式下请求内不走只读副本。
+# 写入块用 SAVEPOINT 隔离（块内异常只回滚该块）；只读块不设 SAVEPOINT（只读块不得写入）。
+# 尚未写入时只读块出错直接回滚事务继续使用，连接断开则丢弃以便重试；
+# 已有写入后只读块中的 SQL 错误使整个事务失效，请求结束时回滚并返回 500，不会静默丢弃此前的写入。
+
+def _request_scope():
+    """返回当前请求的 flask.g；未启用或不在请求上下文中时返回 None"""
+    if not Config.DB_REQUEST_SCOPED_CONN:
+        return None
+    from flask import g, has_request_context
+    if not has_request_context():
+        return None
+    return g
+
+
+def _drop_request_connection(scope, conn):
+    """丢弃断开的请求连接（此前没有写入），下一个块重新借出，允许 with_db_retry 重试"""
+    scope.pop('_db_conn', None)
+    _release(conn, close=True)
+    _tls.connection_lost = True
+
+
+@contextmanager
+def _request_scoped_cursor(scope, commit_on_success, compact=False):
+    conn = scope.get('_db_conn')
+    if conn is None:
+        conn = get_db()
+        scope._db_conn = conn
+        scope._db_savepoint_seq = 0
+
+    cid = getattr(conn, 'connection_id', 'unknown')
+    cursor = conn.cursor(cursor_factory=CompactCursor) if compact else conn.cursor()
+    callbacks_mark = len(conn.commit_callbacks or ())
+    had_writes = scope.get('_db_wrote', False)
+
+    if not commit_on_success:
+        try:
+            yield cursor
+        except Exception as e:
+            logger.error(f"数据库操作失败: {e} (请求连接: {cid})")
+            if conn.closed:
+                if had_writes:
+                    scope._db_aborted = True
+                else:
+                    _drop_request_connection(scope, conn)
+            elif conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+                if had_writes:
+                    # 没有 SAVEPOINT 可以回退：标记整个请求事务失效
+                    scope._db_aborted = True
+                else:
+                    # 事务里只有读：回滚后连接照常可用
+                    try:
+                        conn.rollback()
+                    except Exception:
+                        pass
+            raise
+        finally:
+            _discard_commit_callbacks(conn, callbacks_mark)
+            if not cursor.closed:
+                cursor.close()
+        return
+
+    scope._db_wrote = True
+    scope._db_savepoint_seq += 1
+    savepoint = f"ta_sp_{scope._db_savepoint_seq}"
+    try:
+        cursor.execute(f"SAVEPOINT {savepoint}")
+        yield cursor
+        cursor.execute(f"RELEASE SAVEPOINT {savepoint}")
+    except Exception as e:
+        logger.error(f"数据库操作失败: {e} (请求连接: {cid})")
+        _discard_commit_callbacks(conn, callbacks_mark)
+        if not conn.closed:
+            try:
+                cursor.execute(f"ROLLBACK TO SAVEPOINT {savepoint}")
+            except Exception:
+                pass
+        elif not had_writes:
+            # 请求中的第一个写入块就遇到断开的连接：事务里还没有任何写入，丢弃后允许重试
+            scope._db_wrote = False
+            _drop_request_connection(scope, conn)
+        raise
+    finally:
+        if not cursor.closed:
+            cursor.close()
+
+
+def init_app(app):
+    """注册请求级连接的提交与回收钩子（仅在 DB_REQUEST_SCOPED_CONN 开启时）"""
+    if not Config.DB_REQUEST_SCOPED_CONN:
+        return
+
+    from flask import g
+
+    @app.after_request
+    def _commit_request_connection(response):
+        conn = g.pop('_db_conn', None)
+        if conn is None:
+            return response
+        if not g.pop('_db_wrote', False):
+            # 请求只读过数据库：回滚即可
+            try:
+                conn.rollback()
+                DB_TRANSACTIONS.inc(outcome='readonly')
+            except Exception as e:
+                logger.warning(f"请求连接回滚失败: {e}")
+            finally:
+                close_db(conn)
+            return response
+        if g.pop('_db_aborted', False):
+            # 只读块中的 SQL 错误使事务失效，此时 COMMIT 会静默回滚，不能当作成功返回
+            DB_TRANSACTIONS.inc(outcome='rollback')
+            logger.error("请求事务已失效，回滚")
+            close_db(conn)
+            return app.response_class("Internal Server Error", status=500)
+        try:
+            conn.commit()
+            DB_TRANSACTIONS.inc(outcome='commit')
+            logger.debug(f"✅ 请求事务已提交: {getattr(conn, 'connection_id', 'unknown')}")
+            run_commit_callbacks(conn)
+        except Exception as e:
+            DB_TRANSACTIONS.inc(outcome='rollback')
+            logger.error(f"请求事务提交失败: {e}")
+            response = app.response_class("Internal Server Error", status=500)
+        finally:
+            close_db(conn)
+        return response
+
+    @app.teardown_request
+    def _release_request_connection(exc):
+        # after_request 没有执行（未处理的异常）时在这里回滚并归还
+        conn = g.pop('_db_conn', None)
+        if conn is not None:
+            DB_TRANSACTIONS.inc(outcome='rollback')
+            close_db(conn)
+
+
 @contextmanager
-def get_db_cursor(commit_on_success: bool = True):
+def get_db_cursor(commit_on_success: bool = True, compact: bool = False):
     """
     数据库游标上下文管理器
     使用示例：
         with get_db_cursor() as cur:
             cur.execute("INSERT INTO ...")
+    开启 DB_REQUEST_SCOPED_CONN 时，请求内的所有调用共用同一个连接与事务
+    配置了只读副本时，commit_on_success=False 的块走副本（本请求已写入主库或使用请求级连接时除外）
+    compact=True 时行为只读的 CompactRow（用于热路径，省去逐行 dict）
     """
+    scope = _request_scope()
+    if scope is not None:
+        with _request_scoped_cursor(scope, commit_on_success, compact) as cursor:
+            yield cursor
+        return
+
+    use_replica = _use_replica(commit_on_success)
+
     conn = None
     cursor = None
     cid = "unknown"
 
     try:
-        conn = get_db()
+        conn = _get_replica_db() if use_replica else get_db()
         cid = get_connection_id()
-        cursor = conn.cursor()
+        cursor = conn.cursor(cursor_factory=CompactCursor) if compact else conn.cursor()
         yield cursor
 
         if commit_on_success:
             try:
                 conn.commit()
+                DB_TRANSACTIONS.inc(outcome='commit')
                 logger.debug(f"✅ 事务已提交: {cid}")
+                run_commit_callbacks(conn)
             except Exception as e:
+                if conn.closed:
+                    # 连接在 COMMIT 途中断开，无法确定事务是否已生效，不能重试
+                    _tls.commit_in_doubt = True
                 try:
                     conn.rollback()
                     logger.debug(f"↩️ 提交失败，已回滚: {cid}")
@@ -264,13 +960,17 @@ def get_db_cursor(commit_on_success: bool = True):
         else:
             try:
                 conn.rollback()
+                DB_TRANSACTIONS.inc(outcome='readonly')
                 logger.debug(f"↩️ 事务已回滚（只读）: {cid}")
             except Exception as e:
                 logger.warning(f"回滚失败 ({cid}): {e}")
 
     except Exception as e:
         logger.error(f"数据库操作失败: {e} (连接: {cid})")
+        DB_TRANSACTIONS.inc(outcome='rollback')
         if conn:
+            if conn.closed:
+                _tls.connection_lost = True
             try:
                 conn.rollback()
             except:
@@ -287,6 +987,102 @@ def get_db_cursor(commit_on_success: bool = True):
             close_db(conn)
 
 
+# 主库上尚未结束的事务中最早的开始时间（没有则为 NOW()）。
+# NOW() 取的是事务开始时间，写入的行可能在很久之后才提交；用它作为按时间列增量拉取的水位线，
+# 之后提交的行其时间列必然不早于它，长事务不会被漏掉。须在主库上执行。
+TRANSACTION_HORIZON_SQL = """
+    SELECT LEAST(NOW(), MIN(xact_start)) AS horizon
+    FROM pg_stat_activity
+    WHERE datname = current_database()
+      AND xact_start IS NOT NULL
+      AND pid <> pg_backend_pid()
+"""
+
+
+# 可以安全重试的 SQLSTATE：序列化失败、死锁、服务端关闭/重启、连接数已满
+_TRANSIENT_SQLSTATES = {
+    '40001',  # serialization_failure
+    '40P01',  # deadlock_detected
+    '57P01',  # admin_shutdown
+    '57P02',  # crash_shutdown
+    '57P03',  # cannot_connect_now
+    '53300',  # too_many_connections
+}
+
+
+def _transient_reason(exc):
+    """返回可重试错误的原因标签；不可重试时返回 None"""
+    if isinstance(exc, psycopg2.InterfaceError):
+        # 只有确认是连接断开（而不是误用已关闭的游标等）时才重试
+        return 'connection_lost' if getattr(_tls, 'connection_lost', False) else None
+    if not isinstance(exc, psycopg2.OperationalError):
+        return None
+    pgcode = getattr(exc, 'pgcode', None)
+    if pgcode is None:
+        # 没有 SQLSTATE：客户端侧的连接错误（连接失败、SSL 断开、服务端关闭连接）
+        return 'connection_lost'
+    if pgcode.startswith('08'):
+        return 'connection_lost'
+    if pgcode in ('40001', '40P01'):
+        return 'serialization' if pgcode == '40001' else 'deadlock'
+    if pgcode in _TRANSIENT_SQLSTATES:
+        return 'server_unavailable'
+    return None
+
+
+def _in_request_transaction() -> bool:
+    """请求级连接上已有未提交的写入时，单个块不能单独重试"""
+    if not Config.DB_REQUEST_SCOPED_CONN:
+        return False
+    from flask import g, has_request_context
+    return has_request_context() and g.get('_db_wrote', False)
+
+
+def with_db_retry(func):
+    """
+    装饰幂等的读操作或完整的事务单元：遇到瞬时错误（连接断开、故障切换、序列化失败、死锁）时
+    按指数退避加随机抖动重试，最多 DB_RETRY_ATTEMPTS 次
+    以下情况不重试，直接抛出：
+    - 传入 cursor（处于调用方事务中）
+    - 嵌套在另一个 with_db_retry 调用内（由最外层统一重试）
+    - 请求级连接上已有未提交的工作
+    - 连接在 COMMIT 途中断开（事务是否生效未知）
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if kwargs.get('cursor') is not None or getattr(_tls, 'in_retry', False):
+            return func(*args, **kwargs)
+        if _in_request_transaction():
+            return func(*args, **kwargs)
+
+        attempts = max(1, Config.DB_RETRY_ATTEMPTS)
+        _tls.in_retry = True
+        try:
+            for attempt in range(1, attempts + 1):
+                _tls.connection_lost = False
+                _tls.commit_in_doubt = False
+                try:
+                    return func(*args, **kwargs)
+                except Exception as e:
+                    reason = _transient_reason(e)
+                    if reason is None or getattr(_tls, 'commit_in_doubt', False):
+                        raise
+                    if attempt >= attempts:
+                        DB_RETRIES_EXHAUSTED.inc(function=func.__name__)
+                        raise
+                    delay = min(Config.DB_RETRY_MAX_DELAY, Config.DB_RETRY_BASE_DELAY * (2 ** (attempt - 1)))
+                    delay = random.uniform(delay / 2, delay)
+                    DB_RETRIES.inc(function=func.__name__, reason=reason)
+                    logger.warning(
+                        f"数据库瞬时错误 ({reason})，{delay * 1000:.0f}ms 后重试 {func.__name__} "
+                        f"({attempt}/{attempts - 1}): {e}"
+                    )
+                    time.sleep(delay)
+        finally:
+            _tls.in_retry = False
+    return wrapper
+
+
 # ==============================
 # 关闭连接池（程序退出时）
 # ==============================
@@ -295,12 +1091,18 @@ import atexit
 
 @atexit.register
 def close_db_pool():
-    global db_pool
-    if db_pool is not None:
+    pools = _pools
+    if pools is None or pools[0] != os.getpid():
+        # 从未使用过数据库，或连接池属于父进程
+        return
+    _, primary, replicas = pools
+    for pool in replicas:
         try:
-            db_pool.closeall()
-            logger.info("🔗 数据库连接池已关闭")
+            pool.closeall()
         except Exception as e:
-            logger.error(f"❌ 关闭连接池时出错: {e}")
-    else:
-        logger.warning("⚠️ 无数据库连接池可关闭")
\ No newline at end of file
+            logger.error(f"❌ 关闭副本连接池 {pool.name} 时出错: {e}")
+    try:
+        primary.closeall()
+        logger.info("🔗 数据库连接池已关闭")
+    except Exception as e:
+        logger.error(f"❌ 关闭连接池时出错: {e}")
@@ -0,0 +1,375 @@
+# models/game_token.py
+from models.database import get_db_cursor, with_db_retry, after_commit
+from models.statements import prepared_statement
+from models.write_behind import game_token_last_used
+from config import Config
+from utils.cache import TTLCache
+import hmac
+import logging
+import threading
+import time
+import utils
+
+logger = logging.getLogger(__name__)
+
+
+# 验证游戏 token 所需的列：用户、token 密文、最新声望（取自声望日志汇总表，即最后一条日志的分数）以及封禁状态
+_VERIFY_COLUMNS = """
+    SELECT
+        u.id,
+        u.nickname,
+        u.created_at,
+        g.game_token,
+        g.salt,
+        g.token_fingerprint,
+        COALESCE(l.latest_score, 0) AS reputation,
+        COALESCE(r.is_banned, FALSE) AS is_banned
+"""
+
+_VERIFY_JOINS = """
+    LEFT JOIN taUsersReputation r ON r.user_id = u.id
+    LEFT JOIN taUsersReputationLogRollup l ON l.user_id = u.id
+"""
+
+# 按指纹精确查找（走 token_fingerprint 唯一索引）
+VERIFY_BY_FINGERPRINT_SQL = _VERIFY_COLUMNS + """
+    FROM taUserGame g
+    JOIN taUsers u ON u.id = g.user_id
+""" + _VERIFY_JOINS + """
+    WHERE g.token_fingerprint = %s
+      AND u.nickname = %s
+      AND g.created_at > NOW() - INTERVAL '90 days'
+"""
+
+# 批量版本：一次查出一组指纹对应的用户，昵称在调用方比对
+VERIFY_BY_FINGERPRINTS_SQL = _VERIFY_COLUMNS + """
+    FROM taUserGame g
+    JOIN taUsers u ON u.id = g.user_id
+""" + _VERIFY_JOINS + """
+    WHERE g.token_fingerprint = ANY(%s)
+      AND g.created_at > NOW() - INTERVAL '90 days'
+"""
+
+# 兼容尚未回填指纹的旧 token：同昵称的所有用户，只带出指纹为空的 token 密文
+_VERIFY_LEGACY_FROM = """
+    FROM taUsers u
+    LEFT JOIN taUserGame g
+           ON g.user_id = u.id
+          AND g.token_fingerprint IS NULL
+          AND g.created_at > NOW() - INTERVAL '90 days'
+          AND g.salt IS NOT NULL
+""" + _VERIFY_JOINS
+
+VERIFY_LEGACY_CANDIDATES_SQL = _VERIFY_COLUMNS + _VERIFY_LEGACY_FROM + """
+    WHERE u.nickname = %s
+"""
+
+VERIFY_LEGACY_CANDIDATES_BATCH_SQL = _VERIFY_COLUMNS + _VERIFY_LEGACY_FROM + """
+    WHERE u.nickname = ANY(%s)
+"""
+
+verify_by_fingerprint = prepared_statement('ta_verify_by_fingerprint', VERIFY_BY_FINGERPRINT_SQL)
+verify_by_fingerprints = prepared_statement('ta_verify_by_fingerprints', VERIFY_BY_FINGERPRINTS_SQL)
+verify_legacy_candidates = prepared_statement('ta_verify_legacy_candidates', VERIFY_LEGACY_CANDIDATES_SQL)
+
+
+def _decrypt_and_match(encrypted_token_bytes: bytes, salt: str, target_token: str) -> bool:
+    """
+    尝试用 salt 解密 encrypted_token_bytes，并与 target_token 比较。
+    安全、防崩溃、防时序攻击。
+    """
+    if isinstance(encrypted_token_bytes, memoryview):
+        encrypted_token_bytes = encrypted_token_bytes.tobytes()
+    if not isinstance(encrypted_token_bytes, bytes) or len(encrypted_token_bytes) == 0:
+        logger.warning("Invalid encrypted token: not bytes or empty")
+        return False
+    if not isinstance(salt, str) or len(salt) != 32:  # 假设 salt 固定为 32 字符
+        logger.warning("Invalid salt length or type")
+        return False
+    if not isinstance(target_token, str) or len(target_token.strip()) == 0:
+        logger.warning("Invalid target token")
+        return False
+
+    target_token = target_token.strip()
+
+    try:
+        decrypted: str = utils.decrypt_data(encrypted_token_bytes, salt)
+        if not isinstance(decrypted, str):
+            logger.warning("Invalid decrypted")
+            return False
+        return hmac.compare_digest(decrypted.strip(), target_token)
+    except Exception as e:
+        logger.warning(f"Decryption failed: {e}")
+        return False
+
+
+def _backfill_fingerprint(cursor, pending, user_id, fingerprint):
+    # pending 不为 None 时游标只读（可能在副本上）：先记下，待只读游标释放后由 _write_pending_fingerprints 写入，
+    # 不在持有游标时再从连接池取连接
+    if pending is not None:
+        pending.append((user_id, fingerprint))
+    else:
+        set_token_fingerprint(user_id, fingerprint, cursor=cursor)
+
+
+def _write_pending_fingerprints(pending):
+    """只读查找结束后补写指纹；失败只记录日志，下次验证或回填脚本会再次处理"""
+    if not pending:
+        return
+    try:
+        with get_db_cursor() as cursor:
+            for user_id, fingerprint in pending:
+                set_token_fingerprint(user_id, fingerprint, cursor=cursor)
+    except Exception as e:
+        logger.warning(f"Fingerprint backfill failed: {e}")
+
+
+def _find_game_token_user(cursor, token, nickname, pending=None):
+    """
+    按 token 指纹查找持有该 token 的用户（昵称必须一致）
+    :return: (row, nickname_exists)；row 包含 id, nickname, created_at, reputation, is_banned，
+             未匹配时为 None
+    """
+    fingerprint = utils.fingerprint_token(token)
+    verify_by_fingerprint.execute(cursor, (fingerprint, nickname))
+    row = cursor.fetchone()
+    if row:
+        return row, True
+
+    # 指纹未命中：回退到旧 token，顺带判断昵称是否存在
+    verify_legacy_candidates.execute(cursor, (nickname,))
+    candidates = cursor.fetchall()
+    for candidate in candidates:
+        if candidate['game_token'] is None:
+            continue
+        if _decrypt_and_match(candidate['game_token'], candidate['salt'], token):
+            _backfill_fingerprint(cursor, pending, candidate['id'], fingerprint)
+            return candidate, True
+
+    return None, bool(candidates)
+
+
+def _find_game_token_users(cursor, items, pending=None):
+    fingerprints = [utils.fingerprint_token(token) for token, _ in items]
+    verify_by_fingerprints.execute(cursor, (list(set(fingerprints)),))
+    by_fingerprint = {row['token_fingerprint']: row for row in cursor.fetchall()}
+
+    results = [None] * len(items)
+    misses = []
+    for i, ((token, nickname), fingerprint) in enumerate(zip(items, fingerprints)):
+        row = by_fingerprint.get(fingerprint)
+        if row and row['nickname'] == nickname:
+            results[i] = (row, True)
+        else:
+            misses.append(i)
+
+    if not misses:
+        return results
+
+    # 指纹未命中的条目：一次取回这些昵称下的全部旧 token 候选
+    cursor.execute(VERIFY_LEGACY_CANDIDATES_BATCH_SQL, (list({items[i][1] for i in misses}),))
+    candidates_by_nickname = {}
+    for candidate in cursor.fetchall():
+        candidates_by_nickname.setdefault(candidate['nickname'], []).append(candidate)
+
+    for i in misses:
+        token, nickname = items[i]
+        candidates = candidates_by_nickname.get(nickname, [])
+        matched = None
+        for candidate in candidates:
+            if candidate['game_token'] is None:
+                continue
+            if _decrypt_and_match(candidate['game_token'], candidate['salt'], token):
+                _backfill_fingerprint(cursor, pending, candidate['id'], fingerprints[i])
+                matched = candidate
+                break
+        results[i] = (matched, bool(candidates))
+
+    return results
+
+
+def defer_game_token_touch(user_id):
+    """
+    记录一次 token 使用，仅在启用写回缓冲时生效
+    用于缓存命中等不应访问数据库的路径
+    """
+    if game_token_last_used.enabled:
+        game_token_last_used.touch(user_id)
+
+
+@with_db_retry
+def resolve_game_token(token, nickname):
+    """
+    验证一个 (token, nickname) 并记录 token 使用，整个过程只占用一个连接
+    启用写回缓冲时查找是纯读，走只读游标（配置了副本时在副本上执行）
+    :return: (row, nickname_exists)，同 _find_game_token_user
+    """
+    read_only = game_token_last_used.enabled
+    pending = [] if read_only else None
+    with get_db_cursor(commit_on_success=not read_only, compact=True) as cursor:
+        matched, nickname_exists = _find_game_token_user(cursor, token, nickname, pending)
+        if matched:
+            touch_game_token(matched['id'], cursor=cursor)
+    _write_pending_fingerprints(pending)
+    return matched, nickname_exists
+
+
+@with_db_retry
+def resolve_game_tokens(items):
+    """
+    批量验证 [(token, nickname), ...] 并记录 token 使用
+    :return: 与 items 顺序一致的 [(row, nickname_exists), ...]
+    """
+    if not items:
+        return []
+    read_only = game_token_last_used.enabled
+    pending = [] if read_only else None
+    with get_db_cursor(commit_on_success=not read_only, compact=True) as cursor:
+        results = _find_game_token_users(cursor, items, pending)
+        touch_game_tokens({row['id'] for row, _ in results if row}, cursor=cursor)
+    _write_pending_fingerprints(pending)
+    return results
+
+
+def set_token_fingerprint(user_id, fingerprint, cursor=None):
+    """为已有 token 写入指纹（旧数据回填）；token 已有指纹（并发回填或已重新生成）时不覆盖"""
+    sql = "UPDATE taUserGame SET token_fingerprint = %s WHERE user_id = %s AND token_fingerprint IS NULL"
+    if cursor:
+        cursor.execute(sql, (fingerprint, user_id))
+    else:
+        with get_db_cursor() as new_cursor:
+            new_cursor.execute(sql, (fingerprint, user_id))
+
+
+def touch_game_token(user_id, cursor=None):
+    """
+    更新 token 的 last_used_at 时间
+    启用写回缓冲（WRITE_BEHIND_INTERVAL > 0）时只记入内存，由后台批量写入
+    """
+    if game_token_last_used.enabled:
+        game_token_last_used.touch(user_id)
+        return
+    if cursor:
+        cursor.execute(
+            "UPDATE taUserGame SET last_used_at = NOW() WHERE user_id = %s",
+            (user_id,)
+        )
+    else:
+        with get_db_cursor() as new_cursor:
+            new_cursor.execute(
+                "UPDATE taUserGame SET last_used_at = NOW() WHERE user_id = %s",
+                (user_id,)
+            )
+
+
+def touch_game_tokens(user_ids, cursor=None):
+    """批量更新 token 的 last_used_at 时间"""
+    if not user_ids:
+        return
+    if game_token_last_used.enabled:
+        for user_id in user_ids:
+            game_token_last_used.touch(user_id)
+        return
+    if cursor:
+        cursor.execute(
+            "UPDATE taUserGame SET last_used_at = NOW() WHERE user_id = ANY(%s::uuid[])",
+            (list(user_ids),)
+        )
+    else:
+        with get_db_cursor() as new_cursor:
+            new_cursor.execute(
+                "UPDATE taUserGame SET last_used_at = NOW() WHERE user_id = ANY(%s::uuid[])",
+                (list(user_ids),)
+            )
+
+
+# ==============================
+# 验证结果缓存（进程内，可选）
+# ==============================
+# 只缓存验证成功的结果，键为 (token 指纹, 昵称)，不在内存中保留明文 token。
+# 修改 token、昵称或封禁状态的函数在写入事务中调用 invalidate_verification_cache(user_id, cursor)，事务提交后才失效；
+# 失效只作用于当前进程，其他 worker 中的条目最多在 VERIFY_CACHE_TTL 秒后过期。
+
+_verify_cache = (
+    TTLCache(Config.VERIFY_CACHE_SIZE, Config.VERIFY_CACHE_TTL)
+    if Config.VERIFY_CACHE_TTL > 0 else None
+)
+_invalidated_at = {}  # user_id -> 最近一次失效的时间
+_invalidation_lock = threading.Lock()
+
+
+def verification_clock() -> float:
+    """在查询数据库之前取一次时间戳，传给 cache_verification 以避免缓存失效前读到的旧数据"""
+    return time.monotonic()
+
+
+def get_cached_verification(token, nickname):
+    """
+    查询验证结果缓存
+    :return: 包含 id, reputation, created_at, is_banned 的字典，未命中时为 None
+    """
+    if _verify_cache is None:
+        return None
+
+    key = (utils.fingerprint_token(token), nickname)
+    entry = _verify_cache.get(key)
+    if entry is None:
+        return None
+
+    cached_at, user = entry
+    if _invalidated_at.get(str(user['id']), float('-inf')) >= cached_at:
+        _verify_cache.pop(key)
+        return None
+    return user
+
+
+def cache_verification(token, nickname, row, fetched_at):
+    """
+    缓存一次成功的验证结果
+    :param fetched_at: 开始查询数据库前由 verification_clock() 取得的时间
+    """
+    if _verify_cache is None:
+        return
+
+    user = {
+        'id': row['id'],
+        'reputation': row['reputation'],
+        'created_at': row['created_at'],
+        'is_banned': row['is_banned'],
+    }
+    if _invalidated_at.get(str(user['id']), float('-inf')) >= fetched_at:
+        return
+    _verify_cache.set((utils.fingerprint_token(token), nickname), (fetched_at, user))
+
+
+def invalidate_verification_cache(user_id, cursor=None):
+    """
+    使某用户的所有缓存验证结果失效
+    :param cursor: 传入写入所用的 cursor 时在其事务提交后才失效（请求级连接下提交发生在请求结束时）；
+                   不传则立即失效，须在提交之后调用
+    """
+    invalidate_verification_caches([user_id], cursor=cursor)
+
+
+def invalidate_verification_caches(user_ids, cursor=None):
+    """批量版 invalidate_verification_cache，过期记录只清理一次"""
+    if _verify_cache is None:
+        return
+    if cursor is not None:
+        user_ids = [str(user_id) for user_id in user_ids]
+        after_commit(cursor, lambda: invalidate_verification_caches(user_ids))
+        return
+
+    now = time.monotonic()
+    with _invalidation_lock:
+        for user_id in user_ids:
+            _invalidated_at[str(user_id)] = now
+        # 早于 TTL 的失效记录不会再影响任何缓存条目
+        expired = [uid for uid, ts in _invalidated_at.items() if ts < now - _verify_cache.ttl]
+        for uid in expired:
+            del _invalidated_at[uid]
+
+
+def get_verify_cache_stats():
+    """验证结果缓存统计，未启用时返回 None"""
+    return _verify_cache.stats() if _verify_cache is not None else None
@@ -0,0 +1,251 @@
+# models/leaderboard.py
+from models.database import get_db_cursor, with_db_retry, after_commit, TRANSACTION_HORIZON_SQL
+from config import Config
+from bisect import bisect_right, insort
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# ==============================
+# 声望排行榜与分布
+# ==============================
+# 声望只有 0~100 共 101 个取值：进程内按分数分桶，每桶保存按 user_id 排序的用户列表，
+# 另有每个分数的人数直方图。排行榜按 (score DESC, user_id ASC) 排序，用 (score, user_id) 做 keyset 翻页，
+# 取前 N 名或直方图只访问内存，不扫描 taUsersReputation。
+# 本进程内的声望变更在事务提交后立即应用（record_score）；其他进程的变更至多每
+# LEADERBOARD_REFRESH_INTERVAL 秒按 last_updated 增量拉取；用户被删除无法增量感知，
+# 因此每 LEADERBOARD_RELOAD_INTERVAL 秒整表重建一次。
+# 除进程内首次加载外，增量拉取与整表重建都在后台线程中进行，期间读取方继续使用旧数据。
+#
+# 水位线不是拉取时的 NOW()：last_updated 取的是写入事务的开始时间，事务可能在很久之后才提交。
+# 拉取前先在主库上取所有未结束事务中最早的开始时间（没有则为 NOW()）作为下一次的水位线，
+# 之后提交的写入其 last_updated 必然不早于它，长事务不会被漏掉。拉取因此也在主库上进行。
+
+MAX_SCORE = 100
+
+
+class Leaderboard:
+    """按分数分桶的排行榜"""
+
+    def __init__(self):
+        self._scores = {}                                   # user_id -> score
+        self._buckets = [[] for _ in range(MAX_SCORE + 1)]  # score -> 有序 user_id 列表
+        self.histogram = [0] * (MAX_SCORE + 1)              # score -> 人数
+
+    @classmethod
+    def from_rows(cls, rows):
+        """由 (user_id, score) 整表构建：先分桶再逐桶排序一次，不逐行 insort"""
+        board = cls()
+        for user_id, score in rows:
+            board._scores[str(user_id)] = max(0, min(MAX_SCORE, int(score)))
+        for user_id, score in board._scores.items():
+            board._buckets[score].append(user_id)
+        for score, bucket in enumerate(board._buckets):
+            bucket.sort()
+            board.histogram[score] = len(bucket)
+        return board
+
+    def __len__(self):
+        return len(self._scores)
+
+    def set_score(self, user_id, score):
+        user_id = str(user_id)
+        score = max(0, min(MAX_SCORE, int(score)))
+        current = self._scores.get(user_id)
+        if current == score:
+            return
+        if current is not None:
+            self._remove_from_bucket(user_id, current)
+        self._scores[user_id] = score
+        insort(self._buckets[score], user_id)
+        self.histogram[score] += 1
+
+    def remove(self, user_id):
+        user_id = str(user_id)
+        current = self._scores.pop(user_id, None)
+        if current is not None:
+            self._remove_from_bucket(user_id, current)
+
+    def _remove_from_bucket(self, user_id, score):
+        bucket = self._buckets[score]
+        i = bisect_right(bucket, user_id) - 1
+        if i >= 0 and bucket[i] == user_id:
+            del bucket[i]
+            self.histogram[score] -= 1
+
+    def page(self, limit, after=None):
+        """
+        按 (score DESC, user_id ASC) 取一页
+        :param after: 上一页最后一项的 (score, user_id)，None 表示从第一名开始
+        :return: ([(user_id, score, rank)], 下一页的 after 或 None)
+        """
+        if after is None:
+            score, start = MAX_SCORE, 0
+        else:
+            score = max(0, min(MAX_SCORE, int(after[0])))
+            start = bisect_right(self._buckets[score], str(after[1]))
+        rank = sum(self.histogram[score + 1:]) + start
+
+        entries = []
+        while score >= 0 and len(entries) < limit:
+            bucket = self._buckets[score]
+            for user_id in bucket[start:start + limit - len(entries)]:
+                rank += 1
+                entries.append((user_id, score, rank))
+            score -= 1
+            start = 0
+
+        if len(entries) < limit or rank >= len(self._scores):
+            return entries, None
+        last_user, last_score, _ = entries[-1]
+        return entries, (last_score, last_user)
+
+    def distribution(self, width=1):
+        """把直方图按 width 分段合并：[(起始分数, 结束分数, 人数)]"""
+        width = max(1, int(width))
+        return [
+            (low, min(low + width - 1, MAX_SCORE), sum(self.histogram[low:low + width]))
+            for low in range(0, MAX_SCORE + 1, width)
+        ]
+
+
+_board = None
+_board_pid = None
+_watermark = None       # 下次增量拉取的起点，见 TRANSACTION_HORIZON_SQL
+_loaded_at = 0.0
+_refreshed_at = 0.0
+# 刷新（访问数据库）与读写内存结构分用两把锁，刷新期间读取不被阻塞
+_board_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # fork 时后台刷新线程可能正持有锁，子进程中重新创建
+    global _board_lock, _refresh_lock
+    _board_lock = threading.Lock()
+    _refresh_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+@with_db_retry
+def _load_board():
+    global _board, _board_pid, _watermark, _loaded_at, _refreshed_at
+    with get_db_cursor(compact=True) as cursor:
+        cursor.execute(TRANSACTION_HORIZON_SQL)
+        watermark = cursor.fetchone()['horizon']
+        cursor.execute("SELECT user_id, score FROM taUsersReputation")
+        board = Leaderboard.from_rows((row['user_id'], row['score']) for row in cursor.fetchall())
+
+    with _board_lock:
+        _board, _board_pid, _watermark = board, os.getpid(), watermark
+    _loaded_at = _refreshed_at = time.monotonic()
+    logger.info(f"Leaderboard loaded: {len(board)} users")
+
+
+@with_db_retry
+def _refresh_board():
+    """拉取水位线之后变更过的声望（走 idx_reputation_last_updated）"""
+    global _watermark, _refreshed_at
+    with get_db_cursor(compact=True) as cursor:
+        cursor.execute(TRANSACTION_HORIZON_SQL)
+        watermark = cursor.fetchone()['horizon']
+        cursor.execute(
+            "SELECT user_id, score FROM taUsersReputation WHERE last_updated >= %s",
+            (_watermark,)
+        )
+        rows = cursor.fetchall()
+
+    with _board_lock:
+        for row in rows:
+            _board.set_score(row['user_id'], row['score'])
+    _watermark = watermark
+    _refreshed_at = time.monotonic()
+
+
+def _is_fresh() -> bool:
+    return (
+        _board is not None
+        and _board_pid == os.getpid()
+        and time.monotonic() - _refreshed_at < Config.LEADERBOARD_REFRESH_INTERVAL
+    )
+
+
+def _refresh_in_background():
+    global _refreshed_at
+    try:
+        if _is_fresh():
+            return
+        if time.monotonic() - _loaded_at >= Config.LEADERBOARD_RELOAD_INTERVAL:
+            _load_board()
+        else:
+            _refresh_board()
+    except Exception as e:
+        # 数据库暂不可用时继续使用旧数据，一个刷新间隔后再试
+        _refreshed_at = time.monotonic()
+        logger.error(f"Leaderboard refresh failed, serving stale data: {e}")
+    finally:
+        _refresh_lock.release()
+
+
+def _ensure_board():
+    if _is_fresh():
+        return
+
+    if _board is None or _board_pid != os.getpid():
+        # 本进程还没有任何数据：只能同步加载
+        with _refresh_lock:
+            if _board is None or _board_pid != os.getpid():
+                _load_board()
+        return
+
+    # 已有数据：在后台刷新，本次直接使用旧数据；已有刷新在进行时不重复启动
+    if not _refresh_lock.acquire(blocking=False):
+        return
+    try:
+        threading.Thread(target=_refresh_in_background, name="leaderboard-refresh", daemon=True).start()
+    except Exception:
+        _refresh_lock.release()
+        raise
+
+
+def get_leaderboard_page(limit, after=None):
+    """排行榜的一页，参数与返回值见 Leaderboard.page"""
+    _ensure_board()
+    with _board_lock:
+        return _board.page(limit, after)
+
+
+def get_score_distribution(width=1):
+    """声望分布与总人数"""
+    _ensure_board()
+    with _board_lock:
+        return _board.distribution(width), len(_board)
+
+
+def _apply_scores(scores):
+    board = _board
+    if board is None or _board_pid != os.getpid():
+        # 尚未加载：下次读取时整表加载即可
+        return
+    with _board_lock:
+        for user_id, score in scores:
+            board.set_score(user_id, score)
+
+
+def record_scores(cursor, scores):
+    """
+    声望写入后调用：[(user_id, new_score)] 在 cursor 所在事务提交后应用到本进程的排行榜，回滚则丢弃
+    """
+    scores = [(str(user_id), score) for user_id, score in scores]
+    if scores:
+        after_commit(cursor, lambda: _apply_scores(scores))
+
+
+def record_score(cursor, user_id, score):
+    record_scores(cursor, [(user_id, score)])
@@ -0,0 +1,173 @@
+# models/outbox.py
+from models.database import get_db_cursor, with_db_retry
+from config import Config
+from psycopg2.extras import Json
+
+# ==============================
+# 声望事件 outbox
+# ==============================
+# 声望的连带变更（GitHub 登录加分与贡献者检查、验证加分、封禁连带撤销）在用户请求的事务中只写入一行事件，
+# 由 scripts/outbox_worker.py 批量取出并执行。事件与触发它的业务写入同时提交或同时回滚，不会丢失也不会凭空出现。
+# 未开启 REPUTATION_OUTBOX 时 dispatch 直接在当前事务中执行处理函数，行为与原先一致。
+# 网络请求（prepare）从不在事务内执行：内联模式下由调用方在开事务前经 prepare_inline 完成，worker 中在领取之后、
+# 处理事件的事务之前完成。
+
+_handlers = {}
+_preparers = {}
+
+
+def register_handler(event_type, prepare=None):
+    """
+    注册事件处理函数：handler(cursor, user_id, payload)，在事务中执行，不得访问网络
+    prepare(user_id, payload) -> payload 可选，在任何事务之外执行（例如请求 GitHub API），
+    结果写回 payload；已准备过的 payload 再次传入时应原样返回
+    """
+    def decorator(func):
+        _handlers[event_type] = func
+        if prepare is not None:
+            _preparers[event_type] = prepare
+        return func
+    return decorator
+
+
+def is_enabled() -> bool:
+    return Config.REPUTATION_OUTBOX
+
+
+def prepare_inline(event_type, user_id, payload=None):
+    """
+    未开启 outbox 时，在调用方打开事务之前执行 prepare，使网络请求不落在事务内；
+    开启时原样返回，由 worker 在取出事件后执行
+    """
+    payload = dict(payload or {})
+    prepare = _preparers.get(event_type)
+    if prepare is None or is_enabled():
+        return payload
+    return prepare(str(user_id), payload)
+
+
+def enqueue(cursor, event_type, user_id, payload=None):
+    """在调用方事务中写入一条事件"""
+    if event_type not in _handlers:
+        raise ValueError(f"未注册的 outbox 事件类型: {event_type}")
+    cursor.execute("""
+        INSERT INTO taReputationOutbox (event_type, user_id, payload)
+        VALUES (%s, %s, %s)
+    """, (event_type, user_id, Json(payload or {})))
+
+
+def dispatch(cursor, event_type, user_id, payload=None):
+    """开启 outbox 时写入队列，否则在当前事务中直接执行处理函数（payload 须已经过 prepare_inline）"""
+    if is_enabled():
+        enqueue(cursor, event_type, user_id, payload)
+    else:
+        _handlers[event_type](cursor, str(user_id), payload or {})
+
+
+def _retry_delay(attempts) -> int:
+    """失败后的重试间隔（秒）：指数增长，最长 5 分钟"""
+    return min(300, 2 ** attempts)
+
+
+@with_db_retry
+def _claim_batch(batch_size):
+    """
+    领取一批到期事件：把 available_at 推后 OUTBOX_LEASE_SECONDS 作为租约后立即提交，
+    其他 worker 在租约内不会取到这些事件；worker 中途退出时租约到期后事件自动重新可见
+    """
+    with get_db_cursor() as cursor:
+        cursor.execute("""
+            UPDATE taReputationOutbox o
+            SET available_at = NOW() + make_interval(secs => %s)
+            FROM (
+                SELECT id FROM taReputationOutbox
+                WHERE failed_at IS NULL AND available_at <= NOW()
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            ) c
+            WHERE o.id = c.id
+            RETURNING o.id, o.event_type, o.user_id, o.payload, o.attempts
+        """, (Config.OUTBOX_LEASE_SECONDS, batch_size))
+        return sorted(cursor.fetchall(), key=lambda e: e['id'])
+
+
+@with_db_retry
+def _complete_event(event, payload):
+    """在单独的事务中执行处理函数并删除事件；事件已不存在（被其他 worker 在租约过期后处理）时跳过"""
+    with get_db_cursor() as cursor:
+        cursor.execute("SELECT 1 FROM taReputationOutbox WHERE id = %s FOR UPDATE", (event['id'],))
+        if cursor.fetchone() is None:
+            return False
+        _handlers[event['event_type']](cursor, str(event['user_id']), payload)
+        cursor.execute("DELETE FROM taReputationOutbox WHERE id = %s", (event['id'],))
+        return True
+
+
+@with_db_retry
+def _fail_event(event, error):
+    attempts = event['attempts'] + 1
+    failed = attempts >= Config.OUTBOX_MAX_ATTEMPTS
+    with get_db_cursor() as cursor:
+        cursor.execute("""
+            UPDATE taReputationOutbox
+            SET attempts = %s,
+                last_error = %s,
+                available_at = NOW() + make_interval(secs => %s),
+                failed_at = CASE WHEN %s THEN NOW() ELSE NULL END
+            WHERE id = %s
+        """, (attempts, str(error)[:1000], _retry_delay(attempts), failed, event['id']))
+    return attempts, failed
+
+
+def process_batch(logger, batch_size=None) -> dict:
+    """
+    领取一批到期事件并逐个执行
+    领取是一个短事务（SKIP LOCKED，多个 worker 可同时运行）；每个事件先在事务外执行 prepare（网络请求），
+    再在自己的事务中执行处理函数并删除事件，行锁只在这一个事件的事务内持有。
+    失败的事件按退避时间重新排队，达到 OUTBOX_MAX_ATTEMPTS 次后标记为失败不再处理
+    :return: {'claimed', 'processed', 'retried', 'failed'}
+    """
+    if batch_size is None:
+        batch_size = Config.OUTBOX_BATCH_SIZE
+    stats = {'claimed': 0, 'processed': 0, 'retried': 0, 'failed': 0}
+
+    events = _claim_batch(batch_size)
+    stats['claimed'] = len(events)
+
+    for event in events:
+        try:
+            if event['event_type'] not in _handlers:
+                raise ValueError(f"未注册的 outbox 事件类型: {event['event_type']}")
+            payload = dict(event['payload'] or {})
+            prepare = _preparers.get(event['event_type'])
+            if prepare is not None:
+                payload = prepare(str(event['user_id']), payload)
+            if _complete_event(event, payload):
+                stats['processed'] += 1
+        except Exception as e:
+            try:
+                attempts, failed = _fail_event(event, e)
+            except Exception as update_error:
+                # 记录失败本身也失败时，租约到期后事件会被重新领取
+                logger.error(f"outbox 事件 {event['id']} 失败状态写入失败: {update_error}")
+                continue
+            stats['failed' if failed else 'retried'] += 1
+            logger.warning(
+                f"outbox 事件处理失败 | id={event['id']} | type={event['event_type']} | "
+                f"attempt={attempts} | {'放弃' if failed else '稍后重试'}: {e}"
+            )
+
+    return stats
+
+
+def get_outbox_backlog() -> dict:
+    """待处理与已放弃的事件数"""
+    with get_db_cursor(commit_on_success=False) as cursor:
+        cursor.execute("""
+            SELECT COUNT(*) FILTER (WHERE failed_at IS NULL) AS pending,
+                   COUNT(*) FILTER (WHERE failed_at IS NOT NULL) AS failed
+            FROM taReputationOutbox
+        """)
+        row = cursor.fetchone()
+        return {'pending': row['pending'], 'failed': row['failed']}
@@ -1,71 +1,150 @@
-from models.database import get_db_cursor, get_db, close_db
+from models.database import get_db_cursor, get_db, close_db, with_db_retry, run_commit_callbacks
+from models.statements import prepared_statement
+from models import leaderboard, outbox
 from utils.validators import validate_user_id
+from utils.metrics import Counter, Histogram
+from config import Config
+import csv
+import io
+import time
 import utils
 
 from models.database import get_db_cursor, get_db, close_db
 
-def process_pending_deletions(logger):
+# 显式列出结果列：预备语句的结果类型在 PREPARE 时固定
+_reputation_by_user = prepared_statement('ta_reputation_by_user', """
+    SELECT id, user_id, score, is_contributor, has_github_login, is_banned, banned_at,
+           created_at, last_updated
+    FROM taUsersReputation WHERE user_id = %s
+""")
+
+DELETION_USERS = Counter(
+    'teealloy_deletion_users_total',
+    'Users handled by the pending-deletion job, by outcome (deleted/failed)',
+    labelnames=('outcome',),
+)
+DELETION_CHUNK_DURATION = Histogram(
+    'teealloy_deletion_chunk_duration_seconds',
+    'Duration of one pending-deletion chunk (one transaction, including retries)',
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+
+@with_db_retry
+def _process_deletion_chunk(chunk_size, exclude_ids, logger):
     """
-    自动处理待删除用户：删除到期的用户账户
+    处理一批到期的删除任务（一个事务）
+    SKIP LOCKED 让多个节点可以同时运行；先整批删除，失败时退回逐行删除，单行失败只回滚该行
+    :return: (claimed, deleted_ids, failed_ids)
     """
-    conn = None
-    try:
-        conn = get_db()
-        cursor = conn.cursor()
-
-        # 查询所有到期且未处理的删除请求
+    with get_db_cursor() as cursor:
         cursor.execute("""
-            SELECT user_id FROM taPendingDeletion
-            WHERE deletion_due <= NOW() 
+            SELECT id, user_id FROM taPendingDeletion
+            WHERE deletion_due <= NOW()
               AND is_processed = FALSE
-            FOR UPDATE SKIP LOCKED  -- 避免并发问题
-        """)
-
+              AND id <> ALL(%s::int[])
+            ORDER BY deletion_due, id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (list(exclude_ids), chunk_size))
         rows = cursor.fetchall()
         if not rows:
-            logger.info("没有待处理的删除任务")
-            return
+            return 0, [], []
 
-        deleted_count = 0
+        # 依赖 ON DELETE CASCADE：删除 taUsers 即删除该用户的全部数据（包括这条删除任务）
+        user_ids = [str(row['user_id']) for row in rows]
+        cursor.execute("SAVEPOINT ta_deletion_chunk")
+        try:
+            cursor.execute("DELETE FROM taUsers WHERE id = ANY(%s::uuid[])", (user_ids,))
+            cursor.execute("""
+                UPDATE taPendingDeletion SET is_processed = TRUE
+                WHERE id = ANY(%s::int[])
+            """, ([row['id'] for row in rows],))
+            cursor.execute("RELEASE SAVEPOINT ta_deletion_chunk")
+            return len(rows), [row['id'] for row in rows], []
+        except Exception as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT ta_deletion_chunk")
+            logger.warning(f"整批删除失败，改为逐个删除: {e}")
+
+        deleted, failed = [], []
         for row in rows:
             user_id = row['user_id']
+            cursor.execute("SAVEPOINT ta_deletion_row")
             try:
-                # 开始删除用户数据（按外键依赖顺序）
-                # 注意：taUsersReputation、taUserGitHub 等表有外键引用 taUsers
-
-                # 方法1：依赖 ON DELETE CASCADE（推荐）
-                # 如果所有表都设置了 ON DELETE CASCADE，则只需删 taUsers
                 cursor.execute("DELETE FROM taUsers WHERE id = %s", (user_id,))
-
-                # 标记为已处理
                 cursor.execute("""
                     UPDATE taPendingDeletion 
                     SET is_processed = TRUE 
-                    WHERE user_id = %s
-                """, (user_id,))
-
-                logger.info(f"已自动删除用户: {user_id}")
-                deleted_count += 1
-
+                    WHERE id = %s
+                """, (row['id'],))
+                cursor.execute("RELEASE SAVEPOINT ta_deletion_row")
+                logger.debug(f"已自动删除用户: {user_id}")
+                deleted.append(row['id'])
             except Exception as e:
+                cursor.execute("ROLLBACK TO SAVEPOINT ta_deletion_row")
                 logger.error(f"删除用户 {user_id} 失败: {e}")
-                continue
+                failed.append(row['id'])
+        return len(rows), deleted, failed
 
-        conn.commit()
-        logger.info(f"本次任务完成，共删除 {deleted_count} 个用户")
+def process_pending_deletions(logger, chunk_size=None, time_budget=None):
+    """
+    自动处理待删除用户：按批删除到期的用户账户，每批单独提交
+    :param chunk_size: 每批条数，默认 DELETION_CHUNK_SIZE
+    :param time_budget: 本次运行的时间预算（秒），用完后在批次之间停止，剩余任务留给下次；
+                        默认 DELETION_TIME_BUDGET，0 表示不限
+    :return: 统计字典 {chunks, deleted, failed, seconds, budget_exhausted}
+    """
+    chunk_size = chunk_size or Config.DELETION_CHUNK_SIZE
+    time_budget = Config.DELETION_TIME_BUDGET if time_budget is None else time_budget
+
+    started = time.monotonic()
+    failed_ids = set()
+    stats = {'chunks': 0, 'deleted': 0, 'failed': 0, 'seconds': 0.0, 'budget_exhausted': False}
+
+    while True:
+        if time_budget and time.monotonic() - started >= time_budget:
+            stats['budget_exhausted'] = True
+            logger.warning(f"已用完时间预算 {time_budget}s，剩余任务留给下次运行")
+            break
+
+        chunk_started = time.monotonic()
+        try:
+            claimed, deleted, failed = _process_deletion_chunk(chunk_size, failed_ids, logger)
+        except Exception as e:
+            DELETION_CHUNK_DURATION.observe(time.monotonic() - chunk_started)
+            logger.error(f"处理待删除用户时发生严重错误: {e}")
+            break
+        if not claimed:
+            break
+
+        DELETION_CHUNK_DURATION.observe(time.monotonic() - chunk_started)
+        DELETION_USERS.inc(len(deleted), outcome='deleted')
+        DELETION_USERS.inc(len(failed), outcome='failed')
+
+        failed_ids.update(failed)
+        stats['chunks'] += 1
+        stats['deleted'] += len(deleted)
+        stats['failed'] += len(failed)
+        elapsed = time.monotonic() - started
+        logger.info(
+            f"第 {stats['chunks']} 批: 删除 {len(deleted)}，失败 {len(failed)} | "
+            f"累计删除 {stats['deleted']}，{stats['deleted'] / elapsed if elapsed > 0 else 0:.1f} 个/秒"
+        )
 
-    except Exception as e:
-        if conn:
-            conn.rollback()
-        logger.error(f"处理待删除用户时发生严重错误: {e}")
-    finally:
-        if conn:
-            close_db(conn)
+    stats['seconds'] = time.monotonic() - started
+    if stats['chunks'] == 0 and not stats['budget_exhausted']:
+        logger.info("没有待处理的删除任务")
+    else:
+        logger.info(
+            f"本次任务完成，共删除 {stats['deleted']} 个用户，失败 {stats['failed']} 个，"
+            f"{stats['chunks']} 批，耗时 {stats['seconds']:.1f}s"
+        )
+    return stats
 
+@with_db_retry
 def update_reputation(user_id, change_type, amount, related_user_id=None, description="", cursor=None):
     """
     更新用户声望
-    cursor: 如果传入游标，则在现有事务中操作，否则创建新事务
+    cursor: 如果传入游标，则在现有事务中操作，否则创建新事务（遇到瞬时错误时整体重试）
     """
     validate_user_id(user_id)
     if related_user_id:
@@ -117,12 +196,178 @@ def _update_reputation_with_cursor(cursor, user_id, change_type, amount, related
         VALUES (%s, %s, %s, %s, %s, %s, %s)
     """, (user_id, change_type, amount, old_score, new_score, related_user_id, description))
 
+    leaderboard.record_score(cursor, user_id, new_score)
+
     # 检查是否需要加入待删除队列
     if new_score == 0:
         schedule_for_deletion(user_id, cursor)
     else:
         cancel_deletion(user_id, cursor)
 
+# 批量声望变更：锁按 user_id 排序获取，避免与并发的批量变更互相死锁；
+# 更新分数与写日志在同一条语句中完成。input 为 (user_id, amount, related_user_id, description)
+_APPLY_CHANGES_BODY = """
+    locked AS (
+        SELECT r.user_id, r.score
+        FROM taUsersReputation r
+        JOIN input i ON i.user_id = r.user_id
+        ORDER BY r.user_id
+        FOR UPDATE OF r
+    ),
+    updated AS (
+        UPDATE taUsersReputation r
+        SET score = GREATEST(0, LEAST(100, l.score + i.amount)),
+            has_github_login = r.has_github_login OR %(change_type)s = 'github_login',
+            is_contributor = r.is_contributor OR %(change_type)s = 'teeworlds_contributor',
+            last_updated = NOW()
+        FROM locked l
+        JOIN input i ON i.user_id = l.user_id
+        WHERE r.user_id = l.user_id
+        RETURNING r.user_id, l.score AS old_score, r.score AS new_score
+    ),
+    logged AS (
+        INSERT INTO taUsersReputationLogs
+        (user_id, change_type, change_amount, old_score, new_score, related_user_id, description)
+        SELECT u.user_id, %(change_type)s, i.amount, u.old_score, u.new_score, i.related_user_id, i.description
+        FROM updated u
+        JOIN input i ON i.user_id = u.user_id
+    )
+    SELECT user_id, old_score, new_score FROM updated
+"""
+
+_APPLY_CHANGES_SQL = """
+    WITH input AS (
+        SELECT *
+        FROM unnest(%(user_ids)s::uuid[], %(amounts)s::int[], %(related)s::uuid[], %(descriptions)s::text[])
+             AS t(user_id, amount, related_user_id, description)
+    ),
+""" + _APPLY_CHANGES_BODY
+
+# 批量调整：input 取自 COPY 写入的临时表中的一段（按 user_id 排序编号）
+_APPLY_STAGED_SQL = """
+    WITH input AS (
+        SELECT user_id, amount, %(related_user_id)s::uuid AS related_user_id, reason AS description
+        FROM ta_reputation_adjust
+        WHERE seq > %(lo)s AND seq <= %(hi)s
+    ),
+""" + _APPLY_CHANGES_BODY
+
+def apply_reputation_changes(cursor, change_type, changes):
+    """
+    在调用方事务中批量变更声望，效果与逐个调用 update_reputation 相同，但只用固定几条语句
+    :param change_type: 日志中的 change_type，所有条目相同
+    :param changes: [(user_id, amount, related_user_id, description), ...]，user_id 不能重复
+    :return: [{'user_id', 'old_score', 'new_score'}, ...]
+    """
+    if not changes:
+        return []
+    user_ids = [str(validate_user_id(c[0])) for c in changes]
+    if len(set(user_ids)) != len(user_ids):
+        raise ValueError("批量声望变更中存在重复的用户")
+
+    # 没有声望记录的用户先补一条 0 分记录（与 update_reputation 的插入分支等价）
+    cursor.execute("""
+        INSERT INTO taUsersReputation (user_id, score)
+        SELECT unnest(%s::uuid[]), 0
+        ON CONFLICT (user_id) DO NOTHING
+    """, (user_ids,))
+
+    cursor.execute(_APPLY_CHANGES_SQL, {
+        'user_ids': user_ids,
+        'amounts': [int(c[1]) for c in changes],
+        'related': [str(c[2]) if c[2] else None for c in changes],
+        'descriptions': [c[3] or "" for c in changes],
+        'change_type': change_type,
+    })
+    results = cursor.fetchall()
+
+    leaderboard.record_scores(cursor, [(r['user_id'], r['new_score']) for r in results])
+    schedule_for_deletions([r['user_id'] for r in results if r['new_score'] == 0], cursor)
+    cancel_deletions([r['user_id'] for r in results if r['new_score'] != 0], cursor)
+    return results
+
+def bulk_adjust_reputation(cursor, adjustments, related_user_id=None, batch_size=None):
+    """
+    在调用方事务中批量执行 manual_adjust：COPY 写入临时表后按 user_id 顺序分批套用集合式变更，
+    日志与待删除队列同样批量写入
+    :param adjustments: [(user_id, amount, reason), ...]，user_id 不能重复
+    :return: {'applied', 'batches', 'scheduled_for_deletion'}
+    """
+    if batch_size is None:
+        batch_size = Config.BULK_ADJUST_BATCH_SIZE
+    stats = {'applied': 0, 'batches': 0, 'scheduled_for_deletion': 0}
+    if not adjustments:
+        return stats
+    if related_user_id:
+        validate_user_id(related_user_id)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for user_id, amount, reason in adjustments:
+        writer.writerow((user_id, int(amount), reason or ""))
+    buffer.seek(0)
+
+    cursor.execute("""
+        CREATE TEMP TABLE ta_reputation_adjust_raw (user_id UUID, amount INTEGER, reason TEXT)
+        ON COMMIT DROP
+    """)
+    cursor.copy_expert(
+        "COPY ta_reputation_adjust_raw (user_id, amount, reason) FROM STDIN WITH (FORMAT csv)", buffer
+    )
+
+    cursor.execute("""
+        SELECT user_id FROM ta_reputation_adjust_raw
+        GROUP BY user_id HAVING COUNT(*) > 1
+        LIMIT 10
+    """)
+    duplicates = [str(row['user_id']) for row in cursor.fetchall()]
+    if duplicates:
+        raise ValueError(f"批量调整中存在重复的用户: {', '.join(duplicates)}")
+
+    cursor.execute("""
+        SELECT a.user_id FROM ta_reputation_adjust_raw a
+        LEFT JOIN taUsers u ON u.id = a.user_id
+        WHERE u.id IS NULL
+        LIMIT 10
+    """)
+    missing = [str(row['user_id']) for row in cursor.fetchall()]
+    if missing:
+        raise ValueError(f"用户不存在: {', '.join(missing)}")
+
+    # 按 user_id 编号后分批：每批内部与批与批之间都按同一顺序加锁
+    cursor.execute("""
+        CREATE TEMP TABLE ta_reputation_adjust ON COMMIT DROP AS
+        SELECT ROW_NUMBER() OVER (ORDER BY user_id) AS seq, user_id, amount, reason
+        FROM ta_reputation_adjust_raw
+    """)
+    cursor.execute("""
+        INSERT INTO taUsersReputation (user_id, score)
+        SELECT user_id, 0 FROM ta_reputation_adjust
+        ON CONFLICT (user_id) DO NOTHING
+    """)
+
+    total = len(adjustments)
+    for lo in range(0, total, batch_size):
+        cursor.execute(_APPLY_STAGED_SQL, {
+            'lo': lo,
+            'hi': lo + batch_size,
+            'related_user_id': related_user_id,
+            'change_type': 'manual_adjust',
+        })
+        results = cursor.fetchall()
+
+        zeroed = [r['user_id'] for r in results if r['new_score'] == 0]
+        leaderboard.record_scores(cursor, [(r['user_id'], r['new_score']) for r in results])
+        schedule_for_deletions(zeroed, cursor)
+        cancel_deletions([r['user_id'] for r in results if r['new_score'] != 0], cursor)
+
+        stats['applied'] += len(results)
+        stats['scheduled_for_deletion'] += len(zeroed)
+        stats['batches'] += 1
+
+    cursor.execute("DROP TABLE ta_reputation_adjust, ta_reputation_adjust_raw")
+    return stats
+
 def schedule_for_deletion(user_id, cursor=None):
     validate_user_id(user_id)
     if cursor:
@@ -147,11 +392,29 @@ def cancel_deletion(user_id, cursor=None):
         with get_db_cursor() as new_cursor:
             new_cursor.execute("DELETE FROM taPendingDeletion WHERE user_id = %s", (user_id,))
 
+def schedule_for_deletions(user_ids, cursor):
+    """批量版 schedule_for_deletion，在调用方事务中执行"""
+    if user_ids:
+        cursor.execute("""
+            INSERT INTO taPendingDeletion (user_id, deletion_due)
+            SELECT unnest(%s::uuid[]), NOW() + INTERVAL '7 days'
+            ON CONFLICT (user_id) DO NOTHING
+        """, (list(user_ids),))
+
+def cancel_deletions(user_ids, cursor):
+    """批量版 cancel_deletion，在调用方事务中执行"""
+    if user_ids:
+        cursor.execute(
+            "DELETE FROM taPendingDeletion WHERE user_id = ANY(%s::uuid[])",
+            (list(user_ids),)
+        )
+
+@with_db_retry
 def get_user_reputation(user_id):
     """获取用户声望信息"""
     validate_user_id(user_id)
-    with get_db_cursor() as cursor:
-        cursor.execute("SELECT * FROM taUsersReputation WHERE user_id = %s", (user_id,))
+    with get_db_cursor(commit_on_success=False, compact=True) as cursor:
+        _reputation_by_user.execute(cursor, (user_id,))
         return cursor.fetchone()
 
 def make_full_reputation(user_id):
@@ -165,6 +428,8 @@ def make_full_reputation(user_id):
 
 def on_github_login(user_id, github_info):
     validate_user_id(user_id)
+    # 贡献者检查需要请求 GitHub API：未开启 outbox 时在开事务之前完成，开启时由 worker 在事务外完成
+    payload = outbox.prepare_inline('github_login', user_id, {'login': github_info['login']})
     with get_db_cursor() as cursor:
         # 绑定 GitHub
         cursor.execute("""
@@ -176,18 +441,38 @@ def on_github_login(user_id, github_info):
                 avatar_url = EXCLUDED.avatar_url
         """, (user_id, github_info['id'], github_info['login'], github_info['avatar_url']))
 
-        # +30 声望
+        # 加分与贡献者加分：开启 outbox 时交给 worker
+        outbox.dispatch(cursor, 'github_login', user_id, payload)
+
+def _prepare_github_login(user_id, payload):
+    """事务外查询贡献者身份，结果存入 payload"""
+    if 'is_contributor' not in payload:
+        payload = dict(payload, is_contributor=bool(utils.is_teeworlds_contributor(payload['login'])))
+    return payload
+
+@outbox.register_handler('github_login', prepare=_prepare_github_login)
+def _apply_github_login(cursor, user_id, payload):
+    login = payload['login']
+    # +30 声望
+    update_reputation(
+        user_id=user_id,
+        change_type='github_login',
+        amount=30,
+        description=f"通过 GitHub 登录: {login}",
+        cursor=cursor
+    )
+
+    # 是否是 Teeworlds 贡献者（已由 _prepare_github_login 在事务外查询）
+    if payload.get('is_contributor'):
         update_reputation(
             user_id=user_id,
-            change_type='github_login',
-            amount=30,
-            description=f"通过 GitHub 登录: {github_info['login']}"
+            change_type='teeworlds_contributor',
+            amount=100,
+            description="用户是 Teeworlds 项目贡献者",
+            cursor=cursor
         )
 
-        # 检查是否是 Teeworlds 贡献者
-        if utils.is_teeworlds_contributor(github_info['login']):
-            make_full_reputation(user_id)
-
+@with_db_retry
 def endorse_user(endorser_id, endorsee_id):
     validate_user_id(endorser_id)
     validate_user_id(endorsee_id)
@@ -240,16 +525,43 @@ def endorse_user(endorser_id, endorsee_id):
         if endorser_reputation['score'] > 80:
             score = 50
 
-        update_reputation(
-            user_id=endorsee_id,
-            change_type='endorsed_by_user',
-            amount=score,
-            related_user_id=endorser_id,
-            description=f"被用户 {endorser_id} 验证"
-        )
+        # 与验证记录在同一事务中加声望（或写入 outbox），整个验证可以安全重试
+        outbox.dispatch(cursor, 'endorsed', endorsee_id, {'endorser_id': str(endorser_id), 'amount': score})
         return
     raise PermissionError("数据库连接错误")
 
+@outbox.register_handler('endorsed')
+def _apply_endorsement(cursor, user_id, payload):
+    endorser_id = payload['endorser_id']
+    update_reputation(
+        user_id=user_id,
+        change_type='endorsed_by_user',
+        amount=payload['amount'],
+        related_user_id=endorser_id,
+        description=f"被用户 {endorser_id} 验证",
+        cursor=cursor
+    )
+
+def schedule_ban_cascade(banned_user_id, cursor):
+    """
+    封禁的连带处理（撤销其做出的验证并扣分）
+    开启 outbox 时只写入一条事件，由 worker 执行 on_user_ban；否则在调用方事务中直接执行
+    """
+    validate_user_id(banned_user_id)
+    outbox.dispatch(cursor, 'user_banned', banned_user_id)
+
+@outbox.register_handler('user_banned')
+def _apply_user_ban(cursor, user_id, payload):
+    # 事件入队后用户可能已被解封：锁住声望行确认仍处于封禁状态，否则丢弃事件
+    cursor.execute(
+        "SELECT is_banned FROM taUsersReputation WHERE user_id = %s FOR UPDATE",
+        (user_id,)
+    )
+    row = cursor.fetchone()
+    if row is None or not row['is_banned']:
+        return
+    on_user_ban(user_id, cursor=cursor)
+
 def on_user_ban(banned_user_id, cursor=None):
     """
     处理用户被封禁后的逻辑
@@ -263,30 +575,20 @@ def on_user_ban(banned_user_id, cursor=None):
         cursor = conn.cursor()
 
     try:
-        # 查找所有由该用户验证的记录
+        # 一次性作废该用户做出的所有验证，并取回被验证者
         cursor.execute("""
-            SELECT endorsee_id FROM taCreditEndorsements
+            UPDATE taCreditEndorsements
+            SET is_valid = FALSE, invalidated_at = NOW()
             WHERE endorser_id = %s AND is_valid = TRUE
+            RETURNING endorsee_id
         """, (banned_user_id,))
+        endorsee_ids = sorted({str(row['endorsee_id']) for row in cursor.fetchall()})
         
-        for row in cursor.fetchall():
-            endorsee_id = row['endorsee_id']
-            validate_user_id(endorsee_id)  # 验证被验证者ID
-            
-            cursor.execute("""
-                UPDATE taCreditEndorsements
-                SET is_valid = FALSE, invalidated_at = NOW()
-                WHERE endorser_id = %s AND endorsee_id = %s
-            """, (banned_user_id, endorsee_id))
-            
-            update_reputation(
-                user_id=endorsee_id,
-                change_type='endorsement_revoked',
-                amount=-30,
-                related_user_id=banned_user_id,
-                description="因验证者被封禁，声望被撤销",
-                cursor=cursor  # 复用事务
-            )
+        # 被验证者批量扣除声望（复用事务）
+        apply_reputation_changes(cursor, 'endorsement_revoked', [
+            (endorsee_id, -30, banned_user_id, "因验证者被封禁，声望被撤销")
+            for endorsee_id in endorsee_ids
+        ])
         
         # 验证者自身声望也下降
         update_reputation(
@@ -299,6 +601,7 @@ def on_user_ban(banned_user_id, cursor=None):
 
         if own_cursor:
             conn.commit()
+            run_commit_callbacks(conn)
     except Exception as e:
         if own_cursor:
             conn.rollback()
@@ -307,30 +610,36 @@ def on_user_ban(banned_user_id, cursor=None):
         if own_cursor:
             close_db(conn)
 
-def is_user_banned(user_id):
+def set_ban_state(user_id, banned, cursor):
     """
-    检查用户是否被封禁
-    通过检查声望日志中是否有封禁记录且当前声望为0来判断
+    写入物化的封禁状态（taUsersReputation.is_banned / banned_at）
+    必须与封禁/解封的声望变更在同一事务中调用
     """
     validate_user_id(user_id)
-    
-    with get_db_cursor() as cursor:
-        # 获取当前声望分数
-        cursor.execute("SELECT score FROM taUsersReputation WHERE user_id = %s", (user_id,))
-        reputation = cursor.fetchone()
-        
-        if not reputation or reputation['score'] != 0:
-            return False  # 声望不为0，肯定没被封禁
-        
-        # 检查是否有封禁记录
-        cursor.execute("""
-            SELECT EXISTS(
-                SELECT 1 FROM taUsersReputationLogs 
-                WHERE user_id = %s 
-                AND change_type = 'penalty' 
-                AND description LIKE %s
-            ) AS has_ban_record
-        """, (user_id, '%封禁%'))
+    cursor.execute("""
+        UPDATE taUsersReputation
+        SET is_banned = %s,
+            banned_at = CASE WHEN %s THEN NOW() ELSE NULL END
+        WHERE user_id = %s
+    """, (banned, banned, user_id))
+
+_first_2fa_count = prepared_statement(
+    'ta_first_2fa_count', "SELECT first_2fa_count FROM taUsersReputationLogRollup WHERE user_id = %s"
+)
+
+def has_first_2fa_reward(user_id, cursor=None):
+    """
+    检查用户是否已获得过首次 2FA 验证奖励
+    读取声望日志汇总表，旧日志分区被清理后结果不变
+    结果决定是否发放奖励，不传 cursor 时也读主库（副本滞后会导致重复发放）；
+    要与发放串行化时传入已锁住该用户声望行的 cursor
+    """
+    validate_user_id(user_id)
+    if cursor:
+        _first_2fa_count.execute(cursor, (user_id,))
         result = cursor.fetchone()
-        
-        return result['has_ban_record'] if result else False
+    else:
+        with get_db_cursor(compact=True) as new_cursor:
+            _first_2fa_count.execute(new_cursor, (user_id,))
+            result = new_cursor.fetchone()
+    return bool(result and result['first_2fa_count'] > 0)
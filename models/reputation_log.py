@@ -0,0 +1,109 @@
+# models/reputation_log.py
+from models.database import get_db_cursor
+from config import Config
+from datetime import date, datetime, timezone
+import re
+
+# ==============================
+# 声望日志分区维护
+# ==============================
+# taUsersReputationLogs 按 created_at 的 UTC 月份分区，分区名为 tausersreputationlogs_pYYYYMM。
+# 读取方只依赖 taUsersReputationLogRollup 中的汇总值，旧分区可以整块分离删除，
+# 不需要逐行 DELETE，也不会留下需要 VACUUM 的死元组。
+
+_PARTITION_RE = re.compile(r"^tausersreputationlogs_p(\d{4})(\d{2})$")
+_DEFAULT_PARTITION = "tausersreputationlogs_default"
+
+
+def _current_month() -> date:
+    today = datetime.now(timezone.utc).date()
+    return today.replace(day=1)
+
+
+def _add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def ensure_partitions(months_ahead=None) -> int:
+    """创建当前月及之后 months_ahead 个月中缺失的分区，返回新建的个数"""
+    if months_ahead is None:
+        months_ahead = Config.REPUTATION_LOG_PREMAKE_MONTHS
+    current = _current_month()
+    with get_db_cursor() as cursor:
+        cursor.execute(
+            "SELECT create_reputation_log_partitions(%s, %s) AS created",
+            (current, _add_months(current, max(0, months_ahead)))
+        )
+        return cursor.fetchone()['created']
+
+
+def list_partitions(cursor) -> list:
+    """[(分区名, 月份)]，按月份升序；兜底分区不在其中"""
+    cursor.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'tausersreputationlogs'::regclass
+    """)
+    partitions = []
+    for row in cursor.fetchall():
+        match = _PARTITION_RE.match(row['relname'])
+        if match:
+            partitions.append((row['relname'], date(int(match.group(1)), int(match.group(2)), 1)))
+    partitions.sort(key=lambda p: p[1])
+    return partitions
+
+
+def prune_partitions(logger, retention_months=None, drop=True, lock_timeout_ms=5000) -> dict:
+    """
+    分离早于保留期的月分区（每个分区一个事务），drop 为 True 时随后删除
+    汇总值由触发器在写入时维护，分离分区不影响 taUsersReputationLogRollup
+    拿不到父表锁时跳过该分区，下次运行再处理
+    :return: {'detached': [...], 'dropped': [...], 'skipped': [...], 'default_rows_deleted': n}
+    """
+    if retention_months is None:
+        retention_months = Config.REPUTATION_LOG_RETENTION_MONTHS
+    stats = {'detached': [], 'dropped': [], 'skipped': [], 'default_rows_deleted': 0}
+    if retention_months <= 0:
+        logger.info("REPUTATION_LOG_RETENTION_MONTHS 为 0，不清理声望日志")
+        return stats
+
+    cutoff = _add_months(_current_month(), -retention_months)
+    # 分区列表决定要在主库上 DETACH/DROP 什么，必须读主库的系统表，不能走可能滞后的副本
+    with get_db_cursor() as cursor:
+        expired = [name for name, month in list_partitions(cursor) if month < cutoff]
+
+    for name in expired:
+        try:
+            with get_db_cursor() as cursor:
+                cursor.execute(f"SET LOCAL lock_timeout = {int(lock_timeout_ms)}")
+                cursor.execute(f"ALTER TABLE taUsersReputationLogs DETACH PARTITION {name}")
+                if drop:
+                    cursor.execute(f"DROP TABLE {name}")
+        except Exception as e:
+            stats['skipped'].append(name)
+            logger.warning(f"分离声望日志分区 {name} 失败，下次运行重试: {e}")
+            continue
+        stats['detached'].append(name)
+        if drop:
+            stats['dropped'].append(name)
+        logger.info(f"已{'删除' if drop else '分离'}声望日志分区 {name}")
+
+    # 兜底分区里只应有零星数据（月分区未及时创建时写入的），同样按保留期清理
+    with get_db_cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {_DEFAULT_PARTITION} WHERE created_at < %s",
+            (datetime(cutoff.year, cutoff.month, 1, tzinfo=timezone.utc),)
+        )
+        stats['default_rows_deleted'] = cursor.rowcount
+        cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {_DEFAULT_PARTITION}) AS has_rows")
+        if cursor.fetchone()['has_rows']:
+            logger.warning("声望日志兜底分区中有数据，请检查月分区是否按时创建")
+
+    logger.info(
+        f"声望日志清理完成 | 保留 {retention_months} 个月 | 截止 {cutoff} | "
+        f"分离 {len(stats['detached'])} | 跳过 {len(stats['skipped'])} | "
+        f"兜底分区删除 {stats['default_rows_deleted']} 行"
+    )
+    return stats
@@ -0,0 +1,137 @@
+# models/slow_query_log.py
+from config import Config
+from utils.metrics import Counter
+from collections import deque
+from datetime import datetime, timezone
+import logging
+import random
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+# ==============================
+# 慢查询日志
+# ==============================
+# TrackingCursor 对每次 execute 计时，超过 DB_SLOW_QUERY_MS 的记入进程内环形缓冲（管理面板可查看）。
+# 只记录参数的类型与长度，不记录参数值（可能包含 token、密码哈希等）。
+# 按 DB_SLOW_QUERY_EXPLAIN_RATE 抽样，对只读 SELECT 在 SAVEPOINT 中补跑 EXPLAIN (ANALYZE, BUFFERS)。
+
+SLOW_QUERIES = Counter(
+    'teealloy_db_slow_queries_total',
+    'Queries slower than DB_SLOW_QUERY_MS',
+    labelnames=('statement',),
+)
+
+_MAX_SQL_LENGTH = 2000
+_WHITESPACE_RE = re.compile(r"\s+")
+# 可以安全补跑 EXPLAIN ANALYZE 的语句：纯 SELECT，且不加行锁
+_EXPLAINABLE_RE = re.compile(r"^\s*SELECT\b", re.IGNORECASE)
+_LOCKING_RE = re.compile(r"\bFOR\s+(NO\s+KEY\s+)?(UPDATE|SHARE|KEY\s+SHARE)\b", re.IGNORECASE)
+
+_entries = deque(maxlen=max(1, Config.DB_SLOW_QUERY_LOG_SIZE))
+_lock = threading.Lock()
+
+
+def is_enabled() -> bool:
+    return Config.DB_SLOW_QUERY_MS > 0
+
+
+def threshold_seconds() -> float:
+    return Config.DB_SLOW_QUERY_MS / 1000.0
+
+
+def normalize_sql(sql) -> str:
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    elif not isinstance(sql, str):
+        sql = str(sql)
+    sql = _WHITESPACE_RE.sub(" ", sql).strip()
+    return sql[:_MAX_SQL_LENGTH]
+
+
+def default_statement_name(sql) -> str:
+    """未命名的查询用规范化后 SQL 的前 60 个字符标识"""
+    return normalize_sql(sql)[:60]
+
+
+def describe_params(params):
+    """参数形状：只保留类型（序列附带长度），不含取值"""
+    if params is None:
+        return []
+    if isinstance(params, dict):
+        return {key: describe_params([value])[0] for key, value in params.items()}
+    shape = []
+    for value in params:
+        if isinstance(value, (list, tuple)):
+            shape.append(f"{type(value).__name__}[{len(value)}]")
+        else:
+            shape.append(type(value).__name__)
+    return shape
+
+
+def should_explain(sql) -> bool:
+    rate = Config.DB_SLOW_QUERY_EXPLAIN_RATE
+    if rate <= 0 or not isinstance(sql, str):
+        return False
+    if not _EXPLAINABLE_RE.match(sql) or _LOCKING_RE.search(sql):
+        return False
+    return rate >= 1 or random.random() < rate
+
+
+def explain(connection, sql, params):
+    """在独立游标与 SAVEPOINT 中补跑 EXPLAIN ANALYZE，失败时回滚到保存点，不影响调用方事务"""
+    import psycopg2.extensions
+
+    cursor = connection.cursor(cursor_factory=psycopg2.extensions.cursor)
+    try:
+        cursor.execute("SAVEPOINT ta_slow_query_explain")
+        try:
+            cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql, params)
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+            cursor.execute("RELEASE SAVEPOINT ta_slow_query_explain")
+            return plan
+        except Exception as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT ta_slow_query_explain")
+            cursor.execute("RELEASE SAVEPOINT ta_slow_query_explain")
+            return f"EXPLAIN 失败: {e}"
+    except Exception as e:
+        logger.warning(f"慢查询 EXPLAIN 失败: {e}")
+        return None
+    finally:
+        cursor.close()
+
+
+def record(name, sql, params, duration, connection_id, pool=None, plan=None, error=None):
+    """记录一条慢查询"""
+    entry = {
+        'recorded_at': datetime.now(timezone.utc),
+        'statement': name,
+        'sql': normalize_sql(sql),
+        'params': describe_params(params),
+        'duration_ms': round(duration * 1000, 2),
+        'connection_id': connection_id,
+        'pool': pool,
+        'plan': plan,
+        'error': error,
+    }
+    with _lock:
+        _entries.append(entry)
+    SLOW_QUERIES.inc(statement=name)
+    logger.warning(
+        f"Slow query | statement={name} | {entry['duration_ms']}ms | "
+        f"params={entry['params']} | conn={connection_id}"
+    )
+
+
+def get_slow_queries(limit=None) -> list:
+    """最近的慢查询，最新的在前"""
+    with _lock:
+        entries = list(_entries)
+    entries.reverse()
+    return entries[:limit] if limit else entries
+
+
+def clear_slow_queries():
+    with _lock:
+        _entries.clear()
@@ -0,0 +1,124 @@
+# models/statements.py
+from config import Config
+from models.database import PooledConnection, TrackingCursorMixin
+from utils.metrics import Histogram
+import logging
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+STATEMENT_DURATION = Histogram(
+    'teealloy_db_statement_duration_seconds',
+    'Execution time of named queries (including a first-use PREPARE)',
+    labelnames=('statement',),
+)
+
+
+# ==============================
+# 预备语句注册表
+# ==============================
+# 高频查询以名称注册，在每个池化连接上第一次使用时 PREPARE，之后用 EXECUTE 执行，
+# 省掉每次的解析与规划。预备语句属于会话（不受事务回滚影响），记录在连接对象上；
+# 连接关闭重建后自然重新 PREPARE。DB_PREPARED_STATEMENTS=0 时直接执行原 SQL。
+# 注意：经 PgBouncer 事务池模式连接时不能开启。
+
+_PLACEHOLDER_RE = re.compile(r"%%|%s")
+_NAME_RE = re.compile(r"^[a-z_][a-z0-9_]*$")
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _to_server_placeholders(sql):
+    """把 psycopg2 风格的 %s / %% 转成 PREPARE 使用的 $1..$n / %，返回 (sql, 参数个数)"""
+    count = 0
+
+    def repl(match):
+        nonlocal count
+        if match.group(0) == '%%':
+            return '%'
+        count += 1
+        return f"${count}"
+
+    return _PLACEHOLDER_RE.sub(repl, sql), count
+
+
+class PreparedStatement:
+    """一条命名查询；SQL 使用与 cursor.execute 相同的 %s 占位符"""
+
+    def __init__(self, name, sql, param_types=None):
+        if not _NAME_RE.match(name):
+            raise ValueError(f"invalid statement name: {name}")
+        self.name = name
+        self.sql = sql
+        self.server_sql, self.param_count = _to_server_placeholders(sql)
+        if param_types is not None and len(param_types) != self.param_count:
+            raise ValueError(f"statement {name}: expected {self.param_count} parameter types")
+        self.param_types = param_types
+        self.calls = 0
+        self.prepares = 0
+
+    def _prepare_sql(self):
+        types = f" ({', '.join(self.param_types)})" if self.param_types else ""
+        return f"PREPARE {self.name}{types} AS {self.server_sql}"
+
+    def _execute_sql(self):
+        if not self.param_count:
+            return f"EXECUTE {self.name}"
+        return f"EXECUTE {self.name} ({', '.join(['%s'] * self.param_count)})"
+
+    def execute(self, cursor, params=()):
+        """在 cursor 上执行；结果照常通过 cursor.fetchone() / fetchall() 读取"""
+        self.calls += 1
+        started = time.perf_counter()
+        try:
+            self._execute(cursor, params)
+        finally:
+            STATEMENT_DURATION.observe(time.perf_counter() - started, statement=self.name)
+
+    def _mark(self, cursor, params):
+        # 让慢查询日志按语句名记录，并能对原始 SQL 补跑 EXPLAIN
+        if isinstance(cursor, TrackingCursorMixin):
+            cursor.statement = (self.name, self.sql, params or None)
+
+    def _execute(self, cursor, params):
+        conn = cursor.connection
+        if not Config.DB_PREPARED_STATEMENTS or not isinstance(conn, PooledConnection):
+            self._mark(cursor, params)
+            cursor.execute(self.sql, params or None)
+            return
+
+        prepared = conn.prepared_statements
+        if prepared is None:
+            prepared = conn.prepared_statements = set()
+        if self.name not in prepared:
+            cursor.execute(self._prepare_sql())
+            prepared.add(self.name)
+            self.prepares += 1
+            logger.debug(f"已预备语句 {self.name} (连接: {conn.connection_id})")
+
+        self._mark(cursor, params)
+        cursor.execute(self._execute_sql(), params or None)
+
+
+def prepared_statement(name, sql, param_types=None) -> PreparedStatement:
+    """注册一条命名查询；同名重复注册时 SQL 必须一致"""
+    with _registry_lock:
+        existing = _registry.get(name)
+        if existing is not None:
+            if existing.sql != sql:
+                raise ValueError(f"statement {name} already registered with different SQL")
+            return existing
+        stmt = PreparedStatement(name, sql, param_types)
+        _registry[name] = stmt
+        return stmt
+
+
+def get_statement_stats() -> dict:
+    """每条命名查询的调用次数与 PREPARE 次数"""
+    return {
+        name: {'calls': stmt.calls, 'prepares': stmt.prepares}
+        for name, stmt in sorted(_registry.items())
+    }
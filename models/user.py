@@ -1,9 +1,20 @@
-from models.database import get_db_cursor
+from models.database import get_db_cursor, with_db_retry
+from models.statements import prepared_statement
+from models.game_token import invalidate_verification_cache
+from models.write_behind import user_last_login
 from utils.security import hash_password, check_password
 from utils.validators import validate_user_id
 import uuid
 import re
 
+# 预备语句的结果列在 PREPARE 时固定，这里显式列出而不用 SELECT *，避免加列后报
+# "cached plan must not change result type"
+_user_by_id = prepared_statement('ta_user_by_id', """
+    SELECT id, username, nickname, is_2fa_enabled, is_admin, password_hash,
+           created_at, updated_at, last_login
+    FROM taUsers WHERE id = %s
+""")
+
 def create_user(username, nickname, password):
     """创建新用户"""
     # 检查用户名格式
@@ -39,25 +50,30 @@ def get_user_by_username(username):
         return cursor.fetchone()
 
 def update_last_login(user_id):
-    """更新用户最后登录时间"""
+    """更新用户最后登录时间（启用写回缓冲时由后台批量写入）"""
     validate_user_id(user_id)
+    if user_last_login.enabled:
+        user_last_login.touch(user_id)
+        return
     with get_db_cursor() as cursor:
         cursor.execute(
             "UPDATE taUsers SET last_login = NOW() WHERE id = %s",
             (user_id,)
         )
 
+@with_db_retry
 def get_user_by_id(user_id):
     """根据ID获取用户信息"""
     validate_user_id(user_id)
-    with get_db_cursor() as cursor:
-        cursor.execute("SELECT * FROM taUsers WHERE id = %s", (user_id,))
+    with get_db_cursor(commit_on_success=False) as cursor:
+        _user_by_id.execute(cursor, (user_id,))
         return cursor.fetchone()
 
+@with_db_retry
 def get_user_github_info(user_id):
     """获取用户GitHub信息"""
     validate_user_id(user_id)
-    with get_db_cursor() as cursor:
+    with get_db_cursor(commit_on_success=False) as cursor:
         cursor.execute("SELECT github_login, avatar_url FROM taUserGitHub WHERE user_id = %s", (user_id,))
         return cursor.fetchone()
 
@@ -72,9 +88,10 @@ def get_user_totp_info(user_id):
         """, (user_id,))
         return cursor.fetchone()
 
+@with_db_retry
 def get_user_game_token_info(user_id):
     """获取用户的 game token 元数据（不含明文）"""
-    with get_db_cursor() as cursor:
+    with get_db_cursor(commit_on_success=False) as cursor:
         cursor.execute("""
             SELECT created_at, updated_at, last_used_at
             FROM taUserGame
@@ -126,4 +143,5 @@ def update_user_nickname(user_id, new_nickname):
         cursor.execute(
             "UPDATE taUsers SET nickname = %s WHERE id = %s",
             (new_nickname, user_id)
-        )
\ No newline at end of file
+        )
+        invalidate_verification_cache(user_id, cursor)
\ No newline at end of file
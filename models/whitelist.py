@@ -1,12 +1,87 @@
 # models/whitelist.py
-from models.database import get_db_cursor
+from models.database import get_db_cursor, with_db_retry
+from models.statements import prepared_statement
+from config import Config
 from utils import hash_api_key
 import logging
+import threading
+import time
 from typing import List, Dict, Optional
 
 logger = logging.getLogger(__name__)
 
 
+# ==============================
+# 白名单快照
+# ==============================
+# 白名单极少变化却在每个 API 请求上被读取：进程内保存 (server_address, api_key_hash) 集合，
+# 至多每 WHITELIST_REFRESH_INTERVAL 秒查一次 taCacheVersions 中的版本号（由触发器维护），
+# 版本变化时才重新加载整表；本进程内的增删会立即让快照失效。
+
+_snapshot = None            # frozenset[(server_address, api_key_hash)]
+_snapshot_version = None
+_snapshot_checked_at = 0.0
+_snapshot_lock = threading.Lock()
+
+_whitelist_version = prepared_statement(
+    'ta_whitelist_version', "SELECT version FROM taCacheVersions WHERE name = 'whitelist'"
+)
+_whitelist_entries = prepared_statement(
+    'ta_whitelist_entries', "SELECT server_address, api_key_hash FROM taWhiteListServers"
+)
+
+
+@with_db_retry
+def _refresh_snapshot():
+    global _snapshot, _snapshot_version, _snapshot_checked_at
+    with get_db_cursor(commit_on_success=False, compact=True) as cursor:
+        _whitelist_version.execute(cursor)
+        row = cursor.fetchone()
+        version = row['version'] if row else None
+
+        if _snapshot is None or version is None or version != _snapshot_version:
+            _whitelist_entries.execute(cursor)
+            _snapshot = frozenset(
+                (r['server_address'], r['api_key_hash']) for r in cursor.fetchall()
+            )
+            _snapshot_version = version
+            logger.info(f"Whitelist snapshot loaded: {len(_snapshot)} entries (version={version})")
+
+    _snapshot_checked_at = time.monotonic()
+
+
+def get_whitelist_snapshot() -> frozenset:
+    """获取白名单快照，必要时检查版本号并重新加载"""
+    # 全局变量只读一次：判断与返回之间可能被其他线程替换
+    snapshot = _snapshot
+    if snapshot is not None and time.monotonic() - _snapshot_checked_at < Config.WHITELIST_REFRESH_INTERVAL:
+        return snapshot
+
+    with _snapshot_lock:
+        snapshot = _snapshot
+        if snapshot is not None and time.monotonic() - _snapshot_checked_at < Config.WHITELIST_REFRESH_INTERVAL:
+            return snapshot
+        try:
+            _refresh_snapshot()
+        except Exception as e:
+            if _snapshot is None:
+                raise
+            # 数据库暂不可用时继续使用旧快照
+            logger.error(f"Whitelist snapshot refresh failed, serving stale snapshot: {e}")
+        return _snapshot
+
+
+def invalidate_whitelist_snapshot():
+    """
+    使本进程的白名单快照失效，下次读取时重新加载
+    只标记为过期而不丢弃：重新加载失败时仍可继续使用旧快照
+    """
+    global _snapshot_version, _snapshot_checked_at
+    with _snapshot_lock:
+        _snapshot_version = None
+        _snapshot_checked_at = 0.0
+
+
 def add_whitelist_server(server_address: str, api_key_hash: str) -> bool:
     """
     添加一个白名单服务器记录
@@ -25,12 +100,15 @@ def add_whitelist_server(server_address: str, api_key_hash: str) -> bool:
                 ON CONFLICT (server_address, api_key_hash) DO NOTHING
             """, (server_address, api_key_hash))
 
-            if cursor.rowcount > 0:
-                logger.info(f"Whitelist server added: {server_address}")
-                return True
-            else:
-                logger.warning(f"Whitelist entry already exists: {server_address}")
-                return False
+            added = cursor.rowcount > 0
+
+        if added:
+            invalidate_whitelist_snapshot()
+            logger.info(f"Whitelist server added: {server_address}")
+            return True
+        else:
+            logger.warning(f"Whitelist entry already exists: {server_address}")
+            return False
     except Exception as e:
         logger.error(f"Failed to add whitelist server {server_address}: {e}")
         raise
@@ -53,12 +131,13 @@ def remove_whitelist_server(server_address: str, api_key: str) -> bool:
             """, (server_address, api_key_hash))
             deleted = cursor.rowcount > 0
 
-            if deleted:
-                logger.info(f"Whitelist server removed: {server_address}")
-            else:
-                logger.warning(f"No matching record to delete for {server_address}")
+        if deleted:
+            invalidate_whitelist_snapshot()
+            logger.info(f"Whitelist server removed: {server_address}")
+        else:
+            logger.warning(f"No matching record to delete for {server_address}")
 
-            return deleted
+        return deleted
     except Exception as e:
         logger.error(f"Failed to remove whitelist server {server_address}: {e}")
         raise
@@ -71,7 +150,7 @@ def get_whitelist_by_address(server_address: str) -> List[Dict]:
     :return: 列表，包含 api_key_hash 和 created_at
     """
     try:
-        with get_db_cursor() as cursor:
+        with get_db_cursor(commit_on_success=False) as cursor:
             cursor.execute("""
                 SELECT server_address, api_key_hash, created_at
                 FROM taWhiteListServers
@@ -90,7 +169,7 @@ def get_all_whitelist_servers() -> List[Dict]:
     :return: 所有记录列表
     """
     try:
-        with get_db_cursor() as cursor:
+        with get_db_cursor(commit_on_success=False) as cursor:
             cursor.execute("""
                 SELECT server_address, api_key_hash, created_at
                 FROM taWhiteListServers
@@ -114,14 +193,7 @@ def is_server_authorized(server_address: str, api_key: str) -> bool:
 
     try:
         api_key_hash = hash_api_key(api_key)
-
-        with get_db_cursor() as cursor:
-            cursor.execute("""
-                SELECT 1 FROM taWhiteListServers
-                WHERE server_address = %s AND api_key_hash = %s
-                LIMIT 1
-            """, (server_address, api_key_hash))
-            return cursor.fetchone() is not None
+        return (server_address, api_key_hash) in get_whitelist_snapshot()
     except Exception as e:
         logger.error(f"Authorization check failed for {server_address}: {e}")
         return False
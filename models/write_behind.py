@@ -0,0 +1,183 @@
+# models/write_behind.py
+from models.database import get_db_cursor
+from config import Config
+from datetime import datetime, timezone
+import atexit
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TimestampWriteBehind:
+    """
+    时间戳写回缓冲：把 last_used_at / last_login 之类的“触碰”合并在内存中，
+    由后台线程定期用一条 UPDATE ... FROM unnest(...) 批量写入
+    同一个键在一个周期内多次触碰只保留最新时间；刷新失败的批次会并回缓冲等待下次重试
+    缓冲中的键数不超过 max_backlog：达到上限时立即唤醒刷新，已在缓冲中的键照常更新，
+    新的键被丢弃并计入 dropped（丢失的只是一次时间戳，该键下次触碰时会重新记录）
+    """
+
+    def __init__(self, name, update_sql, interval, max_backlog):
+        self.name = name
+        self.update_sql = update_sql
+        self.interval = interval
+        self.max_backlog = max_backlog
+        self._reset_state()
+
+    def _reset_state(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pending = {}  # key -> datetime
+        self._thread = None
+        self.flush_count = 0
+        self.flush_failures = 0
+        self.flushed_rows = 0
+        self.dropped = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def touch(self, key, ts=None):
+        """记录一次触碰，不访问数据库"""
+        if os.getpid() != self._pid:
+            # fork 后继承来的缓冲与线程不属于当前进程
+            self._reset_state()
+        ts = ts or datetime.now(timezone.utc)
+        key = str(key)
+        with self._lock:
+            self._merge_locked(key, ts)
+            backlog = len(self._pending)
+        self._ensure_thread()
+        if backlog >= self.max_backlog:
+            self._wakeup.set()
+
+    def _merge_locked(self, key, ts):
+        """在持有 self._lock 时记入一个键；缓冲已满且是新键时丢弃"""
+        current = self._pending.get(key)
+        if current is None:
+            if len(self._pending) >= self.max_backlog:
+                self.dropped += 1
+                return
+            self._pending[key] = ts
+        elif current < ts:
+            self._pending[key] = ts
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._run, name=f"write-behind-{self.name}", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"写回缓冲刷新失败 ({self.name}): {e}")
+
+    def flush(self) -> int:
+        """把当前缓冲一次性写入数据库，返回写入的键数"""
+        with self._lock:
+            if not self._pending:
+                return 0
+            batch = self._pending
+            self._pending = {}
+
+        keys = list(batch.keys())
+        stamps = [batch[k] for k in keys]
+        started = time.monotonic()
+        try:
+            with get_db_cursor() as cursor:
+                cursor.execute(self.update_sql, (keys, stamps))
+        except Exception:
+            self.flush_failures += 1
+            with self._lock:
+                for key, ts in batch.items():
+                    self._merge_locked(key, ts)
+            raise
+
+        elapsed = time.monotonic() - started
+        self.flush_count += 1
+        self.flushed_rows += len(keys)
+        self.last_flush_seconds = elapsed
+        self.total_flush_seconds += elapsed
+        self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+        logger.debug(f"写回缓冲已刷新 ({self.name}): {len(keys)} 条, {elapsed * 1000:.1f}ms")
+        return len(keys)
+
+    def stats(self) -> dict:
+        """刷新延迟与积压指标"""
+        with self._lock:
+            backlog = len(self._pending)
+        return {
+            'enabled': self.enabled,
+            'backlog': backlog,
+            'flush_count': self.flush_count,
+            'flush_failures': self.flush_failures,
+            'flushed_rows': self.flushed_rows,
+            'dropped': self.dropped,
+            'last_flush_seconds': self.last_flush_seconds,
+            'max_flush_seconds': self.max_flush_seconds,
+            'total_flush_seconds': self.total_flush_seconds,
+        }
+
+
+game_token_last_used = TimestampWriteBehind(
+    name='taUserGame.last_used_at',
+    update_sql="""
+        UPDATE taUserGame g
+        SET last_used_at = v.ts
+        FROM unnest(%s::uuid[], %s::timestamptz[]) AS v(user_id, ts)
+        WHERE g.user_id = v.user_id
+          AND (g.last_used_at IS NULL OR g.last_used_at < v.ts)
+    """,
+    interval=Config.WRITE_BEHIND_INTERVAL,
+    max_backlog=Config.WRITE_BEHIND_MAX_BACKLOG,
+)
+
+user_last_login = TimestampWriteBehind(
+    name='taUsers.last_login',
+    update_sql="""
+        UPDATE taUsers u
+        SET last_login = v.ts
+        FROM unnest(%s::uuid[], %s::timestamptz[]) AS v(user_id, ts)
+        WHERE u.id = v.user_id
+          AND (u.last_login IS NULL OR u.last_login < v.ts)
+    """,
+    interval=Config.WRITE_BEHIND_INTERVAL,
+    max_backlog=Config.WRITE_BEHIND_MAX_BACKLOG,
+)
+
+_buffers = (game_token_last_used, user_last_login)
+
+
+def get_write_behind_stats() -> dict:
+    """所有写回缓冲的指标，按名称索引"""
+    return {b.name: b.stats() for b in _buffers}
+
+
+@atexit.register
+def flush_write_behind():
+    """进程退出前把剩余缓冲写入数据库"""
+    for buffer in _buffers:
+        if buffer._pid != os.getpid():
+            continue
+        try:
+            buffer.flush()
+        except Exception as e:
+            logger.error(f"退出时刷新写回缓冲失败 ({buffer.name}): {e}")
@@ -34,6 +34,7 @@ CREATE TABLE taUserGame (
     user_id UUID NOT NULL REFERENCES taUsers(id) ON DELETE CASCADE,
     game_token BYTEA NOT NULL,
     salt CHAR(32) NOT NULL,
+    token_fingerprint CHAR(64),          -- HMAC-SHA256 Hex 编码，用于免解密查找
     created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
     updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
     last_used_at TIMESTAMPTZ,
@@ -48,6 +49,8 @@ CREATE TABLE taUsersReputation (
     score INTEGER NOT NULL DEFAULT 0 CHECK (score BETWEEN 0 AND 100),
     is_contributor BOOLEAN NOT NULL DEFAULT FALSE,
     has_github_login BOOLEAN NOT NULL DEFAULT FALSE,
+    is_banned BOOLEAN NOT NULL DEFAULT FALSE,
+    banned_at TIMESTAMPTZ,
     created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
     last_updated TIMESTAMPTZ NOT NULL DEFAULT NOW()
 );
@@ -77,8 +80,9 @@ CREATE TABLE taCreditEndorsements (
 );
 
 -- 声望变更日志表
+-- 按 created_at 按月分区（UTC 月份），旧月份由 scripts/prune_reputation_logs.py 分离并删除
 CREATE TABLE taUsersReputationLogs (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     user_id UUID NOT NULL REFERENCES taUsers(id) ON DELETE CASCADE,
     change_type TEXT NOT NULL CHECK (
         change_type IN (
@@ -98,7 +102,20 @@ CREATE TABLE taUsersReputationLogs (
     new_score INTEGER NOT NULL CHECK (new_score BETWEEN 0 AND 100),
     related_user_id UUID REFERENCES taUsers(id),
     description TEXT,
-    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, created_at)   -- 分区表的主键必须包含分区键
+) PARTITION BY RANGE (created_at);
+
+-- 兜底分区：月分区未提前创建时写入不会失败
+CREATE TABLE taUsersReputationLogs_default PARTITION OF taUsersReputationLogs DEFAULT;
+
+-- 声望日志汇总：每个用户一行，由触发器维护，涵盖全部历史（含已删除的分区）
+CREATE TABLE taUsersReputationLogRollup (
+    user_id UUID PRIMARY KEY REFERENCES taUsers(id) ON DELETE CASCADE,
+    latest_score INTEGER NOT NULL,
+    latest_at TIMESTAMPTZ NOT NULL,
+    log_count BIGINT NOT NULL DEFAULT 0,
+    first_2fa_count INTEGER NOT NULL DEFAULT 0
 );
 
 -- 待删除用户记录表
@@ -110,6 +127,19 @@ CREATE TABLE taPendingDeletion (
     is_processed BOOLEAN NOT NULL DEFAULT FALSE
 );
 
+-- 声望事件 outbox：业务事务中写入，由 scripts/outbox_worker.py 批量取出执行
+CREATE TABLE taReputationOutbox (
+    id BIGSERIAL PRIMARY KEY,
+    event_type TEXT NOT NULL,
+    user_id UUID NOT NULL REFERENCES taUsers(id) ON DELETE CASCADE,
+    payload JSONB NOT NULL DEFAULT '{}',
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    available_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),  -- 失败后按退避时间推迟
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    failed_at TIMESTAMPTZ                              -- 达到最大尝试次数后不再处理
+);
+
 -- 白名单服务器表
 CREATE TABLE taWhiteListServers (
     id SERIAL PRIMARY KEY,
@@ -120,6 +150,15 @@ CREATE TABLE taWhiteListServers (
     CONSTRAINT uk_server_apikey UNIQUE (server_address, api_key_hash)
 );
 
+-- 缓存版本号表：被缓存的表发生变化时由触发器递增版本号
+CREATE TABLE taCacheVersions (
+    name TEXT PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+INSERT INTO taCacheVersions (name) VALUES ('whitelist');
+
 -- 自动更新 updated_at 的触发器函数
 CREATE OR REPLACE FUNCTION update_updated_at_column()
 RETURNS TRIGGER AS $$
@@ -145,6 +184,105 @@ CREATE TRIGGER trg_update_tausergame_updated_at
     FOR EACH ROW
     EXECUTE FUNCTION update_updated_at_column();
 
+-- 递增缓存版本号的触发器函数（参数为版本名）
+CREATE OR REPLACE FUNCTION bump_cache_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO taCacheVersions (name, version, updated_at)
+    VALUES (TG_ARGV[0], 1, NOW())
+    ON CONFLICT (name) DO UPDATE
+        SET version = taCacheVersions.version + 1, updated_at = NOW();
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_bump_whitelist_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON taWhiteListServers
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION bump_cache_version('whitelist');
+
+-- 创建 [from_month, to_month] 之间（含两端）缺失的声望日志月分区，返回新建的个数
+CREATE OR REPLACE FUNCTION create_reputation_log_partitions(from_month DATE, to_month DATE)
+RETURNS INTEGER AS $$
+DECLARE
+    m DATE := date_trunc('month', from_month)::date;
+    partition_name TEXT;
+    lo TIMESTAMPTZ;
+    hi TIMESTAMPTZ;
+    created INTEGER := 0;
+BEGIN
+    WHILE m <= date_trunc('month', to_month)::date LOOP
+        partition_name := 'tausersreputationlogs_p' || to_char(m, 'YYYYMM');
+        lo := m::timestamp AT TIME ZONE 'UTC';
+        hi := (m + INTERVAL '1 month')::timestamp AT TIME ZONE 'UTC';
+        IF to_regclass(partition_name) IS NULL THEN
+            -- 兜底分区中已有该月的数据时 CREATE ... PARTITION OF 会失败：
+            -- 先阻止新行写入兜底分区，把这些行移入新表，再挂载为分区（同一事务内完成）
+            LOCK TABLE taUsersReputationLogs_default IN SHARE ROW EXCLUSIVE MODE;
+            IF EXISTS (SELECT 1 FROM taUsersReputationLogs_default WHERE created_at >= lo AND created_at < hi) THEN
+                EXECUTE format(
+                    'CREATE TABLE %I (LIKE taUsersReputationLogs INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+                    partition_name
+                );
+                -- 新表尚未挂载，汇总触发器不会重复计数
+                EXECUTE format(
+                    'WITH moved AS (DELETE FROM taUsersReputationLogs_default WHERE created_at >= %L AND created_at < %L RETURNING *) '
+                    'INSERT INTO %I SELECT * FROM moved',
+                    lo, hi, partition_name
+                );
+                EXECUTE format(
+                    'ALTER TABLE taUsersReputationLogs ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                    partition_name, lo, hi
+                );
+            ELSE
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF taUsersReputationLogs FOR VALUES FROM (%L) TO (%L)',
+                    partition_name, lo, hi
+                );
+            END IF;
+            created := created + 1;
+        END IF;
+        m := (m + INTERVAL '1 month')::date;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT create_reputation_log_partitions(
+    (NOW() AT TIME ZONE 'UTC')::date,
+    ((NOW() + INTERVAL '3 months') AT TIME ZONE 'UTC')::date
+);
+
+-- 每写入一条声望日志，同步更新该用户的汇总行
+CREATE OR REPLACE FUNCTION rollup_reputation_log()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO taUsersReputationLogRollup AS r (user_id, latest_score, latest_at, log_count, first_2fa_count)
+    VALUES (
+        NEW.user_id,
+        NEW.new_score,
+        NEW.created_at,
+        1,
+        CASE WHEN NEW.change_type = 'first_2fa_verification' THEN 1 ELSE 0 END
+    )
+    ON CONFLICT (user_id) DO UPDATE SET
+        latest_score = CASE WHEN EXCLUDED.latest_at >= r.latest_at THEN EXCLUDED.latest_score ELSE r.latest_score END,
+        latest_at = GREATEST(r.latest_at, EXCLUDED.latest_at),
+        log_count = r.log_count + 1,
+        first_2fa_count = r.first_2fa_count + EXCLUDED.first_2fa_count;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_rollup_reputation_log
+    AFTER INSERT ON taUsersReputationLogs
+    FOR EACH ROW
+    EXECUTE FUNCTION rollup_reputation_log();
+
 CREATE INDEX IF NOT EXISTS idx_reputation_user ON taUsersReputationLogs(user_id, created_at DESC);
 CREATE INDEX IF NOT EXISTS idx_usertoken_user ON taUserGame(user_id);
-CREATE INDEX IF NOT EXISTS idx_users_nickname ON taUsers(nickname);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_reputation_banned ON taUsersReputation(banned_at) WHERE is_banned;
+CREATE INDEX IF NOT EXISTS idx_reputation_last_updated ON taUsersReputation(last_updated);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_usergame_fingerprint ON taUserGame(token_fingerprint);
+CREATE INDEX IF NOT EXISTS idx_users_nickname ON taUsers(nickname);
+CREATE INDEX IF NOT EXISTS idx_outbox_pending ON taReputationOutbox(id) WHERE failed_at IS NULL;
\ No newline at end of file
@@ -0,0 +1,9 @@
+-- 为 taUserGame 增加 token 指纹列及唯一索引
+-- 已有 token 的指纹需要解密后计算，请在执行本脚本后运行：
+--     python scripts/backfill_token_fingerprints.py
+-- 未回填的 token 在验证时会回退到解密比对，并在首次验证成功后自动写入指纹
+
+ALTER TABLE taUserGame ADD COLUMN IF NOT EXISTS token_fingerprint CHAR(64);
+
+-- CONCURRENTLY 不能在事务块中执行
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_usergame_fingerprint ON taUserGame(token_fingerprint);
@@ -0,0 +1,26 @@
+-- 缓存版本号表：被缓存的表发生变化时由触发器递增版本号，
+-- 应用只需比较版本号即可判断进程内快照是否过期
+CREATE TABLE IF NOT EXISTS taCacheVersions (
+    name TEXT PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE OR REPLACE FUNCTION bump_cache_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO taCacheVersions (name, version, updated_at)
+    VALUES (TG_ARGV[0], 1, NOW())
+    ON CONFLICT (name) DO UPDATE
+        SET version = taCacheVersions.version + 1, updated_at = NOW();
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_bump_whitelist_version ON taWhiteListServers;
+CREATE TRIGGER trg_bump_whitelist_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON taWhiteListServers
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION bump_cache_version('whitelist');
+
+INSERT INTO taCacheVersions (name) VALUES ('whitelist') ON CONFLICT (name) DO NOTHING;
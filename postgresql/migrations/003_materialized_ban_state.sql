@@ -0,0 +1,22 @@
+-- 封禁状态物化到声望表：由 ban_user / unban_user 在同一事务中维护，
+-- 验证接口和管理面板不再扫描声望日志判断是否封禁
+ALTER TABLE taUsersReputation
+    ADD COLUMN IF NOT EXISTS is_banned BOOLEAN NOT NULL DEFAULT FALSE,
+    ADD COLUMN IF NOT EXISTS banned_at TIMESTAMPTZ;
+
+-- 回填：沿用旧的判断规则（声望为 0 且存在包含“封禁”的处罚日志）
+UPDATE taUsersReputation r
+SET is_banned = TRUE,
+    banned_at = b.banned_at
+FROM (
+    SELECT user_id, MAX(created_at) AS banned_at
+    FROM taUsersReputationLogs
+    WHERE change_type = 'penalty'
+      AND description LIKE '%封禁%'
+    GROUP BY user_id
+) b
+WHERE r.user_id = b.user_id
+  AND r.score = 0
+  AND r.is_banned = FALSE;
+
+CREATE INDEX IF NOT EXISTS idx_reputation_banned ON taUsersReputation(banned_at) WHERE is_banned;
@@ -0,0 +1,127 @@
+-- 声望日志按 created_at 按月分区（UTC 月份），旧月份由 scripts/prune_reputation_logs.py 分离并删除；
+-- 读取方需要的汇总值（最新分数、首次 2FA 次数）由触发器写入 taUsersReputationLogRollup，不随分区删除而丢失。
+-- 表替换需要原子完成，整个脚本在一个事务中执行
+BEGIN;
+
+ALTER TABLE taUsersReputationLogs RENAME TO taUsersReputationLogs_old;
+ALTER TABLE taUsersReputationLogs_old RENAME CONSTRAINT tausersreputationlogs_pkey TO tausersreputationlogs_old_pkey;
+ALTER INDEX idx_reputation_user RENAME TO idx_reputation_user_old;
+
+-- 分区表的主键必须包含分区键；沿用原表的 id 序列
+CREATE TABLE taUsersReputationLogs (
+    id INTEGER NOT NULL DEFAULT nextval('tausersreputationlogs_id_seq'),
+    user_id UUID NOT NULL REFERENCES taUsers(id) ON DELETE CASCADE,
+    change_type TEXT NOT NULL CHECK (
+        change_type IN (
+            'initial',
+            'github_login',
+            'teeworlds_contributor',
+            'endorsed_by_user',
+            'endorsement_revoked',
+            'penalty',
+            'manual_adjust',
+            'first_2fa_verification',
+            'unbanned_by_admin'
+        )
+    ),
+    change_amount INTEGER NOT NULL,
+    old_score INTEGER NOT NULL CHECK (old_score BETWEEN 0 AND 100),
+    new_score INTEGER NOT NULL CHECK (new_score BETWEEN 0 AND 100),
+    related_user_id UUID REFERENCES taUsers(id),
+    description TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+ALTER SEQUENCE tausersreputationlogs_id_seq OWNED BY taUsersReputationLogs.id;
+
+-- 兜底分区：月分区未提前创建时写入不会失败（清理脚本发现其中有数据会告警）
+CREATE TABLE taUsersReputationLogs_default PARTITION OF taUsersReputationLogs DEFAULT;
+
+-- 创建 [from_month, to_month] 之间（含两端）缺失的月分区，返回新建的个数
+CREATE OR REPLACE FUNCTION create_reputation_log_partitions(from_month DATE, to_month DATE)
+RETURNS INTEGER AS $$
+DECLARE
+    m DATE := date_trunc('month', from_month)::date;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    WHILE m <= date_trunc('month', to_month)::date LOOP
+        partition_name := 'tausersreputationlogs_p' || to_char(m, 'YYYYMM');
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF taUsersReputationLogs FOR VALUES FROM (%L) TO (%L)',
+                partition_name,
+                m::timestamp AT TIME ZONE 'UTC',
+                (m + INTERVAL '1 month')::timestamp AT TIME ZONE 'UTC'
+            );
+            created := created + 1;
+        END IF;
+        m := (m + INTERVAL '1 month')::date;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT create_reputation_log_partitions(
+    (COALESCE((SELECT MIN(created_at) FROM taUsersReputationLogs_old), NOW()) AT TIME ZONE 'UTC')::date,
+    ((NOW() + INTERVAL '3 months') AT TIME ZONE 'UTC')::date
+);
+
+INSERT INTO taUsersReputationLogs
+    (id, user_id, change_type, change_amount, old_score, new_score, related_user_id, description, created_at)
+SELECT id, user_id, change_type, change_amount, old_score, new_score, related_user_id, description, created_at
+FROM taUsersReputationLogs_old;
+
+CREATE INDEX IF NOT EXISTS idx_reputation_user ON taUsersReputationLogs(user_id, created_at DESC);
+
+-- 每个用户一行的日志汇总：涵盖全部历史（含已删除的分区），只增不减
+CREATE TABLE taUsersReputationLogRollup (
+    user_id UUID PRIMARY KEY REFERENCES taUsers(id) ON DELETE CASCADE,
+    latest_score INTEGER NOT NULL,
+    latest_at TIMESTAMPTZ NOT NULL,
+    log_count BIGINT NOT NULL DEFAULT 0,
+    first_2fa_count INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT INTO taUsersReputationLogRollup (user_id, latest_score, latest_at, log_count, first_2fa_count)
+SELECT DISTINCT ON (user_id)
+    user_id,
+    new_score,
+    created_at,
+    COUNT(*) OVER (PARTITION BY user_id),
+    COUNT(*) FILTER (WHERE change_type = 'first_2fa_verification') OVER (PARTITION BY user_id)
+FROM taUsersReputationLogs_old
+ORDER BY user_id, created_at DESC, id DESC;
+
+CREATE OR REPLACE FUNCTION rollup_reputation_log()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO taUsersReputationLogRollup AS r (user_id, latest_score, latest_at, log_count, first_2fa_count)
+    VALUES (
+        NEW.user_id,
+        NEW.new_score,
+        NEW.created_at,
+        1,
+        CASE WHEN NEW.change_type = 'first_2fa_verification' THEN 1 ELSE 0 END
+    )
+    ON CONFLICT (user_id) DO UPDATE SET
+        latest_score = CASE WHEN EXCLUDED.latest_at >= r.latest_at THEN EXCLUDED.latest_score ELSE r.latest_score END,
+        latest_at = GREATEST(r.latest_at, EXCLUDED.latest_at),
+        log_count = r.log_count + 1,
+        first_2fa_count = r.first_2fa_count + EXCLUDED.first_2fa_count;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_rollup_reputation_log
+    AFTER INSERT ON taUsersReputationLogs
+    FOR EACH ROW
+    EXECUTE FUNCTION rollup_reputation_log();
+
+DROP TABLE taUsersReputationLogs_old;
+
+COMMIT;
+
+ANALYZE taUsersReputationLogs;
+ANALYZE taUsersReputationLogRollup;
@@ -0,0 +1,14 @@
+-- 声望事件 outbox：业务事务中写入，由 scripts/outbox_worker.py 批量取出执行（REPUTATION_OUTBOX=1 时启用）
+CREATE TABLE IF NOT EXISTS taReputationOutbox (
+    id BIGSERIAL PRIMARY KEY,
+    event_type TEXT NOT NULL,
+    user_id UUID NOT NULL REFERENCES taUsers(id) ON DELETE CASCADE,
+    payload JSONB NOT NULL DEFAULT '{}',
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    available_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),  -- 失败后按退避时间推迟
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    failed_at TIMESTAMPTZ                              -- 达到最大尝试次数后不再处理
+);
+
+CREATE INDEX IF NOT EXISTS idx_outbox_pending ON taReputationOutbox(id) WHERE failed_at IS NULL;
@@ -0,0 +1,2 @@
+-- 排行榜按 last_updated 增量拉取变更过的声望，避免每次刷新扫描整表
+CREATE INDEX IF NOT EXISTS idx_reputation_last_updated ON taUsersReputation(last_updated);
@@ -0,0 +1,46 @@
+-- 创建月分区时，若兜底分区中已有该月的数据，先把这些行移入新分区（原实现会因此报错并中断整个清理任务）
+CREATE OR REPLACE FUNCTION create_reputation_log_partitions(from_month DATE, to_month DATE)
+RETURNS INTEGER AS $$
+DECLARE
+    m DATE := date_trunc('month', from_month)::date;
+    partition_name TEXT;
+    lo TIMESTAMPTZ;
+    hi TIMESTAMPTZ;
+    created INTEGER := 0;
+BEGIN
+    WHILE m <= date_trunc('month', to_month)::date LOOP
+        partition_name := 'tausersreputationlogs_p' || to_char(m, 'YYYYMM');
+        lo := m::timestamp AT TIME ZONE 'UTC';
+        hi := (m + INTERVAL '1 month')::timestamp AT TIME ZONE 'UTC';
+        IF to_regclass(partition_name) IS NULL THEN
+            -- 兜底分区中已有该月的数据时 CREATE ... PARTITION OF 会失败：
+            -- 先阻止新行写入兜底分区，把这些行移入新表，再挂载为分区（同一事务内完成）
+            LOCK TABLE taUsersReputationLogs_default IN SHARE ROW EXCLUSIVE MODE;
+            IF EXISTS (SELECT 1 FROM taUsersReputationLogs_default WHERE created_at >= lo AND created_at < hi) THEN
+                EXECUTE format(
+                    'CREATE TABLE %I (LIKE taUsersReputationLogs INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+                    partition_name
+                );
+                -- 新表尚未挂载，汇总触发器不会重复计数
+                EXECUTE format(
+                    'WITH moved AS (DELETE FROM taUsersReputationLogs_default WHERE created_at >= %L AND created_at < %L RETURNING *) '
+                    'INSERT INTO %I SELECT * FROM moved',
+                    lo, hi, partition_name
+                );
+                EXECUTE format(
+                    'ALTER TABLE taUsersReputationLogs ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                    partition_name, lo, hi
+                );
+            ELSE
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF taUsersReputationLogs FOR VALUES FROM (%L) TO (%L)',
+                    partition_name, lo, hi
+                );
+            END IF;
+            created := created + 1;
+        END IF;
+        m := (m + INTERVAL '1 month')::date;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
@@ -1,8 +1,20 @@
-from flask import Blueprint, request, render_template, session, flash, redirect, url_for
+from flask import Blueprint, request, render_template, session, flash, redirect, url_for, jsonify
 from utils.validators import validate_user_id
 from utils import generate_api_key
-from services.admin_service import get_all_users, ban_user, unban_user, toggle_admin_status
+from services.admin_service import (
+    get_all_users,
+    ban_user,
+    unban_user,
+    toggle_admin_status,
+    parse_reputation_adjustments,
+    bulk_adjust_users
+)
+from services.endorsement_graph import preview_ban
 from models.user import get_user_by_id
+from models.slow_query_log import get_slow_queries, clear_slow_queries
+from config import Config
+import csv
+import io
 from models.whitelist import (
     add_whitelist_server,
     remove_whitelist_server,
@@ -51,6 +63,23 @@ def admin_panel():
                          total_users=total,
                          search_query=search_query)
 
+@admin_bp.route('/admin/ban-preview/<user_id>')
+@require_admin
+def admin_ban_preview(user_id):
+    """封禁前展示影响范围，确认后再提交封禁"""
+    try:
+        user_id = validate_user_id(user_id)
+        preview = preview_ban(user_id)
+    except Exception as e:
+        flash(f'无法预估封禁影响: {str(e)}')
+        return redirect(url_for('admin.admin_panel'))
+
+    if not preview['user']:
+        flash('用户不存在')
+        return redirect(url_for('admin.admin_panel'))
+
+    return render_template('admin_ban_preview.html', user_id=user_id, preview=preview)
+
 @admin_bp.route('/admin/ban/<user_id>', methods=['POST'])
 @require_admin
 def admin_ban_user(user_id):
@@ -94,6 +123,63 @@ def admin_toggle_admin(user_id):
     
     return redirect(url_for('admin.admin_panel'))
 
+# ========================
+# 批量调整声望
+# ========================
+
+def _adjustments_from_json(data):
+    """JSON 请求体：{"csv": "..."} 或 {"adjustments": [{"user_id", "amount", "reason"}]}"""
+    if isinstance(data.get('csv'), str):
+        return parse_reputation_adjustments(data['csv'])
+    items = data.get('adjustments')
+    if not isinstance(items, list):
+        raise ValueError("缺少 csv 或 adjustments")
+    # 统一转成 CSV 行，与表单走同一套校验
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError("adjustments 的每一项必须是对象")
+        writer.writerow((item.get('user_id', ''), item.get('amount', ''), item.get('reason') or ''))
+    return parse_reputation_adjustments(buffer.getvalue())
+
+
+@admin_bp.route('/admin/reputation/bulk-adjust', methods=['GET', 'POST'])
+@require_admin
+def bulk_adjust_reputation():
+    """
+    批量调整声望：表单提交粘贴的 CSV 或上传的 CSV 文件；以 JSON 提交时返回 JSON
+    每行 user_id,amount,reason，全部在一个事务中生效
+    """
+    if request.method == 'GET':
+        return render_template('admin_bulk_adjust.html', max_rows=Config.BULK_ADJUST_MAX_ROWS)
+
+    admin_id = session['user_id']
+    if request.is_json:
+        try:
+            adjustments = _adjustments_from_json(request.get_json() or {})
+            stats = bulk_adjust_users(admin_id, adjustments)
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+        return jsonify({"success": True, **stats})
+
+    try:
+        upload = request.files.get('file')
+        if upload and upload.filename:
+            text = upload.read().decode('utf-8-sig')
+        else:
+            text = request.form.get('rows', '')
+        adjustments = parse_reputation_adjustments(text)
+        stats = bulk_adjust_users(admin_id, adjustments)
+        flash(
+            f"已调整 {stats['applied']} 个用户的声望（{stats['batches']} 批，"
+            f"{stats['scheduled_for_deletion']} 人归零进入待删除队列，耗时 {stats['elapsed_ms']} ms）"
+        )
+    except Exception as e:
+        flash(f'批量调整失败: {str(e)}')
+
+    return redirect(url_for('admin.bulk_adjust_reputation'))
+
 # ========================
 # 白名单管理
 # ========================
@@ -191,4 +277,22 @@ def remove_whitelist_entry(server_addr, api_key_hash):
         current_app.logger.error(f"Remove whitelist failed: {e}")
         flash(f"删除失败: {str(e)}")
 
-    return redirect(url_for('admin.whitelist_management'))
\ No newline at end of file
+    return redirect(url_for('admin.whitelist_management'))
+
+
+@admin_bp.route('/admin/slow-queries')
+@require_admin
+def slow_queries():
+    """慢查询日志（当前 worker 进程）"""
+    return render_template('admin_slow_queries.html',
+                         entries=get_slow_queries(),
+                         threshold_ms=Config.DB_SLOW_QUERY_MS,
+                         explain_rate=Config.DB_SLOW_QUERY_EXPLAIN_RATE)
+
+
+@admin_bp.route('/admin/slow-queries/clear', methods=['POST'])
+@require_admin
+def clear_slow_query_log():
+    clear_slow_queries()
+    flash('慢查询日志已清空')
+    return redirect(url_for('admin.slow_queries'))
@@ -1,50 +1,37 @@
 # routes/api.py
-from flask import Blueprint, request, jsonify, g
+from flask import Blueprint, request, jsonify, g, Response
 from functools import lru_cache
 import logging
+import uuid
 from datetime import datetime, timezone
 from flask_wtf.csrf import CSRF
 from extensions import csrf
 
 from models.database import get_db_cursor
-from models.user import get_user_by_id
-from models.reputation import is_user_banned
-import utils
+from models.game_token import (
+    resolve_game_token,
+    resolve_game_tokens,
+    defer_game_token_touch,
+    get_cached_verification,
+    cache_verification,
+    verification_clock,
+)
+from models.leaderboard import get_leaderboard_page, get_score_distribution
+from services.metrics_service import render_metrics
+from utils.validators import validate_uuid
+from config import Config
 from utils.decorators import require_api_auth
+from utils.metrics import Counter
 
 api_bp = Blueprint('api', __name__, url_prefix='/api/v1')
 logger = logging.getLogger(__name__)
 
+VERIFY_OUTCOMES = Counter(
+    'teealloy_verify_total',
+    'Game token verifications by endpoint and outcome',
+    labelnames=('mode', 'outcome'),
+)
 
-def _decrypt_and_match(encrypted_token_bytes: bytes, salt: str, target_token: str) -> bool:
-    """
-    尝试用 salt 解密 encrypted_token_bytes，并与 target_token 比较。
-    安全、防崩溃、防时序攻击。
-    """
-    if isinstance(encrypted_token_bytes, memoryview):
-        encrypted_token_bytes = encrypted_token_bytes.tobytes()
-    if not isinstance(encrypted_token_bytes, bytes) or len(encrypted_token_bytes) == 0:
-        logger.warning("Invalid encrypted token: not bytes or empty")
-        return False
-    if not isinstance(salt, str) or len(salt) != 32:  # 假设 salt 固定为 32 字符
-        logger.warning("Invalid salt length or type")
-        return False
-    if not isinstance(target_token, str) or len(target_token.strip()) == 0:
-        logger.warning("Invalid target token")
-        return False
-
-    target_token = target_token.strip()
-
-    try:
-        decrypted: str = utils.decrypt_data(encrypted_token_bytes, salt)
-        if not isinstance(decrypted, str):
-            logger.warning("Invalid decrypted")
-            return False
-        import hmac
-        return hmac.compare_digest(decrypted.strip(), target_token)
-    except Exception as e:
-        logger.warning(f"Decryption failed: {e}")
-        return False
 
 @api_bp.route('/auth/verify-game-token', methods=['POST'])
 @require_api_auth
@@ -55,45 +42,37 @@ def verify_game_token():
     nickname = data.get("nickname")
 
     if not token or not isinstance(token, str) or len(token.strip()) == 0:
+        VERIFY_OUTCOMES.inc(mode='single', outcome='bad_request')
         return jsonify({"success": False, "error": "Missing or invalid game_token"}), 400
     if not nickname or not isinstance(nickname, str) or len(nickname.strip()) == 0:
+        VERIFY_OUTCOMES.inc(mode='single', outcome='bad_request')
         return jsonify({"success": False, "error": "Missing or invalid nickname"}), 400
 
     token = token.strip()
     nickname = nickname.strip()
 
-    with get_db_cursor() as cursor:
-        cursor.execute("""
-            SELECT id FROM taUsers WHERE nickname = %s
-        """, (nickname,))
-        user_records = cursor.fetchall()
-
-    if not user_records:
-        return jsonify({"success": False, "error": "User not found"}), 404
+    cached = get_cached_verification(token, nickname)
+    if cached:
+        defer_game_token_touch(cached['id'])
+        VERIFY_OUTCOMES.inc(mode='single', outcome='cached')
+        logger.info(
+            f"Game token verified (cached) | "
+            f"user_id={cached['id']} | "
+            f"nickname={nickname} | "
+            f"server={g.authenticated_server}"
+        )
+        return jsonify({"success": True, "user": _verified_user_payload(cached)})
 
-    matched_user_id = None
+    fetched_at = verification_clock()
 
-    for user_record in user_records:
-        user_id = user_record['id']
+    # 按 token 指纹走索引查找，候选用户、声望与封禁状态在同一连接上取回
+    matched, nickname_exists = resolve_game_token(token, nickname)
+    if not nickname_exists:
+        VERIFY_OUTCOMES.inc(mode='single', outcome='user_not_found')
+        return jsonify({"success": False, "error": "User not found"}), 404
 
-        with get_db_cursor() as cursor:
-            cursor.execute("""
-                SELECT game_token, salt
-                FROM taUserGame
-                WHERE user_id = %s
-                  AND created_at > NOW() - INTERVAL '90 days'
-                  AND salt IS NOT NULL
-            """, (user_id,))
-            game_record = cursor.fetchone()
-
-        if not game_record:
-            continue
-
-        if _decrypt_and_match(game_record['game_token'], game_record['salt'], token):
-            matched_user_id = user_id
-            break
-
-    if not matched_user_id:
+    if not matched:
+        VERIFY_OUTCOMES.inc(mode='single', outcome='invalid_token')
         logger.warning(
             f"Token verification failed (invalid/expired or no active token) | "
             f"nickname='{nickname}' | "
@@ -104,33 +83,9 @@ def verify_game_token():
             "error": "Invalid or expired game_token"
         }), 401
 
-    with get_db_cursor() as cursor:
-        cursor.execute("""
-            SELECT id, nickname, created_at
-            FROM taUsers
-            WHERE id = %s
-        """, (matched_user_id,))
-        user = cursor.fetchone()
-
-    if not user:
-        return jsonify({"success": False, "error": "User not found"}), 500
-
-    with get_db_cursor() as cursor:
-        cursor.execute("""
-            SELECT new_score
-            FROM taUsersReputationLogs
-            WHERE user_id = %s
-            ORDER BY created_at DESC
-            LIMIT 1
-        """, (matched_user_id,))
-        row = cursor.fetchone()
-        reputation = row['new_score'] if row else 0
-
-    with get_db_cursor() as cursor:
-        cursor.execute(
-            "UPDATE taUserGame SET last_used_at = NOW() WHERE user_id = %s",
-            (matched_user_id,)
-        )
+    matched_user_id = matched['id']
+    cache_verification(token, nickname, matched, fetched_at)
+    VERIFY_OUTCOMES.inc(mode='single', outcome='verified')
 
     logger.info(
         f"Game token verified | "
@@ -141,15 +96,149 @@ def verify_game_token():
 
     return jsonify({
         "success": True,
-        "user": {
-            "user_id": user['id'],
-            "reputation": reputation,
-            "created_at": user['created_at'],
-            "is_banned": is_user_banned(matched_user_id)
-        }
+        "user": _verified_user_payload(matched)
+    })
+
+
+def _verified_user_payload(row):
+    return {
+        "user_id": row['id'],
+        "reputation": row['reputation'],
+        "created_at": row['created_at'],
+        "is_banned": row['is_banned']
+    }
+
+
+@api_bp.route('/auth/verify-game-tokens', methods=['POST'])
+@require_api_auth
+@csrf.exempt
+def verify_game_tokens():
+    """
+    批量验证 game token（换图/重启时整服玩家一次性重新认证）
+    服务器只认证一次，所有条目用集合查询解析，按请求顺序返回逐条结果
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get("items")
+    max_items = Config.VERIFY_BATCH_MAX_ITEMS
+
+    if not isinstance(items, list) or len(items) == 0:
+        return jsonify({"success": False, "error": "Missing or invalid items"}), 400
+    if len(items) > max_items:
+        return jsonify({"success": False, "error": f"Too many items (max {max_items})"}), 400
+
+    results = [None] * len(items)
+    lookups = []  # (index, token, nickname)
+    for i, item in enumerate(items):
+        token = item.get("game_token") if isinstance(item, dict) else None
+        nickname = item.get("nickname") if isinstance(item, dict) else None
+        if not token or not isinstance(token, str) or len(token.strip()) == 0:
+            results[i] = {"success": False, "error": "Missing or invalid game_token"}
+            VERIFY_OUTCOMES.inc(mode='batch', outcome='bad_request')
+        elif not nickname or not isinstance(nickname, str) or len(nickname.strip()) == 0:
+            results[i] = {"success": False, "error": "Missing or invalid nickname"}
+            VERIFY_OUTCOMES.inc(mode='batch', outcome='bad_request')
+        else:
+            lookups.append((i, token.strip(), nickname.strip()))
+
+    pending = []
+    for i, token, nickname in lookups:
+        cached = get_cached_verification(token, nickname)
+        if cached:
+            defer_game_token_touch(cached['id'])
+            results[i] = {"success": True, "user": _verified_user_payload(cached)}
+            VERIFY_OUTCOMES.inc(mode='batch', outcome='cached')
+        else:
+            pending.append((i, token, nickname))
+    lookups = pending
+
+    if lookups:
+        fetched_at = verification_clock()
+        found = resolve_game_tokens([(token, nickname) for _, token, nickname in lookups])
+        for (i, token, nickname), (matched, nickname_exists) in zip(lookups, found):
+            if not nickname_exists:
+                results[i] = {"success": False, "error": "User not found"}
+                VERIFY_OUTCOMES.inc(mode='batch', outcome='user_not_found')
+            elif not matched:
+                results[i] = {"success": False, "error": "Invalid or expired game_token"}
+                VERIFY_OUTCOMES.inc(mode='batch', outcome='invalid_token')
+            else:
+                results[i] = {"success": True, "user": _verified_user_payload(matched)}
+                cache_verification(token, nickname, matched, fetched_at)
+                VERIFY_OUTCOMES.inc(mode='batch', outcome='verified')
+
+    verified = sum(1 for r in results if r["success"])
+    logger.info(
+        f"Game tokens batch verified | "
+        f"verified={verified}/{len(items)} | "
+        f"server={g.authenticated_server}"
+    )
+
+    return jsonify({"success": True, "results": results})
+
+
+def _parse_leaderboard_cursor(value):
+    """翻页游标 "<score>:<user_id>" -> (score, user_id)；格式错误时返回 None"""
+    score, sep, user_id = value.partition(':')
+    if not sep or not score.isdigit() or not validate_uuid(user_id):
+        return None
+    return int(score), str(uuid.UUID(user_id))
+
+
+@api_bp.route('/reputation/leaderboard', methods=['GET'])
+@require_api_auth
+@csrf.exempt
+def reputation_leaderboard():
+    """声望排行榜（keyset 翻页），只读进程内数据"""
+    limit = request.args.get('limit', Config.LEADERBOARD_PAGE_MAX, type=int)
+    if limit is None or limit < 1 or limit > Config.LEADERBOARD_PAGE_MAX:
+        return jsonify({"success": False, "error": "Invalid limit"}), 400
+
+    after = None
+    raw_after = request.args.get('after')
+    if raw_after:
+        after = _parse_leaderboard_cursor(raw_after)
+        if after is None:
+            return jsonify({"success": False, "error": "Invalid cursor"}), 400
+
+    entries, next_after = get_leaderboard_page(limit, after)
+    return jsonify({
+        "success": True,
+        "entries": [
+            {"user_id": user_id, "reputation": score, "rank": rank}
+            for user_id, score, rank in entries
+        ],
+        "next": f"{next_after[0]}:{next_after[1]}" if next_after else None,
     })
 
 
+@api_bp.route('/reputation/distribution', methods=['GET'])
+@require_api_auth
+@csrf.exempt
+def reputation_distribution():
+    """声望分布直方图，width 为分段宽度"""
+    width = request.args.get('width', 1, type=int)
+    if width is None or width < 1 or width > 101:
+        return jsonify({"success": False, "error": "Invalid width"}), 400
+
+    buckets, total = get_score_distribution(width)
+    return jsonify({
+        "success": True,
+        "total": total,
+        "buckets": [{"min": low, "max": high, "count": count} for low, high, count in buckets],
+    })
+
+
+@api_bp.route('/metrics', methods=['GET'])
+@require_api_auth
+@csrf.exempt
+def metrics():
+    """
+    Prometheus 文本格式的运行指标：连接池、查询耗时、事务、验证结果、缓存与写回缓冲
+    指标按 worker 进程统计，抓取经负载均衡时每次只看到其中一个 worker
+    """
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
 @api_bp.route('/healthz', methods=['GET'])
 @csrf.exempt
 def health_check():
@@ -1,5 +1,5 @@
 from flask import Blueprint, request, render_template, redirect, url_for, session, flash
-from services.auth_service import authenticate_user, login_user, process_2fa_verification, process_backup_code_verification
+from services.auth_service import authenticate_user, login_user, process_2fa_verification, process_backup_code_verification, check_first_2fa_verification
 from models.user import create_user, get_user_totp_info, update_last_login, update_user_totp, delete_user_totp, update_user_nickname
 from utils.validators import validate_user_id, validate_uuid
 from utils.security import hash_password, check_password, generate_totp_secret, get_totp_uri, make_qr_code_image, encrypt_data
@@ -169,6 +169,7 @@ def verify_2fa():
 
             token = request.form['token'].strip()
 
+            verified = None
             if totp.verify(token):
                 cursor.execute("SELECT username FROM taUsers WHERE id = %s", (user_id,))
                 user = cursor.fetchone()
@@ -177,34 +178,10 @@ def verify_2fa():
                 session.pop('pending_2fa_user_id', None)
                 session.pop('2fa_stage', None)
                 cursor.execute("UPDATE taUserTOTP SET last_used_at = NOW() WHERE user_id = %s", (user_id,))
-                
-                # 检查是否是首次2FA验证
-                cursor.execute("""
-                    SELECT COUNT(*) as usage_count 
-                    FROM taUsersReputationLogs 
-                    WHERE user_id = %s AND change_type = 'first_2fa_verification'
-                """, (user_id,))
-                log_entry = cursor.fetchone()
-                
-                # 如果没有记录，说明是首次验证，给予声望奖励
-                if log_entry and log_entry['usage_count'] == 0:
-                    update_reputation(
-                        user_id=user_id,
-                        change_type='first_2fa_verification',
-                        amount=10,
-                        description="首次成功完成2FA验证"
-                    )
-                
-                if 'pending_github_info' in session:
-                    github_info = session.pop('pending_github_info')
-                    from services.reputation_service import handle_github_login
-                    handle_github_login(session['user_id'], github_info)
-                    flash('GitHub 账号已自动绑定！')
-                flash('2FA 验证成功！')
-                return redirect(url_for('main.dashboard'))
+                verified = 'totp'
 
             # 尝试备份码
-            if row['backup_codes_encrypted']:
+            elif row['backup_codes_encrypted']:
                 try:
                     backup_codes = decrypt_data(row['backup_codes_encrypted'], row['backup_codes_salt'])
                     codes = set(backup_codes.split(","))
@@ -221,37 +198,31 @@ def verify_2fa():
                         session['username'] = user['username']
                         session.pop('pending_2fa_user_id', None)
                         session.pop('2fa_stage', None)
-                        
-                        # 检查是否是首次2FA验证（备份码方式）
-                        cursor.execute("""
-                            SELECT COUNT(*) as usage_count 
-                            FROM taUsersReputationLogs 
-                            WHERE user_id = %s AND change_type = 'first_2fa_verification'
-                        """, (user_id,))
-                        log_entry = cursor.fetchone()
-                        
-                        if log_entry and log_entry['usage_count'] == 0:
-                            update_reputation(
-                                user_id=user_id,
-                                change_type='first_2fa_verification',
-                                amount=10,
-                                description="首次成功完成2FA验证（使用备份码）"
-                            )
-                        
-                        if 'pending_github_info' in session:
-                            github_info = session.pop('pending_github_info')
-                            from services.reputation_service import handle_github_login
-                            handle_github_login(session['user_id'], github_info)
-                            flash('GitHub 账号已自动绑定！')
-                        flash('备份码验证成功！')
-                        return redirect(url_for('main.dashboard'))
+                        verified = 'backup_code'
                 except Exception as e:
                     from flask import current_app
                     current_app.logger.warning(f"Backup code decryption failed: {e}")
 
+        if verified is None:
             flash('无效的验证码或已过期')
             return redirect(url_for('auth.verify_2fa'))
 
+        # 首次验证奖励与 GitHub 绑定在上面的事务提交之后进行：二者各自开事务并锁住同一声望行，
+        # 嵌套在未提交的事务里会让第二个连接等待外层事务的行锁，线程永久挂起
+        # 检查是否是首次2FA验证，如果没有记录，说明是首次验证，给予声望奖励
+        if verified == 'totp':
+            check_first_2fa_verification(user_id)
+        else:
+            check_first_2fa_verification(user_id, description="首次成功完成2FA验证（使用备份码）")
+
+        if 'pending_github_info' in session:
+            github_info = session.pop('pending_github_info')
+            from services.reputation_service import handle_github_login
+            handle_github_login(session['user_id'], github_info)
+            flash('GitHub 账号已自动绑定！')
+        flash('2FA 验证成功！' if verified == 'totp' else '备份码验证成功！')
+        return redirect(url_for('main.dashboard'))
+
     except Exception as e:
         from flask import current_app
         current_app.logger.error(f"2FA verification error: {e}")
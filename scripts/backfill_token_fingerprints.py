@@ -0,0 +1,65 @@
+# scripts/backfill_token_fingerprints.py
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging
+
+from models.database import get_db_cursor
+import utils
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+if not logger.handlers:
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(levelname)s - %(message)s'))
+    logger.addHandler(handler)
+
+BATCH_SIZE = 500
+
+
+def backfill_token_fingerprints(batch_size=BATCH_SIZE):
+    """
+    为尚未有指纹的 game token 解密并写入 HMAC 指纹
+    按主键分批处理，每批一个事务，可重复执行
+    """
+    last_id = None
+    updated = 0
+    failed = 0
+
+    while True:
+        with get_db_cursor() as cursor:
+            cursor.execute("""
+                SELECT id, user_id, game_token, salt
+                FROM taUserGame
+                WHERE token_fingerprint IS NULL
+                  AND (%s::uuid IS NULL OR id > %s::uuid)
+                ORDER BY id
+                LIMIT %s
+            """, (last_id, last_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            for row in rows:
+                last_id = row['id']
+                try:
+                    token = utils.decrypt_data(row['game_token'], row['salt']).strip()
+                except Exception as e:
+                    logger.warning(f"无法解密 user_id={row['user_id']} 的 token，跳过: {e}")
+                    failed += 1
+                    continue
+
+                cursor.execute(
+                    "UPDATE taUserGame SET token_fingerprint = %s WHERE id = %s",
+                    (utils.fingerprint_token(token), row['id'])
+                )
+                updated += 1
+
+        logger.info(f"已回填 {updated} 条，失败 {failed} 条")
+
+    logger.info(f"回填完成：成功 {updated} 条，失败 {failed} 条")
+
+
+if __name__ == "__main__":
+    backfill_token_fingerprints()
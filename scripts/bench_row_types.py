@@ -0,0 +1,93 @@
+# scripts/bench_row_types.py
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import gc
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timezone
+
+import psycopg2.extras
+
+from models.database import compact_row_type
+
+# 与验证接口返回的列一致
+VERIFY_COLUMNS = (
+    'id', 'nickname', 'created_at', 'game_token', 'salt',
+    'token_fingerprint', 'reputation', 'is_banned',
+)
+
+
+def _sample_tuples(count):
+    now = datetime.now(timezone.utc)
+    token = os.urandom(120)
+    return [
+        (str(uuid.uuid4()), f"player{i}", now, token, os.urandom(16).hex(), os.urandom(32).hex(), i % 101, False)
+        for i in range(count)
+    ]
+
+
+def _build_dict_rows(columns, tuples):
+    # 与 RealDictCursor 的做法相同：每行一个 RealDictRow，逐列写入
+    rows = []
+    for values in tuples:
+        row = psycopg2.extras.RealDictRow()
+        for name, value in zip(columns, values):
+            row[name] = value
+        rows.append(row)
+    return rows
+
+
+def _build_compact_rows(columns, tuples):
+    row_type = compact_row_type(columns)
+    return [tuple.__new__(row_type, values) for values in tuples]
+
+
+def _measure(builder, columns, tuples):
+    """返回 (行对象额外占用的字节数, 构建耗时秒, 读取一列的耗时秒)"""
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    rows = builder(columns, tuples)
+    built = time.perf_counter() - started
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    for row in rows:
+        row['reputation']
+        row['is_banned']
+    read = time.perf_counter() - started
+    del rows
+    return current, built, read
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比 RealDictRow 与 CompactRow 的内存占用和构建/读取耗时")
+    parser.add_argument('--rows', type=int, default=100000, help="行数")
+    args = parser.parse_args()
+
+    tuples = _sample_tuples(args.rows)
+    compact_row_type(VERIFY_COLUMNS)  # 行类型只在第一次构建，不计入测量
+
+    results = {}
+    for label, builder in (('RealDictRow', _build_dict_rows), ('CompactRow', _build_compact_rows)):
+        results[label] = _measure(builder, VERIFY_COLUMNS, tuples)
+
+    print(f"{args.rows} 行 x {len(VERIFY_COLUMNS)} 列（不含列值本身的内存）")
+    for label, (size, built, read) in results.items():
+        print(
+            f"  {label:<12} {size / 1024 / 1024:8.2f} MiB  "
+            f"{size / args.rows:7.1f} B/行  构建 {built * 1000:8.1f} ms  读取 {read * 1000:7.1f} ms"
+        )
+    dict_size = results['RealDictRow'][0]
+    compact_size = results['CompactRow'][0]
+    if dict_size:
+        print(f"  节省 {(1 - compact_size / dict_size) * 100:.1f}% 的行对象内存")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# scripts/check_legacy_verify.py
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging
+import uuid
+
+from models.database import get_db_cursor
+from models.game_token import resolve_game_tokens, game_token_last_used
+from utils.security import generate_secure_token
+import utils
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+if not logger.handlers:
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(levelname)s - %(message)s'))
+    logger.addHandler(handler)
+
+
+# 对配置的数据库做一次冒烟检查：批量验证（/api/v1/auth/verify-game-tokens 所用的 resolve_game_tokens）
+# 命中尚未回填指纹的旧 token 时应返回该用户并补写指纹。
+# 分别在同步写入与写回缓冲（只读查找后再补写指纹）两种模式下运行，结束后删除临时用户。
+
+
+def _create_legacy_user():
+    """创建一个 token 指纹为空的临时用户，返回 (user_id, nickname, token)"""
+    user_id = str(uuid.uuid4())
+    nickname = f"legacy-check-{user_id[:8]}"
+    token = generate_secure_token()
+    encrypted_token, salt = utils.encrypt_data(token, None)
+    if len(salt) != 32:
+        salt = salt[:32].ljust(32, '0')
+    with get_db_cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO taUsers (id, username, nickname, password_hash)
+            VALUES (%s, %s, %s, %s)
+        """, (user_id, nickname, nickname, '!'))
+        cursor.execute("""
+            INSERT INTO taUserGame (user_id, game_token, salt, token_fingerprint)
+            VALUES (%s, %s, %s, NULL)
+        """, (user_id, encrypted_token, salt))
+    return user_id, nickname, token
+
+
+def _delete_user(user_id):
+    with get_db_cursor() as cursor:
+        cursor.execute("DELETE FROM taUsers WHERE id = %s", (user_id,))
+
+
+def _fingerprint_of(user_id):
+    with get_db_cursor() as cursor:
+        cursor.execute("SELECT token_fingerprint FROM taUserGame WHERE user_id = %s", (user_id,))
+        return cursor.fetchone()['token_fingerprint']
+
+
+def check(write_behind_interval) -> bool:
+    game_token_last_used.interval = write_behind_interval
+    mode = "写回缓冲" if game_token_last_used.enabled else "同步写入"
+    user_id, nickname, token = _create_legacy_user()
+    try:
+        results = resolve_game_tokens([
+            (token, nickname),
+            (generate_secure_token(), nickname),
+        ])
+        matched, nickname_exists = results[0]
+        unmatched, unmatched_nickname_exists = results[1]
+
+        problems = []
+        if not matched or str(matched['id']) != user_id or not nickname_exists:
+            problems.append(f"旧 token 未命中: {results[0]}")
+        if unmatched is not None or not unmatched_nickname_exists:
+            problems.append(f"错误 token 的结果不正确: {results[1]}")
+        if _fingerprint_of(user_id) != utils.fingerprint_token(token):
+            problems.append("指纹未回填")
+
+        for problem in problems:
+            logger.error(f"[{mode}] {problem}")
+        if not problems:
+            logger.info(f"[{mode}] 通过")
+        return not problems
+    finally:
+        _delete_user(user_id)
+
+
+if __name__ == "__main__":
+    interval = game_token_last_used.interval
+    try:
+        ok = all([check(0), check(max(interval, 60))])
+    finally:
+        game_token_last_used.interval = interval
+    sys.exit(0 if ok else 1)
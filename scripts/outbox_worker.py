@@ -0,0 +1,56 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import logging
+import time
+
+from config import Config
+from models import outbox
+import models.reputation  # noqa: F401  注册声望事件的处理函数
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+if not logger.handlers:
+    handler = logging.StreamHandler()
+    handler.setLevel(logging.DEBUG)
+
+    formatter = logging.Formatter(
+        '%(levelname)s - %(message)s'
+    )
+    handler.setFormatter(formatter)
+
+    logger.addHandler(handler)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="处理声望事件 outbox；可在多个节点上同时运行")
+    parser.add_argument('--batch-size', type=int, default=None, help="每批处理的事件数（默认 OUTBOX_BATCH_SIZE）")
+    parser.add_argument('--once', action='store_true', help="处理完当前积压后退出")
+    args = parser.parse_args()
+    batch_size = args.batch_size or Config.OUTBOX_BATCH_SIZE
+
+    backlog = outbox.get_outbox_backlog()
+    logger.info(f"outbox worker 启动 | 待处理 {backlog['pending']} | 已放弃 {backlog['failed']}")
+    try:
+        while True:
+            try:
+                stats = outbox.process_batch(logger, batch_size)
+            except Exception as e:
+                logger.error(f"outbox 批次处理失败: {e}")
+                if args.once:
+                    break
+                time.sleep(Config.OUTBOX_POLL_INTERVAL)
+                continue
+            if stats['claimed']:
+                logger.info(
+                    f"outbox 批次 | 取出 {stats['claimed']} | 完成 {stats['processed']} | "
+                    f"重试 {stats['retried']} | 放弃 {stats['failed']}"
+                )
+            # 取满一批说明还有积压，立即继续
+            if stats['claimed'] < batch_size:
+                if args.once:
+                    break
+                time.sleep(Config.OUTBOX_POLL_INTERVAL)
+    except KeyboardInterrupt:
+        logger.info("outbox worker 退出")
@@ -0,0 +1,36 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import logging
+
+from models.reputation_log import ensure_partitions, prune_partitions
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+if not logger.handlers:
+    handler = logging.StreamHandler()
+    handler.setLevel(logging.DEBUG)
+
+    formatter = logging.Formatter(
+        '%(levelname)s - %(message)s'
+    )
+    handler.setFormatter(formatter)
+
+    logger.addHandler(handler)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="提前创建声望日志的月分区，并分离删除超过保留期的旧分区")
+    parser.add_argument('--retention-months', type=int, default=None, help="保留的整月数，0 不清理（默认 REPUTATION_LOG_RETENTION_MONTHS）")
+    parser.add_argument('--premake-months', type=int, default=None, help="提前创建的未来月分区数（默认 REPUTATION_LOG_PREMAKE_MONTHS）")
+    parser.add_argument('--keep-detached', action='store_true', help="只分离不删除，便于先用 pg_dump 归档")
+    args = parser.parse_args()
+
+    try:
+        created = ensure_partitions(args.premake_months)
+        logger.info(f"新建声望日志分区 {created} 个")
+    except Exception as e:
+        # 建分区失败不影响清理旧分区
+        logger.error(f"创建声望日志分区失败: {e}")
+    prune_partitions(logger, retention_months=args.retention_months, drop=not args.keep_detached)
@@ -2,6 +2,7 @@ import sys
 import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import argparse
 import logging
 
 from models.reputation import process_pending_deletions
@@ -20,4 +21,9 @@ if not logger.handlers:
     logger.addHandler(handler)
 
 if __name__ == "__main__":
-    process_pending_deletions(logger)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="删除声望归零且已到期的用户；可在多个节点上同时运行")
+    parser.add_argument('--chunk-size', type=int, default=None, help="每批删除的用户数（默认 DELETION_CHUNK_SIZE）")
+    parser.add_argument('--time-budget', type=float, default=None, help="本次运行的时间预算，秒，0 不限（默认 DELETION_TIME_BUDGET）")
+    args = parser.parse_args()
+
+    process_pending_deletions(logger, chunk_size=args.chunk_size, time_budget=args.time_budget)
\ No newline at end of file
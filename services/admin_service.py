@@ -1,7 +1,14 @@
 from models.database import get_db_cursor
-from models.reputation import update_reputation, on_user_ban, cancel_deletion
+from models.game_token import invalidate_verification_cache, invalidate_verification_caches
+from models.leaderboard import record_score
+from models.reputation import update_reputation, on_user_ban, cancel_deletion, set_ban_state, bulk_adjust_reputation
 from services.reputation_service import handle_user_ban
-from utils.validators import validate_user_id
+from utils.validators import validate_user_id, validate_uuid
+from config import Config
+import csv
+import io
+import time
+import uuid
 
 def ban_user(admin_id, user_id_to_ban):
     validate_user_id(admin_id)
@@ -22,8 +29,11 @@ def ban_user(admin_id, user_id_to_ban):
             cursor=cursor
         )
         
+        set_ban_state(user_id_to_ban, True, cursor)
+        
         # 传入 cursor，确保在同一个事务中
         handle_user_ban(user_id_to_ban, cursor=cursor)
+        invalidate_verification_cache(user_id_to_ban, cursor)
 
 def unban_user(admin_id, user_id_to_unban):
     """
@@ -38,10 +48,13 @@ def unban_user(admin_id, user_id_to_unban):
         if not user:
             raise ValueError("用户不存在")
         
-        # 检查用户是否真的被封禁了（声望为0）
-        cursor.execute("SELECT score FROM taUsersReputation WHERE user_id = %s", (user_id_to_unban,))
+        # 检查用户是否真的被封禁了
+        cursor.execute(
+            "SELECT score, is_banned FROM taUsersReputation WHERE user_id = %s FOR UPDATE",
+            (user_id_to_unban,)
+        )
         reputation = cursor.fetchone()
-        if not reputation or reputation['score'] != 0:
+        if not reputation or not reputation['is_banned']:
             raise ValueError("该用户未被封禁")
         
         # 恢复声望到基础分数（例如50分）
@@ -50,9 +63,10 @@ def unban_user(admin_id, user_id_to_unban):
         
         cursor.execute("""
             UPDATE taUsersReputation
-            SET score = %s, last_updated = NOW()
+            SET score = %s, is_banned = FALSE, banned_at = NULL, last_updated = NOW()
             WHERE user_id = %s
         """, (base_score, user_id_to_unban))
+        record_score(cursor, user_id_to_unban, base_score)
         
         # 记录撤销封禁的日志
         cursor.execute("""
@@ -71,6 +85,7 @@ def unban_user(admin_id, user_id_to_unban):
         
         # 取消删除计划（如果存在）
         cancel_deletion(user_id_to_unban, cursor)
+        invalidate_verification_cache(user_id_to_unban, cursor)
 
 def toggle_admin_status(admin_id, user_id_to_toggle):
     """切换管理员权限"""
@@ -94,13 +109,14 @@ def get_all_users(page=1, per_page=20, search_query=None):
         page = 1
     offset = (page - 1) * per_page
     
-    with get_db_cursor() as cursor:
-        # 构建查询语句
+    with get_db_cursor(commit_on_success=False, compact=True) as cursor:
+        # 构建查询语句（封禁状态在同一查询中取出，行是只读的 CompactRow）
         base_query = """
             SELECT 
                 u.id, u.username, u.nickname, u.is_2fa_enabled, u.is_admin, u.created_at, u.updated_at, u.last_login,
                 r.score as reputation_score,
-                g.github_login
+                g.github_login,
+                COALESCE(r.is_banned, FALSE) AS is_banned
             FROM taUsers u
             LEFT JOIN taUsersReputation r ON u.id = r.user_id
             LEFT JOIN taUserGitHub g ON u.id = g.user_id
@@ -130,9 +146,60 @@ def get_all_users(page=1, per_page=20, search_query=None):
         cursor.execute(count_query, count_params)
         total = cursor.fetchone()['total']
         
-        # 对每个用户检查是否被封禁
-        from models.reputation import is_user_banned
-        for user in users:
-            user['is_banned'] = is_user_banned(user['id'])
-        
         return users, total
+
+
+def parse_reputation_adjustments(text):
+    """
+    解析批量调整的 CSV：每行 user_id,amount,reason（reason 可省略），首行可以是表头
+    :return: [(user_id, amount, reason), ...]
+    :raises ValueError: 格式错误、分数越界、user_id 重复或超过 BULK_ADJUST_MAX_ROWS（消息中带行号）
+    """
+    adjustments = []
+    seen = {}
+    for line_no, row in enumerate(csv.reader(io.StringIO(text)), start=1):
+        if not row or not any(field.strip() for field in row):
+            continue
+        if line_no == 1 and row[0].strip().lower() == 'user_id':
+            continue
+        if len(row) < 2:
+            raise ValueError(f"第 {line_no} 行格式错误，应为 user_id,amount,reason")
+
+        user_id = row[0].strip()
+        if not validate_uuid(user_id):
+            raise ValueError(f"第 {line_no} 行的 user_id 无效: {user_id}")
+        user_id = str(uuid.UUID(user_id))
+        try:
+            amount = int(row[1].strip())
+        except ValueError:
+            raise ValueError(f"第 {line_no} 行的 amount 不是整数: {row[1].strip()}")
+        if amount == 0 or not -100 <= amount <= 100:
+            raise ValueError(f"第 {line_no} 行的 amount 必须在 -100~100 之间且不为 0")
+        if user_id in seen:
+            raise ValueError(f"第 {line_no} 行的用户与第 {seen[user_id]} 行重复: {user_id}")
+        seen[user_id] = line_no
+
+        reason = ",".join(row[2:]).strip()[:500]
+        adjustments.append((user_id, amount, reason))
+        if len(adjustments) > Config.BULK_ADJUST_MAX_ROWS:
+            raise ValueError(f"单次最多调整 {Config.BULK_ADJUST_MAX_ROWS} 个用户")
+
+    if not adjustments:
+        raise ValueError("没有需要调整的数据")
+    return adjustments
+
+
+def bulk_adjust_users(admin_id, adjustments):
+    """
+    批量调整声望（change_type 为 manual_adjust），全部在一个事务中，任一用户不存在则整体不生效
+    :return: bulk_adjust_reputation 的统计，外加耗时 elapsed_ms
+    """
+    validate_user_id(admin_id)
+    started = time.perf_counter()
+
+    with get_db_cursor() as cursor:
+        stats = bulk_adjust_reputation(cursor, adjustments, related_user_id=admin_id)
+        invalidate_verification_caches([user_id for user_id, _, _ in adjustments], cursor)
+
+    stats['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return stats
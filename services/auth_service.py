@@ -6,13 +6,14 @@ from models.user import (
     update_totp_last_used,
     get_user_by_id
 )
-from models.reputation import update_reputation
+from models.reputation import update_reputation, has_first_2fa_reward
 from utils.security import check_password
 from utils.security import generate_secure_token
 from utils.validators import validate_user_id
 import pyotp
 import utils
 from models.database import get_db_cursor
+from models.game_token import invalidate_verification_cache, touch_game_token
 import logging
 
 
@@ -103,23 +104,29 @@ def process_backup_code_verification(user_id, token, session):
     return False
 
 
-def check_first_2fa_verification(user_id):
-    """检查是否为首次成功完成 2FA（包括 TOTP 或备份码）"""
-    with get_db_cursor() as cursor:
-        cursor.execute("""
-            SELECT COUNT(*) AS usage_count 
-            FROM taUsersReputationLogs 
-            WHERE user_id = %s AND change_type = 'first_2fa_verification'
-        """, (user_id,))
-        log_entry = cursor.fetchone()
+def check_first_2fa_verification(user_id, description="首次成功完成2FA验证", cursor=None):
+    """
+    检查是否为首次成功完成 2FA（包括 TOTP 或备份码），是则发放奖励
+    在主库事务中先锁住声望行再判断，并发的验证请求不会重复发放
+    cursor: 可选，用于在现有事务中执行
+    """
+    if cursor:
+        _grant_first_2fa_reward(cursor, user_id, description)
+    else:
+        with get_db_cursor() as new_cursor:
+            _grant_first_2fa_reward(new_cursor, user_id, description)
+
 
-        if log_entry and log_entry['usage_count'] == 0:
-            update_reputation(
-                user_id=user_id,
-                change_type='first_2fa_verification',
-                amount=10,
-                description="首次成功完成2FA验证"
-            )
+def _grant_first_2fa_reward(cursor, user_id, description):
+    cursor.execute("SELECT 1 FROM taUsersReputation WHERE user_id = %s FOR UPDATE", (user_id,))
+    if not has_first_2fa_reward(user_id, cursor):
+        update_reputation(
+            user_id=user_id,
+            change_type='first_2fa_verification',
+            amount=10,
+            description=description,
+            cursor=cursor
+        )
 
 
 # ======================
@@ -142,16 +149,18 @@ def create_or_update_game_token(user_id):
     try:
         with get_db_cursor() as cursor:
             cursor.execute("""
-                INSERT INTO taUserGame (user_id, game_token, salt)
-                VALUES (%s, %s, %s)
+                INSERT INTO taUserGame (user_id, game_token, salt, token_fingerprint)
+                VALUES (%s, %s, %s, %s)
                 ON CONFLICT (user_id)
-                DO UPDATE SET game_token = EXCLUDED.game_token, salt = EXCLUDED.salt, updated_at = NOW()
+                DO UPDATE SET game_token = EXCLUDED.game_token, salt = EXCLUDED.salt,
+                              token_fingerprint = EXCLUDED.token_fingerprint, updated_at = NOW()
                 RETURNING id
-            """, (user_id, encrypted_token, salt))
+            """, (user_id, encrypted_token, salt, utils.fingerprint_token(token_plaintext)))
 
             result = cursor.fetchone()
             if not result:
                 raise Exception("Failed to insert or update game token")
+            invalidate_verification_cache(user_id, cursor)
 
         current_app.logger.info(f"Game token generated for user_id={user_id}")
         return token_plaintext
@@ -164,29 +173,26 @@ def create_or_update_game_token(user_id):
 def authenticate_with_game_token(token):
     """
     使用 game token 认证用户
-    解密所有 token 并比对（安全做法）
+    只按 HMAC 指纹走索引查找：没有昵称可以缩小候选范围，对全部未回填指纹的旧 token 逐个解密代价过高，
+    因此旧 token 需先经 scripts/backfill_token_fingerprints.py 回填后才能用于此入口
     返回用户信息或 None
     """
     if not token or len(token) < 32:
         return None
 
+    fingerprint = utils.fingerprint_token(token)
+    matched_user_id = None
+
     with get_db_cursor() as cursor:
         cursor.execute("""
-            SELECT user_id, game_token, backup_codes_salt AS salt
+            SELECT user_id
             FROM taUserGame
-            WHERE created_at > NOW() - INTERVAL '90 days'  -- 可选过期策略
-        """)
-        records = cursor.fetchall()
-
-    matched_user_id = None
-    for record in records:
-        try:
-            decrypted = utils.decrypt_data(record['game_token'], record['salt'])
-            if decrypted == token:
-                matched_user_id = record['user_id']
-                break
-        except Exception as e:
-            logging.warning(f"Failed to decrypt game token for user_id={record['user_id']}: {e}")
+            WHERE token_fingerprint = %s
+              AND created_at > NOW() - INTERVAL '90 days'  -- 可选过期策略
+        """, (fingerprint,))
+        row = cursor.fetchone()
+        if row:
+            matched_user_id = row['user_id']
 
     if not matched_user_id:
         return None
@@ -205,12 +211,7 @@ def authenticate_with_game_token(token):
 
 def _update_game_token_last_used(user_id):
     """更新 token 的 last_used_at 时间"""
-    with get_db_cursor() as cursor:
-        cursor.execute("""
-            UPDATE taUserGame
-            SET last_used_at = NOW()
-            WHERE user_id = %s
-        """, (user_id,))
+    touch_game_token(user_id)
 
 
 def refresh_game_token(user_id):
@@ -223,13 +224,14 @@ def revoke_game_token(user_id):
     validate_user_id(user_id)
     with get_db_cursor() as cursor:
         cursor.execute("DELETE FROM taUserGame WHERE user_id = %s", (user_id,))
+        invalidate_verification_cache(user_id, cursor)
     logging.info(f"Game token revoked for user_id: {user_id}")
 
 
 def get_game_token_info(user_id):
     """获取 token 元信息（用于前端显示）"""
     validate_user_id(user_id)
-    with get_db_cursor() as cursor:
+    with get_db_cursor(commit_on_success=False) as cursor:
         cursor.execute("""
             SELECT created_at, updated_at, last_used_at
             FROM taUserGame
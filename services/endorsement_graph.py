@@ -0,0 +1,283 @@
+# services/endorsement_graph.py
+from models.database import get_db_cursor, with_db_retry, TRANSACTION_HORIZON_SQL
+from config import Config
+from array import array
+from collections import deque
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# ==============================
+# 验证关系图
+# ==============================
+# taCreditEndorsements 中有效的验证构成一张有向图（验证者 -> 被验证者）。
+# 进程内用整数编号的节点与 array('i') 邻接表保存，回答“封禁某人会影响谁”、链深度、扇出等问题不再访问数据库。
+# 至多每 ENDORSEMENT_GRAPH_REFRESH_INTERVAL 秒增量拉取一次新增/作废的验证；用户被删除时验证行级联删除，
+# 无法增量感知，因此每 ENDORSEMENT_GRAPH_RELOAD_INTERVAL 秒整表重建一次。
+# 除进程内首次加载外，增量拉取与整表重建都在后台线程中进行，期间查询继续使用旧图。
+# 水位线与排行榜相同，取主库上未结束事务中最早的开始时间（见 TRANSACTION_HORIZON_SQL），
+# created_at / invalidated_at 都是写入事务的 NOW()，晚提交的长事务不会被漏掉；拉取因此也在主库上进行。
+# 图只用于展示与预估，封禁、验证本身仍以数据库中的行为准。
+
+
+class EndorsementGraph:
+    """验证关系的邻接表：节点为用户在本图中的编号，出边指向被验证者，入边指向验证者"""
+
+    def __init__(self):
+        self._index = {}    # user_id -> 节点编号
+        self._ids = []      # 节点编号 -> user_id
+        self._out = []      # 节点编号 -> array('i') 被验证者
+        self._in = []       # 节点编号 -> array('i') 验证者
+        self.edge_count = 0
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _node(self, user_id) -> int:
+        user_id = str(user_id)
+        node = self._index.get(user_id)
+        if node is None:
+            node = len(self._ids)
+            self._index[user_id] = node
+            self._ids.append(user_id)
+            self._out.append(array('i'))
+            self._in.append(array('i'))
+        return node
+
+    def add_edge(self, endorser_id, endorsee_id) -> bool:
+        src, dst = self._node(endorser_id), self._node(endorsee_id)
+        if dst in self._out[src]:
+            return False
+        self._out[src].append(dst)
+        self._in[dst].append(src)
+        self.edge_count += 1
+        return True
+
+    def remove_edge(self, endorser_id, endorsee_id) -> bool:
+        src = self._index.get(str(endorser_id))
+        dst = self._index.get(str(endorsee_id))
+        if src is None or dst is None or dst not in self._out[src]:
+            return False
+        self._out[src].remove(dst)
+        self._in[dst].remove(src)
+        self.edge_count -= 1
+        return True
+
+    def endorsees(self, user_id) -> list:
+        node = self._index.get(str(user_id))
+        return [] if node is None else [self._ids[n] for n in self._out[node]]
+
+    def endorsers(self, user_id) -> list:
+        node = self._index.get(str(user_id))
+        return [] if node is None else [self._ids[n] for n in self._in[node]]
+
+    def fan_out(self, user_id) -> int:
+        node = self._index.get(str(user_id))
+        return 0 if node is None else len(self._out[node])
+
+    def _bfs(self, node, edges):
+        """从 node 出发按层遍历，返回 [(节点, 深度)]（不含起点）"""
+        seen = {node}
+        queue = deque([(node, 0)])
+        reached = []
+        while queue:
+            current, depth = queue.popleft()
+            for nxt in edges[current]:
+                if nxt not in seen:
+                    seen.add(nxt)
+                    reached.append((nxt, depth + 1))
+                    queue.append((nxt, depth + 1))
+        return reached
+
+    def downstream(self, user_id) -> list:
+        """该用户直接或间接验证过的所有用户：[(user_id, 深度)]，按深度升序"""
+        node = self._index.get(str(user_id))
+        if node is None:
+            return []
+        return [(self._ids[n], depth) for n, depth in self._bfs(node, self._out)]
+
+    def chain_depth(self, user_id) -> int:
+        """向上追溯验证链的长度（未被任何人验证的用户为 0）"""
+        node = self._index.get(str(user_id))
+        if node is None:
+            return 0
+        reached = self._bfs(node, self._in)
+        return max((depth for _, depth in reached), default=0)
+
+    def blast_radius(self, user_id) -> dict:
+        """
+        封禁该用户的影响范围
+        direct: 其验证会被作废、各扣 30 声望的用户；downstream: 通过验证链间接依赖该用户的用户数；
+        max_depth: 下游链的最大深度
+        """
+        reached = self.downstream(user_id)
+        return {
+            'direct': [uid for uid, depth in reached if depth == 1],
+            'downstream': len(reached),
+            'max_depth': max((depth for _, depth in reached), default=0),
+            'chain_depth': self.chain_depth(user_id),
+        }
+
+
+_graph = None
+_graph_pid = None
+_watermark = None       # 下次增量拉取的起点，见 TRANSACTION_HORIZON_SQL
+_loaded_at = 0.0
+_refreshed_at = 0.0
+# 刷新（访问数据库）与读写图结构分用两把锁：遍历与增量修改互斥，刷新期间的查询不被阻塞
+_graph_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # fork 时后台刷新线程可能正持有锁，子进程中重新创建
+    global _graph_lock, _refresh_lock
+    _graph_lock = threading.Lock()
+    _refresh_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+@with_db_retry
+def _load_graph():
+    global _graph, _graph_pid, _watermark, _loaded_at, _refreshed_at
+    graph = EndorsementGraph()
+    with get_db_cursor(compact=True) as cursor:
+        cursor.execute(TRANSACTION_HORIZON_SQL)
+        watermark = cursor.fetchone()['horizon']
+        cursor.execute("SELECT endorser_id, endorsee_id FROM taCreditEndorsements WHERE is_valid = TRUE")
+        for row in cursor.fetchall():
+            graph.add_edge(row['endorser_id'], row['endorsee_id'])
+
+    with _graph_lock:
+        _graph, _graph_pid, _watermark = graph, os.getpid(), watermark
+    _loaded_at = _refreshed_at = time.monotonic()
+    logger.info(f"Endorsement graph loaded: {len(graph)} users, {graph.edge_count} endorsements")
+
+
+@with_db_retry
+def _refresh_graph():
+    """拉取水位线之后新增或作废的验证；重复应用是幂等的"""
+    global _watermark, _refreshed_at
+    with get_db_cursor(compact=True) as cursor:
+        cursor.execute(TRANSACTION_HORIZON_SQL)
+        watermark = cursor.fetchone()['horizon']
+        cursor.execute("""
+            SELECT endorser_id, endorsee_id, is_valid
+            FROM taCreditEndorsements
+            WHERE created_at >= %s OR invalidated_at >= %s
+        """, (_watermark, _watermark))
+        rows = cursor.fetchall()
+
+    with _graph_lock:
+        for row in rows:
+            if row['is_valid']:
+                _graph.add_edge(row['endorser_id'], row['endorsee_id'])
+            else:
+                _graph.remove_edge(row['endorser_id'], row['endorsee_id'])
+    _watermark = watermark
+    _refreshed_at = time.monotonic()
+
+
+def _is_fresh() -> bool:
+    return (
+        _graph is not None
+        and _graph_pid == os.getpid()
+        and time.monotonic() - _refreshed_at < Config.ENDORSEMENT_GRAPH_REFRESH_INTERVAL
+    )
+
+
+def _refresh_in_background():
+    global _refreshed_at
+    try:
+        if _is_fresh():
+            return
+        if time.monotonic() - _loaded_at >= Config.ENDORSEMENT_GRAPH_RELOAD_INTERVAL:
+            _load_graph()
+        else:
+            _refresh_graph()
+    except Exception as e:
+        # 数据库暂不可用时继续使用旧图，一个刷新间隔后再试
+        _refreshed_at = time.monotonic()
+        logger.error(f"Endorsement graph refresh failed, serving stale graph: {e}")
+    finally:
+        _refresh_lock.release()
+
+
+def _ensure_graph():
+    """保证本进程有一张验证关系图，过期时在后台刷新；读取图须在 _graph_lock 内进行"""
+    if _is_fresh():
+        return
+
+    if _graph is None or _graph_pid != os.getpid():
+        # 本进程还没有图：只能同步加载
+        with _refresh_lock:
+            if _graph is None or _graph_pid != os.getpid():
+                _load_graph()
+        return
+
+    # 已有图：在后台刷新，本次直接使用旧图；已有刷新在进行时不重复启动
+    if not _refresh_lock.acquire(blocking=False):
+        return
+    try:
+        threading.Thread(target=_refresh_in_background, name="endorsement-graph-refresh", daemon=True).start()
+    except Exception:
+        _refresh_lock.release()
+        raise
+
+
+def preview_ban(user_id) -> dict:
+    """
+    封禁前的影响预估：按当前声望计算直接受影响用户被扣分后的分数，以及是否会因归零进入待删除队列
+    与 ban_user / on_user_ban 的规则一致：被封禁者 -100，其验证过的用户各 -30
+    """
+    _ensure_graph()
+    with _graph_lock:
+        graph = _graph
+        radius = graph.blast_radius(user_id)
+        fan_out = {uid: graph.fan_out(uid) for uid in [str(user_id)] + radius['direct']}
+        graph_users, graph_edges = len(graph), graph.edge_count
+    user_ids = [str(user_id)] + radius['direct']
+
+    with get_db_cursor(commit_on_success=False, compact=True) as cursor:
+        cursor.execute("""
+            SELECT u.id, u.username, u.nickname, COALESCE(r.score, 0) AS score
+            FROM taUsers u
+            LEFT JOIN taUsersReputation r ON r.user_id = u.id
+            WHERE u.id = ANY(%s::uuid[])
+        """, (user_ids,))
+        users = {str(row['id']): row for row in cursor.fetchall()}
+
+    affected = []
+    for endorsee_id in radius['direct']:
+        row = users.get(endorsee_id)
+        if row is None:
+            continue
+        new_score = max(0, row['score'] - 30)
+        affected.append({
+            'user_id': endorsee_id,
+            'username': row['username'],
+            'nickname': row['nickname'],
+            'score': row['score'],
+            'new_score': new_score,
+            'will_be_deleted': new_score == 0,
+            'fan_out': fan_out[endorsee_id],
+        })
+    affected.sort(key=lambda a: (a['new_score'], a['username'] or ''))
+
+    return {
+        'user': users.get(str(user_id)),
+        'affected': affected,
+        'deletions': sum(1 for a in affected if a['will_be_deleted']),
+        'fan_out': fan_out[str(user_id)],
+        'downstream': radius['downstream'],
+        'max_depth': radius['max_depth'],
+        'chain_depth': radius['chain_depth'],
+        'graph_users': graph_users,
+        'graph_edges': graph_edges,
+    }
@@ -0,0 +1,87 @@
+# services/metrics_service.py
+from models.database import get_all_pool_stats
+from models.game_token import get_verify_cache_stats
+from models.statements import get_statement_stats
+from models.write_behind import get_write_behind_stats
+from utils.metrics import register_collector, generate_latest
+from utils.security import get_key_cache_stats
+
+
+def _cache_metrics(cache_name, stats):
+    if stats is None:
+        return []
+    labels = {'cache': cache_name}
+    return [
+        ('teealloy_cache_hits_total', 'counter', 'In-process cache hits',
+         [(labels, stats['hits'])]),
+        ('teealloy_cache_misses_total', 'counter', 'In-process cache misses',
+         [(labels, stats['misses'])]),
+        ('teealloy_cache_evictions_total', 'counter', 'In-process cache evictions',
+         [(labels, stats['evictions'])]),
+        ('teealloy_cache_entries', 'gauge', 'In-process cache size',
+         [(labels, stats['size'])]),
+    ]
+
+
+@register_collector
+def collect_pool_metrics():
+    """主库与各副本连接池的当前状态与累计计数"""
+    pools = get_all_pool_stats()
+    gauges = [
+        ('teealloy_db_pool_size', 'Open connections (idle + in use)', 'size'),
+        ('teealloy_db_pool_idle', 'Idle connections', 'idle'),
+        ('teealloy_db_pool_in_use', 'Connections checked out', 'in_use'),
+        ('teealloy_db_pool_waiting', 'Callers waiting for a connection', 'waiting'),
+        ('teealloy_db_pool_max', 'Configured DB_MAX_CONN', 'maxconn'),
+    ]
+    counters = [
+        ('teealloy_db_pool_connections_created_total', 'Connections opened', 'created_total'),
+        ('teealloy_db_pool_connections_closed_total', 'Connections closed', 'closed_total'),
+        ('teealloy_db_pool_checkouts_total', 'Successful checkouts', 'checkouts_total'),
+        ('teealloy_db_pool_timeouts_total', 'Checkouts that timed out waiting (pool exhausted)', 'timeouts_total'),
+    ]
+    return (
+        [(name, 'gauge', doc, [({'pool': s['name']}, s[key]) for s in pools]) for name, doc, key in gauges]
+        + [(name, 'counter', doc, [({'pool': s['name']}, s[key]) for s in pools]) for name, doc, key in counters]
+    )
+
+
+@register_collector
+def collect_statement_metrics():
+    """每条命名查询的 PREPARE 次数（调用次数见 duration 直方图的 _count）"""
+    stats = get_statement_stats()
+    return [(
+        'teealloy_db_statement_prepares_total', 'counter', 'PREPAREs issued per named query',
+        [({'statement': name}, s['prepares']) for name, s in stats.items()],
+    )]
+
+
+@register_collector
+def collect_cache_metrics():
+    """派生密钥缓存与验证结果缓存"""
+    return _cache_metrics('fernet_key', get_key_cache_stats()) + _cache_metrics('verify', get_verify_cache_stats())
+
+
+@register_collector
+def collect_write_behind_metrics():
+    """写回缓冲积压与刷新情况"""
+    stats = get_write_behind_stats()
+    return [
+        ('teealloy_write_behind_backlog', 'gauge', 'Keys waiting to be flushed',
+         [({'buffer': name}, s['backlog']) for name, s in stats.items()]),
+        ('teealloy_write_behind_flushes_total', 'counter', 'Successful flushes',
+         [({'buffer': name}, s['flush_count']) for name, s in stats.items()]),
+        ('teealloy_write_behind_flush_failures_total', 'counter', 'Failed flushes',
+         [({'buffer': name}, s['flush_failures']) for name, s in stats.items()]),
+        ('teealloy_write_behind_flushed_rows_total', 'counter', 'Rows written by flushes',
+         [({'buffer': name}, s['flushed_rows']) for name, s in stats.items()]),
+        ('teealloy_write_behind_dropped_total', 'counter', 'Touches dropped because the buffer was full',
+         [({'buffer': name}, s['dropped']) for name, s in stats.items()]),
+        ('teealloy_write_behind_flush_seconds_total', 'counter', 'Total time spent flushing',
+         [({'buffer': name}, s['total_flush_seconds']) for name, s in stats.items()]),
+    ]
+
+
+def render_metrics() -> str:
+    """Prometheus 文本格式的全部指标（当前 worker 进程）"""
+    return generate_latest()
@@ -1,4 +1,4 @@
-from models.reputation import update_reputation, on_github_login, endorse_user, on_user_ban, make_full_reputation
+from models.reputation import update_reputation, on_github_login, endorse_user, on_user_ban, make_full_reputation, schedule_ban_cascade
 from utils.validators import validate_user_id
 
 def handle_github_login(user_id, github_info):
@@ -14,5 +14,5 @@ def handle_user_endorsement(endorser_id, endorsee_id):
 def handle_user_ban(banned_user_id, cursor):
     """处理用户封禁"""
     validate_user_id(banned_user_id)
-    on_user_ban(banned_user_id, cursor=cursor)
+    schedule_ban_cascade(banned_user_id, cursor)
 
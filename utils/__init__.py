@@ -7,12 +7,13 @@ from .github import (
 )
 
 from .validators import validate_uuid, validate_user_id
-from .security import hash_password, check_password, generate_totp_secret, get_totp_uri, make_qr_code_image, encrypt_data, decrypt_data, get_fernet, generate_api_key, hash_api_key
+from .security import hash_password, check_password, generate_totp_secret, get_totp_uri, make_qr_code_image, encrypt_data, decrypt_data, get_fernet, generate_api_key, hash_api_key, fingerprint_token
 
 
 __all__ = [
     'encrypt_data',
     'decrypt_data',
+    'fingerprint_token',
     'generate_totp_secret',
     'get_totp_uri',
     'make_qr_code_image',
@@ -0,0 +1,142 @@
+# utils/metrics.py
+import math
+import threading
+
+# ==============================
+# 进程内指标（Prometheus 文本格式）
+# ==============================
+# 只实现本项目用到的 Counter / Histogram，不依赖 prometheus_client。
+# 指标按 gunicorn worker 各自累计，由 Prometheus 按实例汇总。
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_metrics = []
+_collectors = []
+_registry_lock = threading.Lock()
+
+
+def _format_value(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _metrics.append(self)
+
+    def _key(self, labels) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in items]
+
+
+class Histogram(_Metric):
+    """累积分桶直方图，带 _sum 与 _count"""
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._values = {}  # key -> [bucket counts..., sum]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        result = []
+        for key, state in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                result.append((f"{self.name}_bucket", {**labels, 'le': _format_value(float(bound))}, cumulative))
+            result.append((f"{self.name}_sum", labels, state[-1]))
+            result.append((f"{self.name}_count", labels, cumulative))
+        return result
+
+
+def register_collector(func):
+    """
+    注册一个在导出时调用的采集函数，用于把已有的 stats() 字典转成指标
+    func() 返回 [(name, type, documentation, [(labels, value), ...]), ...]
+    """
+    with _registry_lock:
+        _collectors.append(func)
+    return func
+
+
+def generate_latest() -> str:
+    """导出全部指标"""
+    lines = []
+
+    def emit(name, type_, documentation, samples):
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} {type_}")
+        for sample_name, labels, value in samples:
+            lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+
+    with _registry_lock:
+        metrics = list(_metrics)
+        collectors = list(_collectors)
+
+    for metric in metrics:
+        emit(metric.name, metric.type, metric.documentation, metric.samples())
+
+    for collector in collectors:
+        for name, type_, documentation, samples in collector():
+            emit(name, type_, documentation, [(name, labels, value) for labels, value in samples])
+
+    return "\n".join(lines) + "\n"
@@ -12,6 +12,8 @@ import os
 import secrets
 import string
 import hashlib
+import hmac
+from .cache import TTLCache
 
 def hash_password(password: str) -> str:
     salt = bcrypt.gensalt()
@@ -38,10 +40,49 @@ def derive_key_from_password(password: str, salt: str) -> bytes:
     key = base64.urlsafe_b64encode(kdf.derive(password.encode()))
     return key
 
+# === 派生密钥缓存（可选） ===
+# PBKDF2 每次派生需数十毫秒；FERNET_KEY_CACHE_SIZE > 0 时按 salt 缓存派生结果。
+# 缓存键包含 FERNET_KEY 摘要，密钥轮换后旧条目不会再命中，并在检测到变化时整体清空。
+_KEY_CACHE_SIZE = int(os.environ.get("FERNET_KEY_CACHE_SIZE", 0))
+_KEY_CACHE_TTL = float(os.environ.get("FERNET_KEY_CACHE_TTL", 300))
+_key_cache = TTLCache(_KEY_CACHE_SIZE, _KEY_CACHE_TTL) if _KEY_CACHE_SIZE > 0 else None
+_key_cache_owner = None
+
+
+def _get_derived_key(salt: str) -> bytes:
+    """获取 salt 对应的派生密钥，启用缓存时优先读缓存"""
+    global _key_cache_owner
+    password = os.environ.get("FERNET_KEY", "")
+    if _key_cache is None:
+        return derive_key_from_password(password, salt)
+
+    owner = hashlib.sha256(password.encode()).digest()
+    if owner != _key_cache_owner:
+        _key_cache.clear()
+        _key_cache_owner = owner
+
+    cache_key = (owner, salt)
+    key = _key_cache.get(cache_key)
+    if key is None:
+        key = derive_key_from_password(password, salt)
+        _key_cache.set(cache_key, key)
+    return key
+
+
+def get_key_cache_stats() -> dict | None:
+    """派生密钥缓存统计（hits/misses/evictions/size），未启用时返回 None"""
+    return _key_cache.stats() if _key_cache is not None else None
+
+
+def clear_key_cache():
+    """清空派生密钥缓存（例如轮换 FERNET_KEY 后）"""
+    if _key_cache is not None:
+        _key_cache.clear()
+
 def encrypt_data(data: str, key_salt: str = None) -> tuple[bytes, str]:
     """加密字符串数据，返回 (ciphertext_bytes, salt_used)"""
     salt = key_salt or os.urandom(16).hex()
-    key = derive_key_from_password(os.environ.get("FERNET_KEY", ""), salt)
+    key = _get_derived_key(salt)
     f = Fernet(key)
     encrypted = f.encrypt(data.encode('utf-8'))
     return (encrypted, salt)
@@ -50,11 +91,22 @@ def decrypt_data(data: bytes, salt: str) -> str:
     """用 salt 解密数据"""
     if isinstance(data, memoryview):
         data = data.tobytes()
-    key = derive_key_from_password(os.environ.get("FERNET_KEY", ""), salt)
+    key = _get_derived_key(salt)
     f = Fernet(key)
     decrypted = f.decrypt(data)
     return decrypted.decode('utf-8')
 
+def fingerprint_token(token: str) -> str:
+    """
+    计算 game token 的 HMAC-SHA256 指纹（64 位 hex），用于索引查找而无需解密
+    HMAC 密钥由 FERNET_KEY 派生，轮换 FERNET_KEY 后旧 token 本身也无法解密
+    """
+    key = os.environ.get("FERNET_KEY")
+    if not key:
+        raise RuntimeError("FERNET_KEY 环境变量未设置")
+    fingerprint_key = hmac.new(key.encode(), b"teealloy-game-token-fingerprint", hashlib.sha256).digest()
+    return hmac.new(fingerprint_key, token.encode('utf-8'), hashlib.sha256).hexdigest()
+
 def generate_totp_secret() -> str:
     """生成 TOTP 密钥（base32 编码）"""
     return pyotp.random_base32()